@@ -0,0 +1,316 @@
+import argparse
+import getpass
+import requests
+from datetime import datetime
+from rich.console import Console
+from rich.panel import Panel
+from rich.text import Text
+
+from chat_tags import canonicalize_tags
+from config import load_config
+
+# Helpers for the ws4sqlite chat_history store, plus the schema migrations
+# that add the normalised tag index and per-user partitioning:
+#
+#   tags(id, name UNIQUE)                 -- tag dictionary
+#   chat_tags(chat_id, tag_id)            -- join table, PK (chat_id, tag_id)
+#   idx_chat_tags_tag ON (tag_id, chat_id) -- inverted index: tag -> chats
+#
+#   chat_history/chat_tags + (workspace, user_id[, session_id])
+#   idx_chat_history_owner_date ON chat_history (workspace, user_id, date, time)
+#   idx_chat_tags_owner_tag ON chat_tags (workspace, user_id, tag_id, chat_id)
+
+def history_server(conf):
+    """Return (server_url, (auth_user, auth_pass)) for the chat history store."""
+    server_url = conf['chat_history_server_url']
+    auth_user = conf['chat_history_server_auth_user']
+    auth_pass = conf['chat_history_server_auth_pass']
+    return server_url, (auth_user, auth_pass)
+
+def history_owner(conf):
+    """Return {"workspace", "user_id"} identifying this instance's partition."""
+    return {
+        "workspace": conf['history_workspace'],
+        "user_id": conf['history_user'] or getpass.getuser(),
+    }
+
+def post_transaction(conf, transaction, timeout=10):
+    """POST a ws4sqlite transaction and return the decoded JSON response."""
+    server_url, auth = history_server(conf)
+    r = requests.post(
+        server_url,
+        json={"transaction": transaction},
+        auth=auth,
+        headers={"Content-Type": "application/json"},
+        timeout=timeout,
+    )
+    r.raise_for_status()
+    return r.json()
+
+def result_rows(data):
+    """Flatten a ws4sqlite response into a list of row dicts.
+
+    Handles the columns/rows shape, the resultHeaders + list resultSet shape,
+    and the default resultSet-of-objects shape.
+    """
+    if isinstance(data, dict) and 'results' in data:
+        data_iter = data.get('results') or []
+    else:
+        data_iter = data if isinstance(data, list) else [data]
+
+    rows_out = []
+    for item in data_iter:
+        if not isinstance(item, dict):
+            continue
+        if 'columns' in item and 'rows' in item:
+            columns = item.get('columns') or []
+            rows_out.extend(dict(zip(columns, row)) for row in item.get('rows') or [])
+        elif 'resultSet' in item:
+            headers = item.get('resultHeaders')
+            for row in item.get('resultSet') or []:
+                if isinstance(row, dict):
+                    rows_out.append(row)
+                elif headers:
+                    rows_out.append(dict(zip(headers, row)))
+    return rows_out
+
+TAG_INDEX_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS chat_tags (chat_id INTEGER NOT NULL, tag_id INTEGER NOT NULL, PRIMARY KEY (chat_id, tag_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS idx_chat_tags_tag ON chat_tags (tag_id, chat_id)",
+]
+
+# Statements used with valuesBatch to link one chat row to its tags
+INSERT_TAG_SQL = "INSERT OR IGNORE INTO tags (name) VALUES (:name)"
+LINK_TAG_SQL = "INSERT OR IGNORE INTO chat_tags (chat_id, tag_id) SELECT :chat_id, id FROM tags WHERE name = :name"
+LINK_LATEST_CHAT_TAG_SQL = "INSERT OR IGNORE INTO chat_tags (chat_id, tag_id) SELECT (SELECT MAX(id) FROM chat_history), id FROM tags WHERE name = :name"
+# Same, once migration 2 has added the owner columns to chat_tags
+LINK_OWNED_TAG_SQL = "INSERT OR IGNORE INTO chat_tags (chat_id, tag_id, workspace, user_id) SELECT :chat_id, id, :workspace, :user_id FROM tags WHERE name = :name"
+LINK_LATEST_OWNED_CHAT_TAG_SQL = "INSERT OR IGNORE INTO chat_tags (chat_id, tag_id, workspace, user_id) SELECT (SELECT MAX(id) FROM chat_history), id, :workspace, :user_id FROM tags WHERE name = :name"
+
+def tag_link_statements(tags, chat_id=None, owner=None):
+    """Build the batched statements that add `tags` to the dictionary and link them.
+
+    With chat_id=None the tags are linked to the newest chat_history row, for
+    use in the same transaction as its INSERT. `owner` (see history_owner)
+    fills chat_tags' partition columns once migration 2 is applied.
+    """
+    if not tags:
+        return []
+    names = [{"name": t} for t in tags]
+    if owner is not None:
+        statement = LINK_LATEST_OWNED_CHAT_TAG_SQL if chat_id is None else LINK_OWNED_TAG_SQL
+        values = [{**owner, "name": t} for t in tags]
+        if chat_id is not None:
+            values = [{**v, "chat_id": chat_id} for v in values]
+        link = {"statement": statement, "valuesBatch": values}
+    elif chat_id is None:
+        link = {"statement": LINK_LATEST_CHAT_TAG_SQL, "valuesBatch": names}
+    else:
+        link = {"statement": LINK_TAG_SQL, "valuesBatch": [{"chat_id": chat_id, "name": t} for t in tags]}
+    return [{"statement": INSERT_TAG_SQL, "valuesBatch": names}, link]
+
+def indexed_tag_query(keys, owner_columns=()):
+    """Retrieval SELECT over the tag index for tag names bound as :<key>.
+
+    Tag names -> IDs via the UNIQUE index, then chats via
+    idx_chat_tags_owner_tag (or idx_chat_tags_tag when unpartitioned),
+    ranked by how many of the tags each chat matches. `owner_columns` are
+    bound as :<column>; :limit caps the rows.
+    """
+    return (
+        "SELECT c.id, c.summary, c.date, c.time, COUNT(*) AS matches "
+        "FROM tags t "
+        # CROSS JOIN pins the join order: the planner would otherwise
+        # start from the whole partition instead of the few tag IDs
+        "CROSS JOIN chat_tags ct ON ct.tag_id = t.id "
+        + "".join(f"AND ct.{column} = :{column} " for column in owner_columns) +
+        "JOIN chat_history c ON c.id = ct.chat_id "
+        f"WHERE t.name IN ({', '.join(':' + k for k in keys)}) "
+        "GROUP BY c.id "
+        "ORDER BY matches DESC, c.id DESC "
+        "LIMIT :limit"
+    )
+
+def like_tag_query(keys, owner_columns=()):
+    """Legacy retrieval SELECT: OR of LIKE :<key> patterns over the tags column."""
+    where_sql = " OR ".join(f"LOWER(tags) LIKE :{k}" for k in keys)
+    owner_sql = "".join(f"{column} = :{column} AND " for column in owner_columns)
+    return (
+        "SELECT summary, date, time, tags FROM chat_history "
+        f"WHERE {owner_sql}({where_sql}) "
+        "ORDER BY id DESC "
+        "LIMIT :limit"
+    )
+
+def _migrate_tag_index(conf, console, batch_size):
+    """Create the tag dictionary/join tables and backfill them from chat_history."""
+    post_transaction(conf, [{"statement": sql} for sql in TAG_INDEX_SCHEMA])
+
+    last_id = 0
+    migrated = 0
+    while True:
+        rows = result_rows(post_transaction(conf, [{
+            "query": "SELECT id, tags FROM chat_history WHERE id > :last_id ORDER BY id LIMIT :limit",
+            "values": {"last_id": last_id, "limit": batch_size},
+        }], timeout=60))
+        if not rows:
+            break
+
+        # Canonicalise in Python, then write the whole page in one transaction
+        names = set()
+        links = []
+        updates = []
+        for row in rows:
+            tags = canonicalize_tags((row.get('tags') or "").split(), conf['tag_synonyms'])
+            names.update(tags)
+            links.extend({"chat_id": row['id'], "name": t} for t in tags)
+            updates.append({"id": row['id'], "tags": " ".join(sorted(tags))[:1024]})
+        transaction = [{"statement": "UPDATE chat_history SET tags = :tags WHERE id = :id", "valuesBatch": updates}]
+        if names:
+            transaction.append({"statement": INSERT_TAG_SQL, "valuesBatch": [{"name": n} for n in sorted(names)]})
+            transaction.append({"statement": LINK_TAG_SQL, "valuesBatch": links})
+        post_transaction(conf, transaction, timeout=60)
+
+        migrated += len(rows)
+        last_id = max(row['id'] for row in rows)
+        console.print(f"[dim]  backfilled {migrated} rows (last id {last_id})[/dim]", highlight=False)
+
+TENANCY_COLUMNS = {
+    "chat_history": ["workspace", "user_id", "session_id"],
+    "chat_tags": ["workspace", "user_id"],
+}
+
+TENANCY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_chat_history_owner_date ON chat_history (workspace, user_id, date, time)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history (session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_tags_owner_tag ON chat_tags (workspace, user_id, tag_id, chat_id)",
+]
+
+def _table_columns(conf, table):
+    rows = result_rows(post_transaction(conf, [{"query": f"SELECT name FROM pragma_table_info('{table}')"}]))
+    return {row.get('name') for row in rows}
+
+def _migrate_tenancy(conf, console, batch_size):
+    """Add workspace/user/session columns, assign existing rows to this owner, and index them."""
+    for table, columns in TENANCY_COLUMNS.items():
+        existing = _table_columns(conf, table)
+        # ALTER TABLE has no IF NOT EXISTS; skipping present columns keeps re-runs safe
+        missing = [column for column in columns if column not in existing]
+        if missing:
+            post_transaction(conf, [
+                {"statement": f"ALTER TABLE {table} ADD COLUMN {column} TEXT NOT NULL DEFAULT ''"}
+                for column in missing
+            ])
+
+    owner = history_owner(conf)
+    console.print(f"[dim]  assigning existing rows to {owner['workspace']}/{owner['user_id']}[/dim]", highlight=False)
+    last_id = 0
+    migrated = 0
+    while True:
+        rows = result_rows(post_transaction(conf, [{
+            "query": "SELECT id FROM chat_history WHERE id > :last_id ORDER BY id LIMIT :limit",
+            "values": {"last_id": last_id, "limit": batch_size},
+        }], timeout=60))
+        if not rows:
+            break
+        page = {"lo": last_id, "hi": max(row['id'] for row in rows), **owner}
+        post_transaction(conf, [
+            {
+                "statement": "UPDATE chat_history SET workspace = :workspace, user_id = :user_id "
+                             "WHERE id > :lo AND id <= :hi AND user_id = ''",
+                "values": page,
+            },
+            {
+                # Tag links inherit the owner of their chat row
+                "statement": "UPDATE chat_tags SET (workspace, user_id) = "
+                             "(SELECT workspace, user_id FROM chat_history WHERE chat_history.id = chat_tags.chat_id) "
+                             "WHERE chat_id > :lo AND chat_id <= :hi",
+                "values": page,
+            },
+        ], timeout=60)
+        migrated += len(rows)
+        last_id = page["hi"]
+        console.print(f"[dim]  partitioned {migrated} rows (last id {last_id})[/dim]", highlight=False)
+
+    post_transaction(conf, [{"statement": sql} for sql in TENANCY_INDEXES], timeout=120)
+
+# Ordered (version, description, function) list; applied versions are
+# recorded in schema_migrations so re-running the tool is a no-op
+MIGRATIONS = [
+    (1, "normalised tag dictionary and chat_tags inverted index", _migrate_tag_index),
+    (2, "per-user partitioning: workspace/user_id/session_id columns and owner indexes", _migrate_tenancy),
+]
+
+def statement_error(error):
+    """ws4sqlite's message for a failed statement ({"reqIdx", "error"} body), else None."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict) or "reqIdx" not in body:
+        return None
+    return str(body.get("error") or body.get("message") or "")
+
+def schema_version(conf, timeout=10):
+    """Highest applied migration version, or 0 if the store was never migrated.
+
+    Outages, timeouts and auth failures are raised, never read as version 0.
+    """
+    try:
+        rows = result_rows(post_transaction(conf, [{"query": "SELECT MAX(version) AS version FROM schema_migrations"}], timeout=timeout))
+    except requests.HTTPError as e:
+        if statement_error(e) is None:
+            raise
+        # The statement failed: no schema_migrations table
+        return 0
+    return (rows[0].get('version') if rows else 0) or 0
+
+def migrate(conf, batch_size=500, console=None):
+    """Apply all pending schema migrations. Returns the list of applied versions."""
+    console = console or Console()
+    post_transaction(conf, [{
+        "statement": "CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, applied_at TEXT NOT NULL)"
+    }])
+    applied = {
+        row.get('version') for row in result_rows(post_transaction(conf, [{"query": "SELECT version FROM schema_migrations"}]))
+    }
+
+    newly_applied = []
+    for version, description, func in MIGRATIONS:
+        if version in applied:
+            continue
+        console.print(f"[bold blue]Applying migration {version}:[/bold blue] {description}")
+        func(conf, console, batch_size)
+        post_transaction(conf, [{
+            "statement": "INSERT INTO schema_migrations (version, applied_at) VALUES (:version, :applied_at)",
+            "values": {"version": version, "applied_at": datetime.now().isoformat(timespec="seconds")},
+        }])
+        newly_applied.append(version)
+    return newly_applied
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the ws4sqlite chat_history schema")
+    parser.add_argument("--conf", default="conf.json", help="Path to conf.json")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per backfill transaction")
+    parser.add_argument("--user", default=None, help="Owner for existing rows (defaults to conf history_user, then the login name)")
+    parser.add_argument("--workspace", default=None, help="Workspace for existing rows (defaults to conf history_workspace)")
+    args = parser.parse_args()
+
+    conf = load_config(args.conf)
+    if args.user:
+        conf['history_user'] = args.user
+    if args.workspace:
+        conf['history_workspace'] = args.workspace
+
+    console = Console()
+    try:
+        applied = migrate(conf, batch_size=args.batch_size, console=console)
+        message = f"Applied migrations: {applied}" if applied else "Schema is up to date"
+        console.print(Panel(Text(message, style="bold green"), title="Migration", border_style="green"))
+    except Exception as e:
+        console.print(Panel(Text(f"Migration failed: {str(e)}", style="bold red"), title="Migration Error", border_style="red"))
+        raise SystemExit(1)
@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import threading
+
+# Single-pass normalisation: every run of characters outside [a-z0-9]
+# (whitespace, punctuation, unicode) becomes one '-' separator
+_TAG_SEPARATOR_RE = re.compile(r"[^a-z0-9]+")
+
+# Folded before stemming so that e.g. "python-asyncio" and "async-python" meet
+DEFAULT_TAG_SYNONYMS = {
+    "py": "python",
+    "python3": "python",
+    "asyncio": "async",
+    "asynchronous": "async",
+    "js": "javascript",
+    "ts": "typescript",
+    "k8s": "kubernetes",
+    "postgres": "postgresql",
+    "db": "database",
+    "databases": "database",
+    "llms": "llm",
+    "ml": "machine-learning",
+    "ai": "artificial-intelligence",
+    "config": "configuration",
+    "perf": "performance",
+}
+
+_NON_TAGS = {"empty-transcript"}
+
+# Names and singular words that only look like plurals, and plurals the
+# suffix rules below would get wrong
+_STEM_EXCEPTIONS = {
+    "kubernetes": "kubernetes", "windows": "windows", "jenkins": "jenkins", "pandas": "pandas",
+    "rails": "rails", "https": "https", "series": "series", "species": "species", "news": "news",
+    "caches": "cache", "niches": "niche",
+}
+
+def stem_token(token):
+    """Light, conservative plural stemming ("queries" -> "query", "tags" -> "tag").
+
+    >>> [stem_token(t) for t in ("queries", "tags", "matches", "caches", "classes")]
+    ['query', 'tag', 'match', 'cache', 'class']
+    >>> [stem_token(t) for t in ("kubernetes", "macos", "aws", "status", "redis", "series")]
+    ['kubernetes', 'macos', 'aws', 'status', 'redis', 'series']
+    """
+    if token in _STEM_EXCEPTIONS:
+        return _STEM_EXCEPTIONS[token]
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("sses", "shes", "ches", "xes")):
+        return token[:-2]
+    # Three letters or fewer are mostly acronyms ("aws", "dns", "gcs"); -ss,
+    # -us, -is and -os words are mostly singular ("class", "status", "redis", "macos")
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is", "os")):
+        return token[:-1]
+    return token
+
+def canonical_tag(raw, synonyms=None):
+    """Return the canonical form of one tag, or "" if nothing usable is left.
+
+    Tokens are synonym-folded, stemmed, de-duplicated and sorted, so word
+    order and inflection no longer produce distinct tags.
+    """
+    synonyms = DEFAULT_TAG_SYNONYMS if synonyms is None else synonyms
+    text = _TAG_SEPARATOR_RE.sub("-", str(raw).lower()).strip("-")
+    if not text or text in _NON_TAGS:
+        return ""
+    tokens = set()
+    for token in text.split("-"):
+        folded = synonyms.get(token, token)
+        for part in folded.split("-"):
+            tokens.add(synonyms.get(stem_token(part), stem_token(part)))
+    tokens.discard("")
+    return "-".join(sorted(tokens))
+
+def canonicalize_tags(raw_tags, synonyms=None, max_tags=None):
+    """Canonicalise and de-duplicate tags, keeping first-seen order."""
+    if synonyms is not None:
+        synonyms = {**DEFAULT_TAG_SYNONYMS, **synonyms}
+    canonical = []
+    seen = set()
+    for raw in raw_tags:
+        tag = canonical_tag(raw, synonyms)
+        if not tag or tag in seen:
+            continue
+        seen.add(tag)
+        canonical.append(tag)
+        if max_tags and len(canonical) >= max_tags:
+            break
+    return canonical
+
+class TagVocabulary:
+    """Persistent canonical-tag -> integer ID dictionary backed by a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.ids = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.ids = {str(k): int(v) for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        self._next_id = max(self.ids.values(), default=0) + 1
+
+    def id_for(self, tag):
+        """Return the ID for a canonical tag, assigning a new one if needed."""
+        with self._lock:
+            tag_id = self.ids.get(tag)
+            if tag_id is None:
+                tag_id = self._next_id
+                self._next_id += 1
+                self.ids[tag] = tag_id
+                self._dirty = True
+            return tag_id
+
+    def ids_for(self, tags):
+        """Return the set of IDs for canonical tags."""
+        return {self.id_for(t) for t in tags}
+
+    def known_ids(self, tags):
+        """Return the set of IDs for tags already in the vocabulary, without assigning new ones."""
+        return {self.ids[t] for t in tags if t in self.ids}
+
+    def save(self):
+        """Write the vocabulary to disk if it changed (atomic replace)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.ids, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+_vocabularies = {}
+
+def get_tag_vocabulary(conf):
+    """Return the shared vocabulary for conf['tag_vocabulary_path']."""
+    path = conf['tag_vocabulary_path']
+    vocabulary = _vocabularies.get(path)
+    if vocabulary is None:
+        vocabulary = _vocabularies.setdefault(path, TagVocabulary(path))
+    return vocabulary
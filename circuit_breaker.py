@@ -0,0 +1,210 @@
+import threading
+import time
+
+import openai
+import requests
+
+# Timeout budgets and circuit breakers for every remote call.
+#
+# Each call belongs to a stage with a {"connect", "read", "total"} budget
+# in seconds (conf['timeout_budgets'], merged over DEFAULT_STAGE_BUDGETS).
+# Unary calls use min(read, total) as their read timeout, since the server
+# sends nothing until it is done; streams get `read` between chunks and
+# `total` as the longest they may go without a token (time to first token,
+# or a stall later on), checked as the chunks arrive. A stream that keeps
+# producing tokens is never cut off, and running out of budget is the
+# request's problem, not the endpoint's: it does not count as an outage.
+#
+# Each endpoint (LLM base URL, ws4sqlite URL) has one breaker. After
+# conf['circuit_failure_threshold'] consecutive outage errors (connection
+# failures, timeouts, 5xx) it opens: calls fail at once with
+# CircuitOpenError while a background thread probes the endpoint, with
+# backoff, and closes the breaker when it answers again.
+
+DEFAULT_STAGE_BUDGETS = {
+    "chat": {"connect": 3.0, "read": 120.0, "total": 900.0},
+    "tagging": {"connect": 2.0, "read": 30.0, "total": 30.0},
+    "autosave": {"connect": 2.0, "read": 120.0, "total": 120.0},
+    "memory": {"connect": 2.0, "read": 60.0, "total": 60.0},
+    "ingest": {"connect": 2.0, "read": 120.0, "total": 120.0},
+    "compaction": {"connect": 2.0, "read": 120.0, "total": 120.0},
+    "retrieval": {"connect": 1.0, "read": 5.0, "total": 5.0},
+    "history_write": {"connect": 1.0, "read": 10.0, "total": 10.0},
+}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+class DeadlineExceeded(TimeoutError):
+    """A stream went its stage's total budget without producing a token."""
+
+def is_outage(error):
+    """True for errors that say the endpoint is down rather than the request is bad."""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, openai.APIConnectionError)):
+        return True
+    if isinstance(error, requests.HTTPError):
+        response = error.response
+        if response is None or response.status_code < 500:
+            return False
+        try:
+            # ws4sqlite reports a failing statement as a 500 with {"reqIdx", "error"}:
+            # the server is up, the request is bad
+            return "reqIdx" not in response.json()
+        except ValueError:
+            return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+class StageBudget:
+    def __init__(self, connect, read, total):
+        self.connect = float(connect)
+        self.read = float(read)
+        self.total = float(total)
+
+    def requests_timeout(self):
+        """(connect, read) for requests, for a unary call."""
+        return (self.connect, min(self.read, self.total))
+
+    def openai_timeout(self, stream=False):
+        """openai.Timeout; streams get the per-chunk read timeout, unary calls the total."""
+        read = self.read if stream else min(self.read, self.total)
+        return openai.Timeout(read, connect=self.connect)
+
+    def deadline(self, started_at=None):
+        """perf_counter() time by which a stream must produce its next token."""
+        return (started_at if started_at is not None else time.perf_counter()) + self.total
+
+class CircuitBreaker:
+    """Closed/open breaker for one endpoint, with background recovery probing.
+
+    `probe()` should make a cheap request and raise if the endpoint is still
+    down; it runs on a daemon thread while the breaker is open. Without a
+    probe, one real call is let through every probe_interval instead.
+    """
+
+    def __init__(self, name, probe=None, failure_threshold=2, probe_interval=5.0, max_probe_interval=60.0):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.probe_interval = float(probe_interval)
+        self.max_probe_interval = float(max_probe_interval)
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.trips = 0
+        self._prober = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def check(self):
+        """Raise CircuitOpenError if calls to this endpoint should be skipped."""
+        opened_at = self.opened_at
+        if opened_at is None:
+            return
+        if self.probe is None and time.monotonic() - opened_at >= self.probe_interval:
+            # Half-open: this call is the probe
+            with self._lock:
+                self.opened_at = time.monotonic()
+            return
+        raise CircuitOpenError(f"{self.name} is down ({self.describe_error()}); retrying in the background")
+
+    def describe_error(self):
+        return type(self.last_error).__name__ if self.last_error is not None else "unknown error"
+
+    def record_success(self):
+        self.close()
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.opened_at is not None or self.failures < self.failure_threshold:
+                return
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            if self.probe is None:
+                return
+            self._prober = threading.Thread(target=self._probe_until_closed, daemon=True)
+            self._prober.start()
+
+    def close(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def _probe_until_closed(self):
+        interval = self.probe_interval
+        while self.opened_at is not None:
+            time.sleep(interval)
+            try:
+                self.probe()
+            except Exception as e:
+                self.last_error = e
+                interval = min(self.max_probe_interval, interval * 2)
+                continue
+            self.close()
+
+class RemoteGuard:
+    """Stage budgets plus one breaker per endpoint, shared by all callers."""
+
+    def __init__(self, conf):
+        self._lock = threading.Lock()
+        self.breakers = {}
+        self.configure(conf)
+
+    def configure(self, conf):
+        """(Re)read budgets and breaker settings; open breakers keep their state."""
+        budgets = {stage: dict(budget) for stage, budget in DEFAULT_STAGE_BUDGETS.items()}
+        for stage, budget in conf['timeout_budgets'].items():
+            budgets.setdefault(stage, dict(DEFAULT_STAGE_BUDGETS["chat"])).update(budget)
+        self.budgets = {stage: StageBudget(**budget) for stage, budget in budgets.items()}
+        self.failure_threshold = int(conf['circuit_failure_threshold'])
+        self.probe_interval = float(conf['circuit_probe_interval_s'])
+        self.max_probe_interval = float(conf['circuit_probe_max_interval_s'])
+        with self._lock:
+            for breaker in self.breakers.values():
+                breaker.failure_threshold = self.failure_threshold
+                breaker.probe_interval = self.probe_interval
+                breaker.max_probe_interval = self.max_probe_interval
+
+    def budget(self, stage):
+        return self.budgets.get(stage) or self.budgets["chat"]
+
+    def breaker(self, endpoint, probe=None):
+        with self._lock:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = self.breakers[endpoint] = CircuitBreaker(
+                    endpoint, probe, self.failure_threshold, self.probe_interval, self.max_probe_interval
+                )
+            elif breaker.probe is None:
+                breaker.probe = probe
+        return breaker
+
+    def available(self, endpoint):
+        with self._lock:
+            breaker = self.breakers.get(endpoint)
+        return breaker is None or not breaker.is_open
+
+    def call(self, endpoint, stage, func, probe=None):
+        """Run func(budget) against `endpoint`, failing fast while its breaker is open."""
+        breaker = self.breaker(endpoint, probe)
+        breaker.check()
+        try:
+            result = func(self.budget(stage))
+        except Exception as e:
+            if is_outage(e):
+                breaker.record_failure(e)
+            raise
+        breaker.record_success()
+        return result
+
+    def open_breakers(self):
+        with self._lock:
+            return [breaker for breaker in self.breakers.values() if breaker.is_open]
@@ -0,0 +1,264 @@
+from openai import OpenAI
+import argparse
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from rich.console import Console
+from rich.panel import Panel
+from rich.text import Text
+
+from chat_history_db import history_owner, post_transaction, result_rows, schema_version, tag_link_statements
+from chat_tags import canonicalize_tags
+from circuit_breaker import RemoteGuard
+from config import load_config
+from ranking import chat_timestamp
+
+# Compaction for the chat_history store:
+#
+#   1. group   rows of one owner that belong to the same session (or were
+#              saved within --gap-minutes of each other) and share tags
+#   2. merge   each group into one consolidated summary, LLM calls spread
+#              across the conf.json endpoints
+#   3. prune   rows older than --max-age-days / beyond --max-rows per owner
+#   4. vacuum  the SQLite file, when it is reachable locally
+#
+# Every group is replaced in one transaction, so an interrupted run leaves
+# either the originals or the merged row, never both or neither. Merge
+# calls run within the "compaction" timeout budget; a group whose call
+# stalls is skipped and left for the next run.
+
+def tag_similarity(a, b):
+    """Jaccard similarity of two tag sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def load_rows(conf, partitioned, batch_size=500):
+    """All chat_history rows with parsed timestamps and canonical tag sets."""
+    columns = "id, summary, tags, date, time" + (", workspace, user_id, session_id" if partitioned else "")
+    rows = []
+    last_id = 0
+    while True:
+        page = result_rows(post_transaction(conf, [{
+            "query": f"SELECT {columns} FROM chat_history WHERE id > :last_id ORDER BY id LIMIT :limit",
+            "values": {"last_id": last_id, "limit": batch_size},
+        }], timeout=60))
+        if not page:
+            break
+        for row in page:
+            row['timestamp'] = chat_timestamp(row.get('date'), row.get('time'))
+            row['tag_set'] = set(canonicalize_tags((row.get('tags') or "").split(), conf['tag_synonyms']))
+        rows.extend(page)
+        last_id = page[-1]['id']
+    return rows
+
+def _owner_key(row):
+    return (row.get('workspace', ""), row.get('user_id', ""))
+
+def group_rows(rows, gap_minutes, min_similarity):
+    """Split rows into runs of overlapping summaries.
+
+    Rows are walked per owner in time order; a row joins the current group
+    if it shares its session (or is within gap_minutes of the previous row)
+    and its tags are at least min_similarity similar to the group's.
+    """
+    gap = timedelta(minutes=gap_minutes)
+    ordered = sorted(rows, key=lambda r: (_owner_key(r), r['timestamp'] or datetime.min, r['id']))
+    groups = []
+    current = []
+    group_tags = set()
+    for row in ordered:
+        if current:
+            previous = current[-1]
+            same_owner = _owner_key(row) == _owner_key(previous)
+            same_session = bool(row.get('session_id')) and row.get('session_id') == previous.get('session_id')
+            close_in_time = (
+                row['timestamp'] is not None and previous['timestamp'] is not None
+                and row['timestamp'] - previous['timestamp'] <= gap
+            )
+            if same_owner and (same_session or close_in_time) and tag_similarity(row['tag_set'], group_tags) >= min_similarity:
+                current.append(row)
+                group_tags |= row['tag_set']
+                continue
+            groups.append(current)
+        current = [row]
+        group_tags = set(row['tag_set'])
+    if current:
+        groups.append(current)
+    return [group for group in groups if len(group) > 1]
+
+def merge_summaries(group, base_url, budget):
+    """Ask the LLM for one consolidated summary of a group's summaries, within `budget`."""
+    client = OpenAI(base_url=base_url, api_key="dummy_api_key", timeout=budget.openai_timeout(), max_retries=0)
+    listing = "\n".join(f"- [{row.get('date')} {row.get('time') or ''}] {row.get('summary')}" for row in group)
+    prompt = (
+        "You will receive several overlapping summaries of the same chat, oldest first.\n"
+        "Merge them into one concise, high-signal summary without repeating yourself.\n"
+        "Keep decisions, facts and open questions; prefer later summaries on conflicts.\n"
+        "Output only the summary."
+    )
+    resp = client.chat.completions.create(
+        model="my-model",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt + "\n\nSummaries:\n" + listing},
+        ],
+        temperature=0.3,
+        top_p=0.9,
+        max_tokens=2048,
+        stream=False,
+    )
+    content = resp.choices[0].message.content if resp and resp.choices else ""
+    return content.split("</think>")[-1].strip()
+
+def _delete_statements(chat_ids, schema):
+    ids = [{"id": chat_id} for chat_id in chat_ids]
+    statements = [{"statement": "DELETE FROM chat_history WHERE id = :id", "valuesBatch": ids}]
+    if schema >= 1:
+        # The tag index tables only exist from migration 1 on
+        statements.insert(0, {"statement": "DELETE FROM chat_tags WHERE chat_id = :id", "valuesBatch": ids})
+    return statements
+
+def replace_group(conf, group, summary, schema):
+    """Insert the merged row and delete the originals in one transaction."""
+    partitioned = schema >= 2
+    latest = max(group, key=lambda r: (r['timestamp'] or datetime.min, r['id']))
+    tags = sorted(set().union(*(row['tag_set'] for row in group)))
+    values = {
+        "summary": summary,
+        "tags": " ".join(tags)[:1024],
+        "date": latest.get('date'),
+        "time": latest.get('time'),
+    }
+    owner = None
+    if partitioned:
+        owner = {"workspace": latest.get('workspace', ""), "user_id": latest.get('user_id', "")}
+        values.update(owner, session_id=latest.get('session_id', ""))
+        insert_sql = (
+            "INSERT INTO chat_history (summary, tags, date, time, workspace, user_id, session_id) "
+            "VALUES (:summary, :tags, :date, :time, :workspace, :user_id, :session_id)"
+        )
+    else:
+        insert_sql = "INSERT INTO chat_history (summary, tags, date, time) VALUES (:summary, :tags, :date, :time)"
+    # Insert before deleting: with the originals still present the new row gets
+    # an id above all of them (never a recycled one, which stale tag links or
+    # the summary index's id watermark could mistake), and MAX(id) in the tag
+    # link statements is that row
+    post_transaction(conf, (
+        [{"statement": insert_sql, "values": values}]
+        + (tag_link_statements(tags, owner=owner) if schema >= 1 else [])
+        + _delete_statements([row['id'] for row in group], schema)
+    ), timeout=60)
+
+def retention_victims(rows, max_age_days=None, max_rows=None, now=None):
+    """IDs of rows to prune: older than max_age_days, or beyond the newest max_rows per owner."""
+    now = now or datetime.now()
+    victims = set()
+    if max_age_days:
+        cutoff = now - timedelta(days=max_age_days)
+        victims.update(row['id'] for row in rows if row['timestamp'] is not None and row['timestamp'] < cutoff)
+    if max_rows:
+        by_owner = {}
+        for row in rows:
+            by_owner.setdefault(_owner_key(row), []).append(row)
+        for owner_rows in by_owner.values():
+            owner_rows.sort(key=lambda r: (r['timestamp'] or datetime.min, r['id']), reverse=True)
+            victims.update(row['id'] for row in owner_rows[max_rows:])
+    return victims
+
+def vacuum(conf, db_file=None):
+    """VACUUM the store; returns a message describing what happened."""
+    if db_file:
+        conn = sqlite3.connect(db_file)
+        try:
+            conn.execute("PRAGMA optimize")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        return f"Vacuumed {db_file}"
+    # ws4sqlite wraps every request in a transaction, where VACUUM is not allowed
+    post_transaction(conf, [{"statement": "PRAGMA optimize"}])
+    return ("Ran PRAGMA optimize. VACUUM needs the database file (--db-file) "
+            "or ws4sqlite's scheduled maintenance (doVacuum).")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact, prune and vacuum the chat_history store")
+    parser.add_argument("--conf", default="conf.json", help="Path to conf.json")
+    parser.add_argument("--gap-minutes", type=float, default=120, help="Max gap between rows of one group without a shared session")
+    parser.add_argument("--min-tag-similarity", type=float, default=0.2, help="Min tag Jaccard similarity to join a group")
+    parser.add_argument("--max-age-days", type=float, default=None, help="Delete rows older than this")
+    parser.add_argument("--max-rows", type=int, default=None, help="Keep at most this many rows per owner (newest first)")
+    parser.add_argument("--all-owners", action="store_true", help="Compact every user's rows, not just this instance's")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel merge requests")
+    parser.add_argument("--db-file", default=None, help="SQLite file behind ws4sqlite, for VACUUM")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+
+    conf = load_config(args.conf)
+
+    console = Console()
+    try:
+        schema = schema_version(conf)
+        partitioned = schema >= 2
+        rows = load_rows(conf, partitioned)
+        if partitioned and not args.all_owners:
+            owner = history_owner(conf)
+            rows = [row for row in rows if _owner_key(row) == (owner["workspace"], owner["user_id"])]
+        console.print(f"[bold blue]Loaded {len(rows)} rows[/bold blue]")
+
+        # Prune first so no LLM calls are spent on rows about to be deleted
+        victims = retention_victims(rows, args.max_age_days, args.max_rows)
+        rows = [row for row in rows if row['id'] not in victims]
+        groups = group_rows(rows, args.gap_minutes, args.min_tag_similarity)
+        merged_rows = sum(len(group) for group in groups)
+        console.print(
+            f"Retention: {len(victims)} rows to delete · Compaction: {merged_rows} rows in {len(groups)} groups",
+            highlight=False
+        )
+
+        if args.dry_run:
+            for group in groups:
+                console.print(f"[dim]  {[row['id'] for row in group]} {sorted(set().union(*(r['tag_set'] for r in group)))[:6]}[/dim]", highlight=False)
+            raise SystemExit(0)
+
+        if victims:
+            ids = sorted(victims)
+            for start in range(0, len(ids), 500):
+                post_transaction(conf, _delete_statements(ids[start:start + 500], schema), timeout=60)
+            if schema >= 1:
+                post_transaction(conf, [{"statement": "DELETE FROM tags WHERE id NOT IN (SELECT tag_id FROM chat_tags)"}], timeout=60)
+
+        endpoints = list(dict.fromkeys(conf['baseurl']))
+        budget = RemoteGuard(conf).budget("compaction")
+        failed = 0
+        replaced_rows = 0
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+            futures = [
+                (group, pool.submit(merge_summaries, group, endpoints[i % len(endpoints)], budget))
+                for i, group in enumerate(groups)
+            ]
+            for n, (group, future) in enumerate(futures, 1):
+                try:
+                    # Backstop in case the client timeout does not fire
+                    summary = future.result(timeout=budget.connect + budget.total)
+                    if not summary:
+                        raise ValueError("empty summary")
+                    replace_group(conf, group, summary, schema)
+                    replaced_rows += len(group)
+                except Exception as e:
+                    failed += 1
+                    console.print(f"[yellow]  group {[row['id'] for row in group]} skipped: {str(e) or type(e).__name__}[/yellow]", highlight=False)
+                console.print(f"[dim]{n}/{len(groups)}[/dim]", end="\r", highlight=False)
+
+        vacuum_message = vacuum(conf, args.db_file)
+        remaining = len(rows) - replaced_rows + len(groups) - failed
+        message = (
+            f"Deleted {len(victims)} rows, merged {replaced_rows} rows into {len(groups) - failed}"
+            f" ({failed} groups failed); {remaining} rows remain. {vacuum_message}"
+        )
+        console.print(Panel(Text(message, style="bold green"), title="Compaction", border_style="green"))
+    except SystemExit:
+        raise
+    except Exception as e:
+        console.print(Panel(Text(f"Compaction failed: {str(e)}", style="bold red"), title="Compaction Error", border_style="red"))
+        raise SystemExit(1)
@@ -0,0 +1,310 @@
+import json
+import os
+from urllib.parse import urlparse
+
+# conf.json, typed and validated in one place.
+#
+# FIELDS is the single list of settings: each key's type, the default used
+# when conf.json leaves it out, and an optional check. load_config() reads
+# the file once, coerces and validates every key and reports all problems
+# together; the other modules read the result with plain conf['key'].
+#
+# Config.reload() re-reads the file when its mtime changes. main.py calls it
+# between turns, so no request ever sees half of an edit: a valid file
+# swaps in every key that is read per turn (endpoint pools, window and
+# retrieval budgets, timeouts, ...), keys in RESTART_KEYS keep their
+# current value until the next start, and an invalid file changes nothing.
+
+class ConfigError(ValueError):
+    """conf.json could not be read or failed validation; lists every problem."""
+
+REQUIRED = object()
+
+def _positive(value):
+    return None if value > 0 else "must be > 0"
+
+def _non_negative(value):
+    return None if value >= 0 else "must be >= 0"
+
+def _fraction(value):
+    return None if 0 <= value <= 1 else "must be between 0 and 1"
+
+def _non_empty(value):
+    return None if value.strip() else "must not be empty"
+
+def _one_of(*choices):
+    def check(value):
+        return None if value in choices else f"must be one of {', '.join(map(repr, choices))}"
+    return check
+
+def _url(value):
+    parsed = urlparse(value)
+    return None if parsed.scheme in ("http", "https") and parsed.netloc else f"{value!r} is not an http(s) URL"
+
+def _optional_url(value):
+    return _url(value) if value else None
+
+def _urls(min_count=0):
+    def check(value):
+        if len(value) < min_count:
+            return f"needs at least {min_count} endpoints"
+        for url in value:
+            problem = _url(url) if isinstance(url, str) else f"{url!r} is not a string"
+            if problem:
+                return problem
+        return None
+    return check
+
+def _weights(*keys):
+    def check(value):
+        for key, weight in value.items():
+            if keys and key not in keys:
+                return f"unknown key {key!r} (expected {', '.join(keys)})"
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight < 0:
+                return f"{key!r} must be a number >= 0"
+        return None
+    return check
+
+def _cache_similarity(value):
+    # Below ~0.95 character shingles match prompts that differ in a single verb
+    return None if value == 1.0 or 0.95 <= value < 1.0 else "must be 1.0 (exact matches only) or between 0.95 and 1"
+
+def _synonyms(value):
+    for alias, tag in value.items():
+        if not isinstance(tag, str):
+            return f"{alias!r} must map to a string"
+    return None
+
+def _stage_budgets(value):
+    for stage, budget in value.items():
+        if not isinstance(budget, dict):
+            return f"{stage!r} must be an object"
+        for key, seconds in budget.items():
+            if key not in ("connect", "read", "total"):
+                return f"{stage}.{key}: unknown key (expected connect, read, total)"
+            if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds <= 0:
+                return f"{stage}.{key} must be a number > 0"
+    return None
+
+# key: (type, default, check); check(value) returns a problem or None
+FIELDS = {
+    # Endpoints: baseurl[0] answers, baseurl[1] tags and summarises
+    "baseurl": (list, REQUIRED, _urls(min_count=2)),
+    "fanout_mode": (str, "off", _one_of("off", "first", "best")),
+    "fanout_endpoints": (list, [], _urls()),
+    "max_tokens": (int, 32768, _positive),
+    # Sliding window and adaptive context
+    "chat_sliding_window_max_size": (int, 4000, _non_negative),
+    "adaptive_context": (bool, True, None),
+    "target_ttft_s": (float, 2.0, _positive),
+    "context_budget_split": (dict, {}, _weights("history", "midterm", "longterm")),
+    "context_output_fraction": (float, 0.25, _fraction),
+    "context_min_output_tokens": (int, 512, _positive),
+    "context_min_history_tokens": (int, 256, _non_negative),
+    "context_safety_margin_tokens": (int, 256, _non_negative),
+    "context_probe_timeout_s": (float, 2.0, _positive),
+    # Chat history server and retrieval
+    "chat_history_server_url": (str, "http://127.0.0.1:12321/chat_history", _url),
+    "chat_history_server_auth_user": (str, "admin", None),
+    "chat_history_server_auth_pass": (str, "YourSuperSecretPass123", None),
+    "history_user": (str, "", None),
+    "history_workspace": (str, "default", _non_empty),
+    "chat_history_scope": (str, "user", _one_of("user", "workspace", "all")),
+    "max_chat_history_results": (int, 100, _positive),
+    "chat_history_tag_index": (bool, True, None),
+    "chat_history_top_k": (int, 5, _positive),
+    "chat_history_min_score": (float, 0.15, _fraction),
+    "chat_history_recency_half_life_days": (float, 30.0, _positive),
+    "chat_history_text_similarity": (bool, True, None),
+    "chat_history_score_weights": (dict, {}, _weights("tags", "text", "recency")),
+    "summary_index_enabled": (bool, False, None),
+    "summary_index_dir": (str, "summary_index", _non_empty),
+    "summary_index_tag_dim": (int, 1024, _positive),
+    "summary_index_word_dim": (int, 1024, _positive),
+    "summary_index_sync_interval_s": (float, 30.0, _non_negative),
+    # Tagging
+    "tag_vocabulary_path": (str, "tag_vocabulary.json", _non_empty),
+    "tag_synonyms": (dict, {}, _synonyms),
+    "tag_max_count": (int, 12, _positive),
+    "tag_max_tokens": (int, 2048, _positive),
+    "tag_output_constraint": (str, "off", _one_of("off", "stop", "grammar")),
+    # Tag requests arriving within the window share one batched request; 0 is off
+    "tag_batch_window_ms": (float, 0.0, _non_negative),
+    "tag_batch_max_items": (int, 8, _positive),
+    # Speculation, response cache, shutdown and session logs
+    "speculative_generation": (bool, False, None),
+    "speculation_min_context_score": (float, 0.35, _fraction),
+    "response_cache_enabled": (bool, False, None),
+    "response_cache_path": (str, "response_cache.json", _non_empty),
+    "response_cache_max_entries": (int, 500, _positive),
+    "response_cache_policy": (str, "lru", _one_of("lru", "lfu")),
+    "response_cache_similarity": (float, 1.0, _cache_similarity),
+    "response_cache_history_window": (int, 2, _non_negative),
+    "shutdown_autosave_deadline_s": (float, 15.0, _non_negative),
+    "sessions_dir": (str, "sessions", _non_empty),
+    # Memory tiers
+    "memory_tiers_enabled": (bool, False, None),
+    "memory_midterm_max_tokens": (int, 1000, _non_negative),
+    "memory_longterm_max_tokens": (int, 800, _non_negative),
+    "memory_chunk_min_tokens": (int, 600, _positive),
+    "memory_rollup_chunks": (int, 4, _positive),
+    # Token counting
+    "tokenizer_backend": (str, "tiktoken", _one_of("server", "hf", "tiktoken", "estimate")),
+    "tokenizer_server_url": (str, "", _optional_url),
+    "tokenizer_hf_name": (str, "", None),
+    "tokenizer_tiktoken_encoding": (str, "cl100k_base", _non_empty),
+    "tokenizer_cache_size": (int, 4096, _non_negative),
+    "tokenizer_timeout_s": (float, 5.0, _positive),
+    "tokenizer_retry_s": (float, 30.0, _non_negative),
+    # Large input ingestion; ingest_concurrency 0 means two per endpoint
+    "ingest_threshold_tokens": (int, 4000, _positive),
+    "ingest_chunk_tokens": (int, 3000, _positive),
+    "ingest_summary_tokens": (int, 600, _positive),
+    "ingest_excerpt_chars": (int, 600, _non_negative),
+    "ingest_concurrency": (int, 0, _non_negative),
+    "blob_store_dir": (str, "blobs", _non_empty),
+    # Timeouts and circuit breakers
+    "timeout_budgets": (dict, {}, _stage_budgets),
+    "circuit_failure_threshold": (int, 2, _positive),
+    "circuit_probe_interval_s": (float, 5.0, _positive),
+    "circuit_probe_max_interval_s": (float, 60.0, _positive),
+    # Profiling
+    "profile_dir": (str, "profiles", _non_empty),
+    "profile_format": (str, "collapsed", _one_of("collapsed", "speedscope")),
+    "profile_interval_ms": (float, 5.0, _positive),
+    # Pick up conf.json edits between turns
+    "config_hot_reload": (bool, True, None),
+}
+
+# Read once into long-lived objects at startup; a reload reports them instead of applying them
+RESTART_KEYS = frozenset({
+    "chat_history_server_url", "chat_history_server_auth_user", "chat_history_server_auth_pass",
+    "summary_index_dir", "summary_index_tag_dim", "summary_index_word_dim",
+    "response_cache_enabled", "response_cache_path", "response_cache_max_entries",
+    "response_cache_policy", "response_cache_similarity", "response_cache_history_window",
+    "sessions_dir", "memory_tiers_enabled",
+    "tokenizer_backend", "tokenizer_server_url", "tokenizer_hf_name",
+    "tokenizer_tiktoken_encoding", "tokenizer_cache_size", "tokenizer_timeout_s",
+    "tokenizer_retry_s", "config_hot_reload",
+})
+
+_TYPE_NAMES = {list: "a list", dict: "an object", str: "a string", int: "an integer", float: "a number", bool: "true or false"}
+
+def _coerce(kind, value):
+    """value as `kind`, or raise TypeError; JSON numbers are converted where lossless."""
+    if kind is bool or isinstance(value, bool):
+        if kind is bool and isinstance(value, bool):
+            return value
+        raise TypeError
+    if kind is float and isinstance(value, (int, float)):
+        return float(value)
+    if kind is int and isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, kind):
+        return value
+    raise TypeError
+
+def validate(raw, source="conf.json"):
+    """Check a decoded conf.json against FIELDS.
+
+    Returns (values, warnings): every FIELDS key with its coerced value or
+    default, plus any unknown keys as given (warned about, they are often
+    typos). Raises ConfigError listing all problems at once.
+    """
+    if not isinstance(raw, dict):
+        raise ConfigError(f"{source}: expected a JSON object")
+    values = {}
+    problems = []
+    for key, (kind, default, check) in FIELDS.items():
+        if key not in raw:
+            if default is REQUIRED:
+                problems.append(f"{key}: required")
+            else:
+                values[key] = json.loads(json.dumps(default))
+            continue
+        try:
+            value = _coerce(kind, raw[key])
+        except TypeError:
+            problems.append(f"{key}: must be {_TYPE_NAMES[kind]}, got {json.dumps(raw[key])}")
+            continue
+        problem = check(value) if check else None
+        if problem:
+            problems.append(f"{key}: {problem}")
+            continue
+        values[key] = value
+    if values.get('tokenizer_backend') == "hf" and not values.get('tokenizer_hf_name'):
+        problems.append("tokenizer_hf_name: required when tokenizer_backend is \"hf\"")
+    if problems:
+        raise ConfigError(f"{source} is invalid:\n" + "\n".join(f"  {p}" for p in problems))
+    unknown = [key for key in raw if key not in FIELDS]
+    values.update((key, raw[key]) for key in unknown)
+    return values, [f"{source}: unknown setting {key!r} ignored" for key in unknown]
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _read(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except OSError as e:
+        raise ConfigError(f"{path}: {e.strerror}") from None
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"{path}: invalid JSON ({e})") from None
+
+class Config(dict):
+    """Validated settings; a dict, so conf['key'] works everywhere (as does conf.key).
+
+    reload() updates this same object, so every module holding it reads the
+    new values from the next lookup on.
+    """
+
+    def __init__(self, values, path=None, warnings=()):
+        super().__init__(values)
+        self.path = path
+        self.warnings = list(warnings)
+        self._file_stat = _stat(path) if path else None
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def reload(self):
+        """Re-read the file if it changed since it was last read.
+
+        Returns None when unchanged, else (applied, pending): the changed
+        keys now in effect and the changed RESTART_KEYS left as they were.
+        Raises ConfigError (current values kept) when the new file is
+        invalid; the same broken file is not reported twice.
+        """
+        stat = _stat(self.path)
+        if stat is None or stat == self._file_stat:
+            return None
+        self._file_stat = stat
+        values, warnings = validate(_read(self.path), self.path)
+        self.warnings = warnings
+        changed = [key for key in values.keys() | self.keys() if values.get(key) != self.get(key)]
+        pending = sorted(key for key in changed if key in RESTART_KEYS)
+        for key in changed:
+            if key not in values:
+                del self[key]
+            elif key not in RESTART_KEYS:
+                self[key] = values[key]
+        return sorted(key for key in changed if key in FIELDS and key not in RESTART_KEYS), pending
+
+def load_config(path="conf.json"):
+    """Read and validate conf.json; raises ConfigError."""
+    values, warnings = validate(_read(path), path)
+    return Config(values, path, warnings)
+
+def default_config(**overrides):
+    """A Config of the FIELDS defaults (no file, no baseurl) for tools and benchmarks."""
+    values = {key: json.loads(json.dumps(default)) for key, (_, default, _) in FIELDS.items() if default is not REQUIRED}
+    values.update(overrides)
+    return Config(values)
@@ -0,0 +1,158 @@
+import threading
+import time
+
+import requests
+
+# Per-turn token budget sized from the backend instead of a static window.
+#
+#   prompt cap = min(n_ctx - output reservation, target TTFT * prefill tok/s)
+#   free       = prompt cap - system prompt - user input - fixed context
+#
+# `free` is split between the working history window and the mid-term and
+# long-term memory tiers by conf['context_budget_split']. n_ctx is probed
+# once per endpoint, and again every PROBE_RETRY_S while a probe has not
+# answered (the server may still be loading its model); prefill throughput is an EMA of what the server
+# reports (llama.cpp `timings`) or, failing that, prompt tokens / TTFT.
+# Anything still unknown falls back to the static conf.json sizes.
+
+DEFAULT_BUDGET_SPLIT = {"history": 0.6, "midterm": 0.2, "longterm": 0.2}
+PROBE_RETRY_S = 60.0
+
+def _server_root(baseurl):
+    root = baseurl.rstrip("/")
+    return root[:-3] if root.endswith("/v1") else root
+
+def probe_context_size(baseurl, timeout=2):
+    """Return the context size an endpoint reports, or None.
+
+    Tries llama.cpp's /props, then the n_ctx-style fields servers put on
+    their /models entries (llama.cpp meta, vLLM max_model_len, ...).
+    """
+    try:
+        r = requests.get(f"{_server_root(baseurl)}/props", timeout=timeout)
+        if r.ok:
+            props = r.json()
+            n_ctx = (props.get("default_generation_settings") or {}).get("n_ctx") or props.get("n_ctx")
+            if n_ctx:
+                return int(n_ctx)
+    except (requests.RequestException, ValueError, AttributeError):
+        pass
+    try:
+        r = requests.get(f"{baseurl.rstrip('/')}/models", timeout=timeout)
+        if r.ok:
+            for model in r.json().get("data") or []:
+                meta = model.get("meta") or {}
+                for value in (meta.get("n_ctx"), meta.get("n_ctx_train"), model.get("max_model_len"), model.get("context_length")):
+                    if value:
+                        return int(value)
+    except (requests.RequestException, ValueError, AttributeError):
+        pass
+    return None
+
+class ContextBudget:
+    """Tracks each endpoint's context size and prefill speed and plans turns."""
+
+    def __init__(self, conf):
+        self.conf = conf
+        self._lock = threading.Lock()
+        # baseurl -> {"n_ctx": int | None, "prefill_tps": float | None, "samples": int, "probed_at": float}
+        self.endpoints = {}
+
+    def _endpoint(self, baseurl):
+        with self._lock:
+            endpoint = self.endpoints.get(baseurl)
+        if endpoint is None or (endpoint["n_ctx"] is None and time.monotonic() >= endpoint["probed_at"] + PROBE_RETRY_S):
+            n_ctx = probe_context_size(baseurl, timeout=float(self.conf['context_probe_timeout_s']))
+            with self._lock:
+                endpoint = self.endpoints.setdefault(baseurl, {"n_ctx": None, "prefill_tps": None, "samples": 0})
+                endpoint["n_ctx"] = endpoint["n_ctx"] or n_ctx
+                endpoint["probed_at"] = time.monotonic()
+        return endpoint
+
+    def observe(self, baseurl, prompt_tokens, ttft, timings=None):
+        """Record one request's prefill: server timings if present, else tokens / TTFT."""
+        tps = None
+        if timings:
+            if timings.get("prompt_per_second"):
+                tps = float(timings["prompt_per_second"])
+            elif timings.get("prompt_n") and timings.get("prompt_ms"):
+                tps = 1000.0 * timings["prompt_n"] / timings["prompt_ms"]
+        if tps is None and ttft and prompt_tokens:
+            tps = prompt_tokens / ttft
+        if not tps:
+            return
+        endpoint = self._endpoint(baseurl)
+        with self._lock:
+            previous = endpoint["prefill_tps"]
+            endpoint["prefill_tps"] = tps if previous is None else 0.7 * previous + 0.3 * tps
+            endpoint["samples"] += 1
+
+    def plan(self, baseurls, fixed_tokens=0):
+        """Token budget for the next request to `baseurls`.
+
+        With several endpoints (fan-out) the smallest context and slowest
+        prefill among them are planned for. Returns {"n_ctx", "prefill_tps",
+        "prompt", "history", "midterm", "longterm", "max_tokens", "adaptive"};
+        with adaptive=False the static conf.json sizes are returned unchanged.
+        """
+        conf = self.conf
+        static = {
+            "n_ctx": None,
+            "prefill_tps": None,
+            "prompt": None,
+            "history": int(conf['chat_sliding_window_max_size']),
+            "midterm": int(conf['memory_midterm_max_tokens']),
+            "longterm": int(conf['memory_longterm_max_tokens']),
+            "max_tokens": int(conf['max_tokens']),
+            "adaptive": False,
+        }
+        if not conf['adaptive_context']:
+            return static
+        endpoints = [self._endpoint(url) for url in baseurls]
+        n_ctx = min((e["n_ctx"] for e in endpoints if e["n_ctx"]), default=None)
+        tps = min((e["prefill_tps"] for e in endpoints if e["prefill_tps"]), default=None)
+        if not n_ctx and not tps:
+            return static
+
+        if n_ctx:
+            # Reserve room for the answer, then leave the rest to the prompt
+            output_fraction = float(conf['context_output_fraction'])
+            max_tokens = min(static["max_tokens"], max(int(conf['context_min_output_tokens']), int(n_ctx * output_fraction)))
+            prompt_cap = n_ctx - max_tokens - int(conf['context_safety_margin_tokens'])
+        else:
+            max_tokens = static["max_tokens"]
+            prompt_cap = None
+        if tps:
+            ttft_cap = int(float(conf['target_ttft_s']) * tps)
+            prompt_cap = ttft_cap if prompt_cap is None else min(prompt_cap, ttft_cap)
+
+        split = {**DEFAULT_BUDGET_SPLIT, **conf['context_budget_split']}
+        total_weight = sum(split.values()) or 1.0
+        free = max(0, prompt_cap - fixed_tokens)
+        min_history = int(conf['context_min_history_tokens'])
+        return {
+            "n_ctx": n_ctx,
+            "prefill_tps": tps,
+            "prompt": prompt_cap,
+            "history": max(min_history, int(free * split["history"] / total_weight)),
+            "midterm": int(free * split["midterm"] / total_weight),
+            "longterm": int(free * split["longterm"] / total_weight),
+            "max_tokens": max_tokens,
+            "adaptive": True,
+        }
+
+def describe_plan(plan):
+    """One-line summary of a plan for the per-turn status output."""
+    if not plan["adaptive"]:
+        return f"budget: static · history {plan['history']} · mid-term {plan['midterm']} · long-term {plan['longterm']} · max_tokens {plan['max_tokens']}"
+    parts = []
+    if plan["n_ctx"]:
+        parts.append(f"n_ctx {plan['n_ctx']}")
+    if plan["prefill_tps"]:
+        parts.append(f"prefill {plan['prefill_tps']:.0f} tok/s")
+    parts.append(f"prompt ≤{plan['prompt']}")
+    parts.append(f"history {plan['history']}")
+    parts.append(f"mid-term {plan['midterm']}")
+    parts.append(f"long-term {plan['longterm']}")
+    parts.append(f"max_tokens {plan['max_tokens']}")
+    return "budget: " + " · ".join(parts)
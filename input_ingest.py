@@ -0,0 +1,139 @@
+import hashlib
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Ingestion of oversized user inputs. The original text goes to a local,
+# content-addressed blob store; what enters history (and every later tag,
+# summary and chat request) is a compact stand-in:
+#
+#   [Large input: <chars> chars, ~<tokens> tokens, blob <sha256[:12]>]
+#   Summary: <map-reduce summary>
+#   Beginning: <head excerpt>
+#   End: <tail excerpt>
+#
+# Chunks are summarised in parallel across the endpoints (map), and the
+# chunk summaries are summarised again until they fit the target (reduce).
+
+class BlobStore:
+    """Content-addressed text files under `root`, keyed by SHA-256."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.txt")
+
+    def put(self, text):
+        """Store `text` (idempotent) and return its hex digest."""
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def put_file(self, path, block_size=1 << 20):
+        """Stream a file into the store without reading it whole; returns its digest."""
+        sha = hashlib.sha256()
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f".incoming-{os.getpid()}.tmp")
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for block in iter(lambda: src.read(block_size), b""):
+                sha.update(block)
+                dst.write(block)
+        digest = sha.hexdigest()
+        os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+        os.replace(tmp_path, self.path(digest))
+        return digest
+
+    def get(self, digest):
+        with open(self.path(digest), 'r', encoding='utf-8') as f:
+            return f.read()
+
+def iter_chunks(text, chunk_chars):
+    """Yield pieces of at most ~chunk_chars, split on line boundaries where possible."""
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            newline = text.rfind("\n", start + chunk_chars // 2, end)
+            if newline != -1:
+                end = newline + 1
+        yield text[start:end]
+        start = end
+
+def iter_file_chunks(path, chunk_chars):
+    """Like iter_chunks, but reads the file lazily so only one chunk is in memory."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        carry = ""
+        while True:
+            block = f.read(chunk_chars - len(carry))
+            if not block:
+                if carry:
+                    yield carry
+                return
+            text = carry + block
+            newline = text.rfind("\n", chunk_chars // 2)
+            if newline == -1 or len(text) < chunk_chars:
+                carry = ""
+                yield text
+            else:
+                carry = text[newline + 1:]
+                yield text[:newline + 1]
+
+def _drain(pending, results, on_wait):
+    done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+    for future in done:
+        results[pending.pop(future)] = future.result().strip()
+    if on_wait:
+        on_wait()
+
+def _map(pool, chunks, summarize, endpoints, max_in_flight, on_wait):
+    # Chunks are pulled lazily, so at most max_in_flight of them are held at once
+    results = {}
+    pending = {}
+    for i, chunk in enumerate(chunks):
+        while len(pending) >= max_in_flight:
+            _drain(pending, results, on_wait)
+        pending[pool.submit(summarize, chunk, i + 1, endpoints[i % len(endpoints)])] = i
+    while pending:
+        _drain(pending, results, on_wait)
+    return [results[i] for i in range(len(results))]
+
+def map_reduce(chunks, summarize, endpoints, target_chars, concurrency=4, on_wait=None):
+    """Summarise chunks in parallel, then re-summarise until under target_chars.
+
+    `chunks` may be any iterable (e.g. iter_file_chunks). `summarize(text,
+    part, baseurl)` returns a summary string; endpoints are assigned
+    round-robin. `on_wait()` is called while waiting so the caller can keep
+    a status line alive.
+    """
+    concurrency = max(1, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        summaries = _map(pool, chunks, summarize, endpoints, 2 * concurrency, on_wait)
+        previous_chars = None
+        while True:
+            combined = "\n".join(summaries)
+            if len(combined) <= target_chars or len(summaries) <= 1:
+                return combined
+            if previous_chars is not None and len(combined) >= previous_chars:
+                # Summaries stopped shrinking; cut rather than loop forever
+                return combined[:target_chars]
+            previous_chars = len(combined)
+            # Reduce: regroup the summaries into target-sized chunks and go again
+            summaries = _map(pool, iter_chunks(combined, target_chars), summarize, endpoints, 2 * concurrency, on_wait)
+
+def compact_representation(num_chars, head, tail, digest, summary, approx_tokens):
+    """The stand-in that replaces an oversized input in history."""
+    lines = [
+        f"[Large input: {num_chars} chars, ~{approx_tokens} tokens, blob {digest[:12]}]",
+        f"Summary: {summary}",
+        f"Beginning:\n{head}",
+    ]
+    if tail:
+        lines.append(f"End:\n{tail}")
+    return "\n".join(lines)
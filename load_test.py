@@ -0,0 +1,478 @@
+from openai import OpenAI
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from rich.console import Console
+from rich.table import Table
+
+from chat_history_db import indexed_tag_query, like_tag_query, migrate, post_transaction, result_rows, schema_version, tag_link_statements
+from chat_tags import canonicalize_tags
+from output_parser import BatchTagParser, OutputParser, tag_request_options
+from circuit_breaker import DeadlineExceeded, RemoteGuard
+from config import load_config
+from tag_batching import TagBatcher, batch_tag_prompt
+
+# Load generator for capacity planning of conf['baseurl'] and ws4sqlite.
+# Every simulated session follows main.py's per-turn call pattern:
+#
+#   tagging           streamed tag request to baseurl[1], closed at the list's "]"
+#   retrieval         tag query against chat_history (same SQL as main.py)
+#   chat              streamed answer from baseurl[0]; chat ttft separately
+#   autosave summary  every --autosave-every turns: summary request,
+#   autosave tags     tag request (both baseurl[1]) and the INSERT
+#   autosave write    transaction with its tag links
+#
+# Tag requests of all sessions go through one TagBatcher; with
+# --tag-batch-ms those arriving together share a batched request.
+#
+# Sessions start staggered over --ramp-s and pause for an exponentially
+# distributed think time between turns. Timeouts are the conf.json
+# timeout_budgets; there are no circuit breakers, so every failure counts.
+
+TAGS_PROMPT = (
+    "You will receive a full chat transcript.\n"
+    "Produce ONLY a Python list of at most {max_tags} detailed tags that uniquely identify this chat.\n"
+    "Tags must be strings, lowercase, and specific.\n"
+    "Output format strictly as:\n"
+    "[\"tag1\", \"tag2\", ...]"
+)
+
+SUMMARY_PROMPT = (
+    "You will receive a full chat transcript.\n"
+    "1) Produce a concise, high-signal summary.\n"
+    "2) Then produce a Python list of detailed tags that uniquely identify this chat.\n"
+    "Tags must be strings, lowercase, and specific.\n"
+    "Output format strictly as:\n"
+    "Summary: <one-line or short paragraph>\n"
+    "Tags: [\"tag1\", \"tag2\", ...]"
+)
+
+PROMPT_WORDS = [
+    "how", "do", "i", "fix", "the", "python", "server", "latency", "when", "cache", "misses",
+    "thread", "pool", "blocks", "on", "sqlite", "writes", "why", "does", "my", "query", "plan",
+    "scan", "table", "index", "stream", "tokens", "slowly", "after", "deploy", "config", "reload",
+]
+
+STAGES = ["tagging", "retrieval", "chat ttft", "chat", "autosave summary", "autosave tags", "autosave write"]
+
+class Recorder:
+    """Thread-safe list of per-call records, optionally mirrored to a JSONL file."""
+
+    def __init__(self, out=None):
+        self.records = []
+        self._lock = threading.Lock()
+        self._out = out
+
+    def add(self, **record):
+        with self._lock:
+            self.records.append(record)
+            if self._out is not None:
+                self._out.write(json.dumps(record) + "\n")
+
+def _transcript(history):
+    return "\n\n".join(f"{m['role']}: {m['content']}" for m in history)
+
+def _usage(resp):
+    usage = getattr(resp, 'usage', None)
+    return (getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
+
+class TagRequests:
+    """Single and batched tag requests behind the TagBatcher all sessions share.
+
+    Results are (tags, prompt_tokens, completion_tokens); a batch's usage is
+    split evenly over its items. `requests` counts the requests actually sent.
+    """
+
+    def __init__(self, conf, guard):
+        self.conf = conf
+        self.guard = guard
+        self._lock = threading.Lock()
+        self._llm = {}
+        self.requests = 0
+
+    def _stream(self, baseurl, messages, parser, max_tokens, options):
+        with self._lock:
+            self.requests += 1
+            client = self._llm.get(baseurl)
+            if client is None:
+                client = self._llm[baseurl] = OpenAI(base_url=baseurl, api_key="dummy_api_key", max_retries=0)
+        budget = self.guard.budget("tagging")
+        # Same early stop as main.generate_chat_tags
+        stream = client.chat.completions.create(
+            model="my-model",
+            messages=messages,
+            temperature=0.3,
+            top_p=0.9,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=budget.openai_timeout(stream=True),
+            **options
+        )
+        usage = None
+        deadline = budget.deadline()
+        try:
+            for chunk in stream:
+                if time.perf_counter() > deadline:
+                    raise DeadlineExceeded(f"tagging produced no token for {budget.total:.0f}s")
+                usage = getattr(chunk, 'usage', None) or usage
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    deadline = budget.deadline()
+                    if parser.feed(text):
+                        break
+        finally:
+            stream.close()
+        parser.close()
+        return getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+
+    def one(self, baseurl, transcript):
+        max_tags = int(self.conf['tag_max_count'])
+        parser = OutputParser(max_items=max_tags)
+        usage = self._stream(baseurl, [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": TAGS_PROMPT.format(max_tags=max_tags) + "\n\nTranscript:\n" + transcript},
+        ], parser, int(self.conf['tag_max_tokens']), tag_request_options(max_tags, self.conf['tag_output_constraint']))
+        return (parser.tags, *usage)
+
+    def batch(self, baseurl, transcripts):
+        max_tags = int(self.conf['tag_max_count'])
+        count = len(transcripts)
+        parser = BatchTagParser(count, max_items=max_tags)
+        usage = self._stream(baseurl, [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": batch_tag_prompt(transcripts, max_tags)},
+        ], parser, int(self.conf['tag_max_tokens']) * count,
+            tag_request_options(max_tags, self.conf['tag_output_constraint'], batch_size=count))
+        share = [None if tokens is None else tokens / count for tokens in usage]
+        return [None if tags is None else (tags, *share) for tags in parser.tags]
+
+class LoadSession:
+    """One simulated user: a thread running `turns` turns against the endpoints."""
+
+    def __init__(self, n, conf, args, guard, tagger, recorder, run_start, schema):
+        self.n = n
+        self.conf = conf
+        self.args = args
+        self.guard = guard
+        self.tagger = tagger
+        self.recorder = recorder
+        self.run_start = run_start
+        self.schema = schema
+        self.rng = random.Random(args.seed * 100003 + n)
+        self.owner = {"workspace": args.workspace, "user_id": f"load-{n}"}
+        self.history = []
+        self.turn = 0
+        self.llm = {url: OpenAI(base_url=url, api_key="dummy_api_key", max_retries=0) for url in set(conf['baseurl'][:2])}
+
+    def _timed(self, stage, func):
+        """Run func() -> (result, prompt_tokens, completion_tokens) and record it."""
+        started = time.perf_counter()
+        error = None
+        result, prompt_tokens, completion_tokens = None, None, None
+        try:
+            result, prompt_tokens, completion_tokens = func()
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)[:200]}"
+        self.recorder.add(
+            session=self.n, turn=self.turn, stage=stage,
+            start_s=round(started - self.run_start, 4),
+            latency_s=round(time.perf_counter() - started, 4),
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            error=error,
+        )
+        return result if error is None else None
+
+    def _complete(self, baseurl, stage, budget_stage, messages, max_tokens, temperature=0.3):
+        def _call():
+            resp = self.llm[baseurl].chat.completions.create(
+                model="my-model",
+                messages=messages,
+                temperature=temperature,
+                top_p=0.9,
+                max_tokens=max_tokens,
+                stream=False,
+                timeout=self.guard.budget(budget_stage).openai_timeout(),
+            )
+            content = resp.choices[0].message.content if resp and resp.choices else ""
+            return (content, *_usage(resp))
+        return self._timed(stage, _call)
+
+    def _history(self, stage, budget_stage, transaction):
+        budget = self.guard.budget(budget_stage)
+        return self._timed(stage, lambda: (post_transaction(self.conf, transaction, timeout=budget.requests_timeout()), None, None))
+
+    def _tags(self, stage, history, user_input=None):
+        transcript = _transcript(history + ([{"role": "user", "content": user_input}] if user_input else []))
+        # Shared by all sessions: concurrent requests may go out as one batch
+        tags = self._timed(stage, lambda: self.tagger.tag(self.conf['baseurl'][1], transcript))
+        return canonicalize_tags(tags or [], self.conf['tag_synonyms'], max_tags=int(self.conf['tag_max_count']))
+
+    def _retrieve(self, tags):
+        if not tags:
+            return
+        keys = [f"t{i}" for i in range(len(tags))]
+        values = {"limit": int(self.conf['max_chat_history_results'])}
+        owner_columns = ["workspace", "user_id"] if self.schema >= 2 else []
+        values.update({column: self.owner[column] for column in owner_columns})
+        if self.schema >= 1:
+            values.update(zip(keys, tags))
+            sql = indexed_tag_query(keys, owner_columns)
+        else:
+            values.update((key, f"%{tag}%") for key, tag in zip(keys, tags))
+            sql = like_tag_query(keys, owner_columns)
+        data = self._history("retrieval", "retrieval", [{"query": sql, "values": values}])
+        return result_rows(data) if data else []
+
+    def _chat(self, user_input):
+        messages = [{"role": "system", "content": "You are a helpful AI assistant."}] + self.history + [
+            {"role": "user", "content": user_input}
+        ]
+        budget = self.guard.budget("chat")
+        started = time.perf_counter()
+        parts = []
+
+        def _call():
+            stream = self.llm[self.conf['baseurl'][0]].chat.completions.create(
+                model="my-model",
+                messages=messages,
+                temperature=0.99,
+                top_p=0.95,
+                max_tokens=self.args.max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=budget.openai_timeout(stream=True),
+            )
+            usage = None
+            first_token_at = None
+            deadline = budget.deadline(started)
+            try:
+                for chunk in stream:
+                    if time.perf_counter() > deadline:
+                        raise DeadlineExceeded(f"chat stream produced no token for {budget.total:.0f}s")
+                    if getattr(chunk, 'usage', None) is not None:
+                        usage = chunk.usage
+                    if chunk.choices:
+                        delta = chunk.choices[0].delta
+                        text = getattr(delta, 'reasoning_content', None) or delta.content or ""
+                        if text:
+                            deadline = budget.deadline()
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                self.recorder.add(
+                                    session=self.n, turn=self.turn, stage="chat ttft",
+                                    start_s=round(started - self.run_start, 4),
+                                    latency_s=round(first_token_at - started, 4),
+                                    prompt_tokens=None, completion_tokens=None, error=None,
+                                )
+                            parts.append(text)
+            finally:
+                stream.close()
+            return ("".join(parts), getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
+
+        return self._timed("chat", _call)
+
+    def _autosave(self):
+        content = self._complete(self.conf['baseurl'][1], "autosave summary", "autosave", [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": SUMMARY_PROMPT + "\n\nTranscript:\n" + _transcript(self.history)},
+        ], max_tokens=512, temperature=0.5)
+        tags = self._tags("autosave tags", self.history)
+        if content is None or self.args.no_writes:
+            return
+        summary = content.split("Summary:")[-1].split("Tags:")[0].strip()[:1000]
+        now = datetime.now()
+        values = {"summary": summary, "tags": " ".join(sorted(set(tags)))[:1024],
+                  "date": now.strftime("%Y-%m-%d"), "time": now.strftime("%H:%M:%S")}
+        if self.schema >= 2:
+            statement = ("INSERT INTO chat_history (summary, tags, date, time, workspace, user_id, session_id) "
+                         "VALUES (:summary, :tags, :date, :time, :workspace, :user_id, :session_id)")
+            values.update(self.owner, session_id=f"load-{self.n}")
+        else:
+            statement = "INSERT INTO chat_history (summary, tags, date, time) VALUES (:summary, :tags, :date, :time)"
+        transaction = [{"statement": statement, "values": values}]
+        if self.schema >= 1:
+            transaction += tag_link_statements(tags, owner=self.owner if self.schema >= 2 else None)
+        self._history("autosave write", "history_write", transaction)
+
+    def run(self, stop):
+        args = self.args
+        for self.turn in range(args.turns):
+            if stop.is_set():
+                return
+            user_input = " ".join(self.rng.choice(PROMPT_WORDS) for _ in range(args.prompt_words)) + "?"
+            tags = self._tags("tagging", self.history, user_input)
+            self._retrieve(tags)
+            answer = self._chat(user_input)
+            self.history += [{"role": "user", "content": user_input}, {"role": "assistant", "content": answer or ""}]
+            # Keep a sliding window of recent messages, like main.py's history
+            self.history = self.history[-args.window_messages:]
+            if args.autosave_every and (self.turn + 1) % args.autosave_every == 0:
+                self._autosave()
+            if args.think_s > 0 and self.turn + 1 < args.turns:
+                stop.wait(self.rng.expovariate(1.0 / args.think_s))
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize_records(records):
+    """Per-stage {"stage", "calls", "errors", "p50", "p95", "p99", "mean", "max"} in STAGES order."""
+    by_stage = {}
+    for r in records:
+        by_stage.setdefault(r["stage"], []).append(r)
+    summary = []
+    for stage in STAGES + sorted(set(by_stage) - set(STAGES)):
+        rows = by_stage.get(stage)
+        if not rows:
+            continue
+        latencies = sorted(r["latency_s"] for r in rows if r["error"] is None)
+        summary.append({
+            "stage": stage,
+            "calls": len(rows),
+            "errors": sum(1 for r in rows if r["error"] is not None),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        })
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many concurrent AI Sidekick sessions against the LLM and chat_history servers")
+    parser.add_argument("--conf", default="conf.json", help="Path to conf.json (endpoints, history server, timeout budgets)")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent simulated sessions")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session")
+    parser.add_argument("--think-s", type=float, default=2.0, help="Mean think time between turns (exponential)")
+    parser.add_argument("--ramp-s", type=float, default=5.0, help="Spread session starts over this many seconds")
+    parser.add_argument("--autosave-every", type=int, default=3, help="Autosave every N turns (0 = never)")
+    parser.add_argument("--prompt-words", type=int, default=40, help="Words per simulated user message")
+    parser.add_argument("--window-messages", type=int, default=8, help="Messages of history kept per session")
+    parser.add_argument("--max-tokens", type=int, default=512, help="max_tokens for the chat stream")
+    parser.add_argument("--endpoint", action="append", default=None, help="LLM base URL (repeatable; first answers, second tags)")
+    parser.add_argument("--history-url", default=None, help="ws4sqlite chat_history URL (defaults to conf.json)")
+    parser.add_argument("--workspace", default="loadtest", help="Workspace the simulated users write to")
+    parser.add_argument("--no-writes", action="store_true", help="Skip the autosave INSERT (read-only against real servers)")
+    parser.add_argument("--mock", action="store_true", help="Run against local mock LLM and chat_history servers")
+    parser.add_argument("--mock-prefill-tps", type=float, default=2000.0)
+    parser.add_argument("--mock-decode-tps", type=float, default=80.0)
+    parser.add_argument("--mock-slots", type=int, default=4, help="Concurrent completions the mock LLM serves before queueing")
+    parser.add_argument("--tag-batch-ms", type=float, default=None, help="Tag batching window (defaults to conf tag_batch_window_ms; 0 = off)")
+    parser.add_argument("--tag-batch-max", type=int, default=None, help="Most transcripts per batched tag request (defaults to conf tag_batch_max_items)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Write per-call records to this JSONL file")
+    args = parser.parse_args()
+
+    conf = load_config(args.conf)
+
+    console = Console()
+
+    if args.mock:
+        from mock_servers import start_mock_history_server, start_mock_llm_server
+        _, llm_url = start_mock_llm_server(
+            prefill_tps=args.mock_prefill_tps, decode_tps=args.mock_decode_tps, slots=args.mock_slots
+        )
+        _, history_url = start_mock_history_server()
+        conf['baseurl'] = [llm_url, llm_url]
+        conf['chat_history_server_url'] = history_url
+        migrate(conf, console=console)
+    if args.endpoint:
+        conf['baseurl'] = args.endpoint if len(args.endpoint) > 1 else args.endpoint * 2
+    if args.history_url:
+        conf['chat_history_server_url'] = args.history_url
+
+    schema = schema_version(conf)
+    guard = RemoteGuard(conf)
+    tag_requests = TagRequests(conf, guard)
+    tagger = TagBatcher(
+        tag_requests.one,
+        tag_requests.batch,
+        window_s=(conf['tag_batch_window_ms'] if args.tag_batch_ms is None else args.tag_batch_ms) / 1000.0,
+        max_items=conf['tag_batch_max_items'] if args.tag_batch_max is None else args.tag_batch_max,
+    )
+    console.print(
+        f"[bold blue]{args.sessions} sessions x {args.turns} turns[/bold blue] · "
+        f"chat {conf['baseurl'][0]} · tags {conf['baseurl'][1]} · history {conf['chat_history_server_url']} (schema v{schema})",
+        highlight=False
+    )
+
+    out = open(args.out, 'w', encoding='utf-8') if args.out else None
+    recorder = Recorder(out)
+    stop = threading.Event()
+    run_start = time.perf_counter()
+    sessions = [LoadSession(n, conf, args, guard, tagger, recorder, run_start, schema) for n in range(args.sessions)]
+
+    def _start(session):
+        # Stagger starts so the run ramps up instead of arriving as one burst
+        stop.wait(args.ramp_s * session.n / max(1, args.sessions))
+        session.run(stop)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.sessions)) as pool:
+            pending = {pool.submit(_start, session) for session in sessions}
+            while pending:
+                done, pending = wait(pending, timeout=1.0)
+                for future in done:
+                    future.result()
+                records = recorder.records
+                chats = sum(1 for r in records if r["stage"] == "chat")
+                errors = sum(1 for r in records if r["error"] is not None)
+                console.print(
+                    f"[dim]{time.perf_counter() - run_start:6.1f}s · {chats}/{args.sessions * args.turns} turns · {errors} errors[/dim]",
+                    end="\r", highlight=False
+                )
+    except KeyboardInterrupt:
+        stop.set()
+        console.print("\n[yellow]Stopping; in-flight requests finish first.[/yellow]")
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - run_start
+    records = recorder.records
+
+    def _fmt(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    table = Table(title=f"Latency per stage over {elapsed:.1f}s (seconds; errors excluded from percentiles)")
+    for column in ["stage", "calls", "errors", "error %", "p50", "p95", "p99", "mean", "max"]:
+        table.add_column(column, justify="right")
+    for s in summarize_records(records):
+        table.add_row(
+            s["stage"], str(s["calls"]), str(s["errors"]), f"{100.0 * s['errors'] / s['calls']:.1f}",
+            _fmt(s["p50"]), _fmt(s["p95"]), _fmt(s["p99"]), _fmt(s["mean"]), _fmt(s["max"]),
+        )
+    console.print(table)
+
+    turns = sum(1 for r in records if r["stage"] == "chat" and r["error"] is None)
+    llm_calls = sum(1 for r in records if r["stage"] in ("chat", "autosave summary")) + tag_requests.requests
+    history_calls = sum(1 for r in records if r["stage"] in ("retrieval", "autosave write"))
+    completion_tokens = sum(r["completion_tokens"] or 0 for r in records)
+    errors = sum(1 for r in records if r["error"] is not None)
+    console.print(
+        f"Throughput: {turns / elapsed:.2f} turns/s · {llm_calls / elapsed:.2f} LLM requests/s · "
+        f"{history_calls / elapsed:.2f} history requests/s · {completion_tokens / elapsed:.0f} completion tok/s · "
+        f"errors {errors}/{len(records)} ({100.0 * errors / max(1, len(records)):.1f}%)",
+        highlight=False
+    )
+    batching = tagger.stats()
+    if batching["batches"]:
+        console.print(
+            f"Tag batching: {batching['batched_items']} of {sum(1 for r in records if r['stage'] in ('tagging', 'autosave tags'))} "
+            f"tag calls in {batching['batches']} batches (mean {batching['batched_items'] / batching['batches']:.1f}), "
+            f"{batching['retried_items']} retried alone · {tag_requests.requests} tag requests sent",
+            highlight=False
+        )
+    first_errors = {}
+    for r in records:
+        if r["error"] is not None:
+            first_errors.setdefault(r["stage"], r["error"])
+    for stage, error in first_errors.items():
+        console.print(f"[red]  {stage}: {error}[/red]", highlight=False)
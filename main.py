@@ -1,100 +1,158 @@
 from openai import OpenAI
 import os
-import json
-import tiktoken
+import argparse
+import math
 import signal
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.panel import Panel
 from rich.text import Text
 import requests
-import re
-import ast
 from datetime import datetime
 import threading
+import queue
 import time
-from contextlib import contextmanager
-
-# Global spinner state (supports nested usage across functions)
-_spinner_lock = threading.Lock()
-_spinner_counter = 0
-_spinner_stop_event = None
-_spinner_thread = None
-
-def _spinner_worker(stop_event):
-    frames = ["-", "/", "|", "\\"]
-    i = 0
-    local_console = Console()
-    while not stop_event.is_set():
-        frame = frames[i % len(frames)]
-        local_console.print(f"[dim]{frame}[/dim]", end="\r", highlight=False)
-        i += 1
-        time.sleep(0.08)
-
-def start_processing_spinner():
-    """Start a subtle, global inline spinner. Returns a stop() callable.
-
-    Safe for nested calls; only the outermost start actually spawns the thread.
+from renderer import OutputRenderer
+from chat_tags import canonicalize_tags, get_tag_vocabulary
+from chat_history_db import (
+    history_owner, history_server, indexed_tag_query, like_tag_query, post_transaction, result_rows,
+    schema_version, tag_link_statements,
+)
+from circuit_breaker import CircuitOpenError, DeadlineExceeded, RemoteGuard, is_outage
+from ranking import score_summaries
+from response_cache import load_response_cache
+from context_budget import ContextBudget, describe_plan
+from input_ingest import BlobStore, compact_representation, iter_chunks, iter_file_chunks, map_reduce
+from memory_tiers import fit_to_budget, load_tiered_memory
+from session_log import SessionLog, latest_session_id, new_session_id, session_path
+from token_counting import MESSAGE_OVERHEAD_TOKENS, TokenLedger, format_ledger, load_token_counter
+from profiling import profiler
+from output_parser import BatchTagParser, OutputParser, parse_summary, parse_summary_and_tags, tag_request_options
+from summary_index import get_summary_index
+from config import ConfigError, load_config
+from tag_batching import TagBatcher, batch_tag_prompt
+
+# One renderer owns the terminal: all output and the pipeline stage status line
+renderer = OutputRenderer()
+
+class ShutdownCoordinator:
+    """Ctrl+C handling that never does real work inside the signal handler.
+
+    The first Ctrl+C only sets a flag and raises KeyboardInterrupt in the main
+    thread, which cancels the in-flight stream (query_llm keeps the partial
+    answer) or the pending input(). The REPL then runs the autosave on a
+    background thread with a hard deadline. A second Ctrl+C exits immediately.
     """
-    global _spinner_counter, _spinner_thread, _spinner_stop_event
-    with _spinner_lock:
-        if _spinner_counter == 0:
-            _spinner_stop_event = threading.Event()
-            _spinner_thread = threading.Thread(target=_spinner_worker, args=(_spinner_stop_event,), daemon=True)
-            _spinner_thread.start()
-        _spinner_counter += 1
-
-    def _stop():
-        global _spinner_counter, _spinner_stop_event
-        with _spinner_lock:
-            if _spinner_counter > 0:
-                _spinner_counter -= 1
-                if _spinner_counter == 0 and _spinner_stop_event is not None:
-                    _spinner_stop_event.set()
-                    try:
-                        Console().print(" " * 10, end="\r")
-                    except Exception:
-                        pass
-    return _stop
-
-@contextmanager
-def processing_spinner():
-    """Context manager wrapper around start_processing_spinner()."""
-    stop = start_processing_spinner()
-    try:
-        yield
-    finally:
-        stop()
 
-with open('conf.json') as f:
-    conf = json.load(f)
+    def __init__(self):
+        self.requested = threading.Event()
+
+    def handle_sigint(self, signum, frame):
+        if self.requested.is_set():
+            # Second Ctrl+C: no cleanup, no waiting
+            os.write(2, b"\nForced exit.\n")
+            os._exit(130)
+        self.requested.set()
+        raise KeyboardInterrupt
+
+    def flush(self, func, deadline):
+        """Run func() on a daemon thread, waiting at most `deadline` seconds.
+
+        Returns True if it finished in time.
+        """
+        worker = threading.Thread(target=func, daemon=True)
+        worker.start()
+        worker.join(deadline)
+        return not worker.is_alive()
 
-# Get chat sliding window size from config, default to 4000 tokens if not specified
-CHAT_SLIDING_WINDOW_MAX_TOKENS = conf.get('chat_sliding_window_max_size', 4000)
+# Validated against config.FIELDS (defaults live there); edits are applied between turns
+try:
+    conf = load_config('conf.json')
+except ConfigError as e:
+    print(e)
+    raise SystemExit(1)
+
+# Token counts from the served model's tokenizer where configured (see token_counting.py)
+token_counter = load_token_counter(conf)
+# Prompt/completion tokens per stage, taken from the servers' usage blocks
+token_ledger = TokenLedger(token_counter)
+
+# Backend context sizes and prefill throughput, used to size each turn's prompt
+context_budget = ContextBudget(conf)
+
+# Per-stage timeout budgets and one circuit breaker per endpoint
+remote_guard = RemoteGuard(conf)
+
+# Set to False once the history server turns out not to have the tag index tables
+_tag_index_available = True
+
+# Set once the history server's schema version is known; partitioning needs migration 2
+_history_schema_version = None
+
+# Set to False when summary_index_enabled is on but numpy is missing
+_summary_index_available = True
 
 # Prevent double-saving on autosave and Ctrl+C in quick succession
 keyboard_interupt_double_autosave_prevention_bool = False
 
+def _llm_probe(baseurl):
+    def probe():
+        budget = remote_guard.budget("retrieval")
+        requests.get(f"{baseurl.rstrip('/')}/models", timeout=budget.requests_timeout()).raise_for_status()
+    return probe
+
+def create_completion(baseurl, stage, **params):
+    """chat.completions.create within the stage's timeout budget and the endpoint's breaker.
+
+    Raises CircuitOpenError at once while the endpoint is known to be down.
+    """
+    def _create(budget):
+        client = OpenAI(
+            base_url=baseurl,
+            api_key="dummy_api_key",
+            timeout=budget.openai_timeout(stream=params.get('stream', False)),
+            # The breaker decides when to try again, not the client
+            max_retries=0
+        )
+        return client.chat.completions.create(model="my-model", **params)
+    return remote_guard.call(baseurl, stage, _create, probe=_llm_probe(baseurl))
+
+def _history_probe(conf):
+    def probe():
+        post_transaction(conf, [{"query": "SELECT 1"}], timeout=remote_guard.budget("retrieval").requests_timeout())
+    return probe
+
+def history_transaction(conf, stage, transaction):
+    """post_transaction within the stage's timeout budget and the history server's breaker."""
+    server_url, _ = history_server(conf)
+    return remote_guard.call(
+        server_url, stage,
+        lambda budget: post_transaction(conf, transaction, timeout=budget.requests_timeout()),
+        probe=_history_probe(conf)
+    )
+
+def history_available(conf):
+    return remote_guard.available(history_server(conf)[0])
+
+@profiler.profiled()
 def count_tokens(messages):
     """Count the total number of tokens in a list of messages."""
     try:
-        encoding = tiktoken.get_encoding("cl100k_base")  # This is used by gpt-3.5-turbo and gpt-4
-        num_tokens = 0
-        for message in messages:
-            # Every message follows format: {"role": "user", "content": "..."} 
-            # Add 4 tokens for message format overhead
-            num_tokens += 4
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-        return num_tokens
+        # Every message follows format: {"role": "user", "content": "..."},
+        # plus 4 tokens for message format overhead
+        return token_counter.count_messages(messages)
     except Exception as e:
         print(f"Warning: Could not count tokens accurately: {str(e)}")
         # Fallback to rough character-based estimate
         return sum(len(str(m.get('content', ''))) // 4 for m in messages)
 
 
-def generate_chat_tags(history, conf, system_prompt, current_user_input=None):
-    """Generate detailed, lowercase tags from the chat transcript using the LLM."""
+@profiler.profiled()
+def generate_chat_tags(history, conf, system_prompt, current_user_input=None, with_raw=False):
+    """Generate detailed, lowercase tags from the chat transcript using the LLM.
+
+    With `with_raw` returns (canonical tags, the model's tags as written).
+    """
     # Build conversation text; include current user input when provided
     parts = [
         f"{m.get('role', 'user')}: {m.get('content', '')}" for m in history
@@ -103,13 +161,53 @@ def generate_chat_tags(history, conf, system_prompt, current_user_input=None):
         parts.append(f"user: {current_user_input}")
     conversation_text = "\n\n".join(parts)
 
-    llm_base_url = conf['baseurl'][1]
-    client = OpenAI(base_url=llm_base_url, api_key="dummy_api_key")
+    # A single REPL rarely overlaps tag requests, so batching (off by default) only
+    # pays off for callers that share this process, such as load_test
+    with renderer.stage("tagging"):
+        tags = tag_batcher.tag((conf['baseurl'][1], system_prompt or "You are a helpful assistant."), conversation_text)
+
+    # Canonicalise in a single pass per tag (synonym folding, stemming, dedupe)
+    canonical = canonicalize_tags(tags, conf['tag_synonyms'], max_tags=int(conf['tag_max_count']))
+    if with_raw:
+        return canonical, [str(tag) for tag in tags]
+    return canonical
 
-    system_msg = system_prompt or "You are a helpful assistant."
+def _stream_tag_reply(llm_base_url, messages, parser, max_tokens, options):
+    """Stream a tag request into `parser`, closing it as soon as the parser is done."""
+    generated = []
+    meta = {}
+    stream = create_completion(
+        llm_base_url,
+        "tagging",
+        messages=messages,
+        temperature=0.3,
+        top_p=0.9,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+        **options
+    )
+    try:
+        for kind, text in iter_stream_deltas(stream, meta, llm_base_url, stage="tagging"):
+            generated.append(text)
+            renderer.tick()
+            if kind == "content" and parser.feed(text):
+                break
+    finally:
+        stream.close()
+    parser.close()
+
+    # Without the final usage chunk (stopped early) the ledger estimates
+    # locally rather than holding the tag request up on a /tokenize round trip
+    token_ledger.record("tagging", meta.get('usage'), messages, "".join(generated), local=True)
+
+def request_chat_tags(key, conversation_text):
+    """Tags for one transcript from the tagging endpoint; key is (baseurl, system message)."""
+    llm_base_url, system_msg = key
+    max_tags = int(conf['tag_max_count'])
     prompt = (
         "You will receive a full chat transcript.\n"
-        "Produce ONLY a Python list of detailed tags that uniquely identify this chat.\n"
+        f"Produce ONLY a Python list of at most {max_tags} detailed tags that uniquely identify this chat.\n"
         "Tags must be strings, lowercase, and specific.\n"
         "Output format strictly as:\n"
         "[\"tag1\", \"tag2\", ...]"
@@ -120,61 +218,129 @@ def generate_chat_tags(history, conf, system_prompt, current_user_input=None):
         {"role": "user", "content": prompt + "\n\nTranscript:\n" + conversation_text},
     ]
 
-    with processing_spinner():
-        resp = client.chat.completions.create(
-            model="my-model",
-            messages=messages,
-            temperature=0.3,
-            top_p=0.9,
-            max_tokens=2048,
-            stream=False,
+    # Streamed so the request can be closed as soon as the list is complete
+    # instead of waiting out whatever the model adds after it
+    parser = OutputParser(max_items=max_tags)
+    _stream_tag_reply(
+        llm_base_url, messages, parser, int(conf['tag_max_tokens']),
+        tag_request_options(max_tags, conf['tag_output_constraint'])
+    )
+    return parser.tags
+
+def request_chat_tag_batch(key, conversation_texts):
+    """Tags for several transcripts from one request; None for those the reply misses."""
+    llm_base_url, system_msg = key
+    max_tags = int(conf['tag_max_count'])
+    count = len(conversation_texts)
+    messages = [
+        {"role": "system", "content": system_msg},
+        {"role": "user", "content": batch_tag_prompt(conversation_texts, max_tags)},
+    ]
+    parser = BatchTagParser(count, max_items=max_tags)
+    _stream_tag_reply(
+        llm_base_url, messages, parser, int(conf['tag_max_tokens']) * count,
+        tag_request_options(max_tags, conf['tag_output_constraint'], batch_size=count)
+    )
+    return parser.tags
+
+# tag_batch_window_ms 0 sends each tag request on its own
+tag_batcher = TagBatcher(
+    request_chat_tags,
+    request_chat_tag_batch,
+    window_s=conf['tag_batch_window_ms'] / 1000.0,
+    max_items=conf['tag_batch_max_items'],
+)
+
+def _disable_tag_index(console, error):
+    """Fall back to the legacy tags column for the rest of the session."""
+    global _tag_index_available
+    _tag_index_available = False
+    console.print(
+        f"[dim]Tag index unavailable ({str(error)}); using LIKE matching. "
+        "Run 'python chat_history_db.py' to migrate the chat_history schema.[/dim]"
+    )
+
+def _use_tag_index(conf):
+    return _tag_index_available and conf['chat_history_tag_index']
+
+def _history_partition(conf):
+    """This instance's {"workspace", "user_id"}, or None before migration 2.
+
+    Raises requests.RequestException or CircuitOpenError while the schema
+    version is unknown, so nothing is read or written unpartitioned on a
+    guess; only a version the server reported is kept for the session.
+    """
+    global _history_schema_version
+    if _history_schema_version is None:
+        server_url, _ = history_server(conf)
+        _history_schema_version = remote_guard.call(
+            server_url, "retrieval",
+            lambda budget: schema_version(conf, timeout=budget.requests_timeout()),
+            probe=_history_probe(conf)
         )
+        if _history_schema_version < 2:
+            renderer.console.print(
+                "[dim]chat_history is not partitioned per user; retrieval sees every user's chats. "
+                "Run 'python chat_history_db.py' to migrate the chat_history schema.[/dim]"
+            )
+    return history_owner(conf) if _history_schema_version >= 2 else None
 
-    content = resp.choices[0].message.content if resp and resp.choices else ""
+def _owner_columns(conf, owner):
+    """Columns retrieval filters on for conf['chat_history_scope'] ("user", "workspace" or "all")."""
+    scope = conf['chat_history_scope']
+    if owner is None or scope not in ("user", "workspace"):
+        return []
+    return ["workspace", "user_id"] if scope == "user" else ["workspace"]
 
-    tags_list = []
-    m_list = re.search(r"\[(?:.|\n)*?\]", content)
-    if m_list:
-        candidate = m_list.group(0)
-        try:
-            parsed = ast.literal_eval(candidate)
-            if isinstance(parsed, list):
-                tags_list = [str(t).strip().lower() for t in parsed if str(t).strip()]
-        except Exception:
-            pass
-    if not tags_list:
-        tags_list = [t.lower() for t in re.findall(r"['\"]([^'\"]+)['\"]", content)]
-
-    # Normalize: lowercase already; replace spaces with '-', remove invalid chars, collapse '-' runs
-    normalized = []
-    seen = set()
-    for raw in tags_list:
-        t = str(raw).strip().lower()
-        if not t or t == 'empty_transcript':
-            continue
-        t = re.sub(r"\s+", "-", t)
-        t = re.sub(r"[^a-z0-9\-]", "-", t)
-        t = re.sub(r"-+", "-", t).strip('-')
-        if not t:
-            continue
-        if t in seen:
-            continue
-        seen.add(t)
-        normalized.append(t)
-
-    return normalized
-
-
-def save_chat(history, conf, system_prompt):
+def _summary_index(conf):
+    """This user's local recall index when conf['summary_index_enabled'], else None."""
+    global _summary_index_available
+    if not (_summary_index_available and conf['summary_index_enabled']):
+        return None
+    owner = history_owner(conf)
+    scope = conf['chat_history_scope']
+    key = {"user": f"{owner['workspace']}.{owner['user_id']}", "workspace": owner['workspace']}.get(scope, "all")
+    try:
+        return get_summary_index(conf, "".join(c if c.isalnum() or c in "._-" else "_" for c in key))
+    except ImportError as e:
+        _summary_index_available = False
+        renderer.console.print(f"[dim]{str(e)}; recalling from the history server instead.[/dim]")
+        return None
+
+def _sync_summary_index(index, conf):
+    """Pull chat_history changes into the local index when due and the server is up."""
+    if not index.sync_due() or not history_available(conf):
+        return
+    try:
+        owner = _history_partition(conf)
+        with renderer.stage("retrieval"):
+            index.sync(
+                lambda sql, values: result_rows(history_transaction(conf, "retrieval", [{"query": sql, "values": values}])),
+                _owner_columns(conf, owner), owner,
+                interval_s=float(conf['summary_index_sync_interval_s']),
+                on_wait=renderer.tick,
+            )
+    except (requests.RequestException, CircuitOpenError) as e:
+        renderer.console.print(f"[dim]Summary index sync failed ({str(e)}); recalling from the local copy.[/dim]", highlight=False)
+
+@profiler.profiled()
+def save_chat(history, conf, system_prompt, session_id=None):
     """Summarize chat via LLM and save to ws4sqlite server."""
-    console = Console()
+    console = renderer.console
+    if not history_available(conf):
+        # No point spending two LLM calls on a summary that can't be stored
+        console.print(Panel(
+            Text(f"Chat autosave skipped: history server {history_server(conf)[0]} is down", style="bold yellow"),
+            title="Autosave",
+            border_style="yellow"
+        ))
+        return
     try:
         conversation_text = "\n\n".join(
             f"{m.get('role', 'user')}: {m.get('content', '')}" for m in history
         )
 
         llm_base_url = conf['baseurl'][1]
-        client = OpenAI(base_url=llm_base_url, api_key="dummy_api_key")
 
         system_msg = system_prompt or "You are a helpful assistant."
         prompt = (
@@ -192,61 +358,37 @@ def save_chat(history, conf, system_prompt):
             {"role": "user", "content": prompt + "\n\nTranscript:\n" + conversation_text},
         ]
 
-        with processing_spinner():
-            resp = client.chat.completions.create(
-                model="my-model",
+        # Streamed so the status line keeps ticking while the summary is written
+        content_parts = []
+        meta = {}
+        with renderer.stage("autosave summary"):
+            stream = create_completion(
+                llm_base_url,
+                "autosave",
                 messages=messages,
                 temperature=0.5,
                 top_p=0.9,
                 max_tokens=8192,
-                stream=False,
+                stream=True,
+                stream_options={"include_usage": True},
             )
+            try:
+                for kind, text in iter_stream_deltas(stream, meta, llm_base_url, stage="autosave"):
+                    if kind == "content":
+                        content_parts.append(text)
+                    renderer.tick()
+            finally:
+                stream.close()
 
-        content = resp.choices[0].message.content if resp and resp.choices else ""
-
-        m_sum = re.search(r"Summary:\s*(.+)", content, re.IGNORECASE | re.DOTALL)
-        summary = ""
-        if m_sum:
-            summary = m_sum.group(1).strip()
-            summary = re.split(r"\n\s*Tags:\s*\[", summary)[0].strip()
-        if not summary:
-            summary = content.strip()[:1000]
+        content = "".join(content_parts)
+        token_ledger.record("autosave summary", meta.get('usage'), messages, content)
+        summary = parse_summary(content)
 
         # Use shared tag generator for consistency
         tags_list = generate_chat_tags(history, conf, system_prompt)
-        tags_field = " ".join(sorted(set(tags_list)))[:1024]
-
-        now = datetime.now()
-        date_str = now.strftime("%Y-%m-%d")
-        time_str = now.strftime("%H:%M:%S")
-
-        server_url = conf.get('chat_history_server_url') or "http://127.0.0.1:12321/chat_history"
-        auth_user = conf.get('chat_history_server_auth_user') or "admin"
-        auth_pass = conf.get('chat_history_server_auth_pass') or "YourSuperSecretPass123"
-
-        payload = {
-            "transaction": [
-                {
-                    "statement": "INSERT INTO chat_history (summary, tags, date, time) VALUES (:summary, :tags, :date, :time)",
-                    "values": {
-                        "summary": summary,
-                        "tags": tags_field,
-                        "date": date_str,
-                        "time": time_str,
-                    },
-                }
-            ]
-        }
 
-        with processing_spinner():
-            r = requests.post(
-                server_url,
-                json=payload,
-                auth=(auth_user, auth_pass),
-                headers={"Content-Type": "application/json"},
-                timeout=10,
-            )
-        r.raise_for_status()
+        with renderer.stage("autosave"):
+            store_chat_summary(summary, tags_list, conf, session_id)
 
         console.print()
         console.print(Panel(
@@ -261,15 +403,290 @@ def save_chat(history, conf, system_prompt):
             border_style="red"
         ))
 
-def find_chat_summaries(history, conf, system_prompt, current_user_input=None):
+def store_chat_summary(summary, tags_list, conf, session_id=None):
+    """Insert one chat_history row (and its tag links) for a summary.
+
+    Once the store is partitioned the row is owned by this workspace/user
+    and tagged with `session_id`.
+    """
+    tags_field = " ".join(sorted(set(tags_list)))[:1024]
+    vocabulary = get_tag_vocabulary(conf)
+    vocabulary.ids_for(tags_list)
+    vocabulary.save()
+
+    now = datetime.now()
+    date_str = now.strftime("%Y-%m-%d")
+    time_str = now.strftime("%H:%M:%S")
+
+    insert_row = {
+        "statement": "INSERT INTO chat_history (summary, tags, date, time) VALUES (:summary, :tags, :date, :time)",
+        "values": {
+            "summary": summary,
+            "tags": tags_field,
+            "date": date_str,
+            "time": time_str,
+        },
+    }
+    owner = _history_partition(conf)
+    if owner is not None:
+        insert_row = {
+            "statement": "INSERT INTO chat_history (summary, tags, date, time, workspace, user_id, session_id) "
+                         "VALUES (:summary, :tags, :date, :time, :workspace, :user_id, :session_id)",
+            "values": {**insert_row["values"], **owner, "session_id": session_id or ""},
+        }
+
+    if _use_tag_index(conf):
+        # Row and its tag links go in one transaction
+        try:
+            history_transaction(conf, "history_write", [insert_row] + tag_link_statements(tags_list, owner=owner))
+        except requests.HTTPError as e:
+            if is_outage(e):
+                raise
+            _disable_tag_index(renderer.console, e)
+            history_transaction(conf, "history_write", [insert_row])
+    else:
+        history_transaction(conf, "history_write", [insert_row])
+    index = _summary_index(conf)
+    if index is not None:
+        index.request_sync()
+
+def compress_evicted_messages(messages, conf, system_prompt):
+    """Compress messages evicted from the sliding window into a mid-term summary.
+
+    Runs on the memory tier's background thread, so it draws nothing on screen.
+    """
+    conversation_text = "\n\n".join(
+        f"{m.get('role', 'user')}: {m.get('content', '')}" for m in messages
+    )
+    prompt = (
+        "You will receive an excerpt from an ongoing chat.\n"
+        "Compress it into a few dense sentences that keep names, numbers, decisions,\n"
+        "user preferences and open questions. Output only the summary."
+    )
+    messages = [
+        {"role": "system", "content": system_prompt or "You are a helpful assistant."},
+        {"role": "user", "content": prompt + "\n\nExcerpt:\n" + conversation_text},
+    ]
+    resp = create_completion(
+        conf['baseurl'][1],
+        "memory",
+        messages=messages,
+        temperature=0.3,
+        top_p=0.9,
+        max_tokens=512,
+        stream=False,
+    )
+    content = resp.choices[0].message.content if resp and resp.choices else ""
+    token_ledger.record("memory compress", getattr(resp, 'usage', None), messages, content)
+    # Reasoning models may still think out loud; keep only what follows
+    return content.split("</think>")[-1].strip()
+
+def archive_memory_chunks(summaries, conf, system_prompt, session_id=None):
+    """Roll mid-term chunk summaries up into one long-term chat_history row."""
+    prompt = (
+        "You will receive consecutive summaries of parts of one chat.\n"
+        "1) Merge them into a concise, high-signal summary.\n"
+        "2) Then produce a Python list of detailed tags that uniquely identify this chat.\n"
+        "Tags must be strings, lowercase, and specific.\n"
+        "Output format strictly as:\n"
+        "Summary: <one-line or short paragraph>\n"
+        "Tags: [\"tag1\", \"tag2\", ...]"
+    )
+    messages = [
+        {"role": "system", "content": system_prompt or "You are a helpful assistant."},
+        {"role": "user", "content": prompt + "\n\nSummaries:\n" + "\n".join(f"- {s}" for s in summaries)},
+    ]
+    resp = create_completion(
+        conf['baseurl'][1],
+        "memory",
+        messages=messages,
+        temperature=0.3,
+        top_p=0.9,
+        max_tokens=2048,
+        stream=False,
+    )
+    content = resp.choices[0].message.content if resp and resp.choices else ""
+    token_ledger.record("memory rollup", getattr(resp, 'usage', None), messages, content)
+    summary, tags_list = parse_summary_and_tags(content)
+    store_chat_summary(summary, canonicalize_tags(tags_list, conf['tag_synonyms']), conf, session_id)
+
+def summarize_input_chunk(chunk, part, baseurl, conf):
+    """Summarise one chunk of an oversized input (runs on an ingest worker thread)."""
+    prompt = (
+        f"You will receive part {part} of a large input the user pasted (a log, transcript or document).\n"
+        "Summarise it densely. Keep errors, identifiers, file names, numbers and anything unusual.\n"
+        "Output only the summary."
+    )
+    messages = [{"role": "user", "content": prompt + "\n\nInput:\n" + chunk}]
+    resp = create_completion(
+        baseurl,
+        "ingest",
+        messages=messages,
+        temperature=0.3,
+        top_p=0.9,
+        max_tokens=1024,
+        stream=False,
+    )
+    content = resp.choices[0].message.content if resp and resp.choices else ""
+    token_ledger.record("ingest", getattr(resp, 'usage', None), messages, content)
+    return content.split("</think>")[-1]
+
+def ingest_large_input(conf, text=None, path=None):
+    """Replace an oversized input (pasted `text` or a file at `path`) with a compact stand-in.
+
+    The original goes to the blob store; chunks are map-reduced across the
+    configured endpoints. Returns (compact_text, digest).
+    """
+    chars_per_token = token_counter.estimator.chars_per_token
+    chunk_chars = int(int(conf['ingest_chunk_tokens']) * chars_per_token)
+    target_chars = int(int(conf['ingest_summary_tokens']) * chars_per_token)
+    excerpt_chars = int(conf['ingest_excerpt_chars'])
+    endpoints = list(dict.fromkeys(conf['baseurl']))
+    blobs = BlobStore(conf['blob_store_dir'])
+
+    if path is not None:
+        digest = blobs.put_file(path)
+        num_chars = 0
+        edges = {"head": None, "tail": ""}
+
+        def _chunks():
+            # Keep only what the stand-in needs while streaming the file
+            nonlocal num_chars
+            for chunk in iter_file_chunks(path, chunk_chars):
+                num_chars += len(chunk)
+                if edges["head"] is None:
+                    edges["head"] = chunk[:excerpt_chars]
+                edges["tail"] = (edges["tail"] + chunk)[-excerpt_chars:]
+                yield chunk
+        chunks = _chunks()
+    else:
+        digest = blobs.put(text)
+        num_chars = len(text)
+        edges = {"head": text[:excerpt_chars], "tail": text[-excerpt_chars:]}
+        chunks = iter_chunks(text, chunk_chars)
+
+    with renderer.stage("ingest"):
+        summary = map_reduce(
+            chunks,
+            lambda chunk, part, baseurl: summarize_input_chunk(chunk, part, baseurl, conf),
+            endpoints,
+            target_chars,
+            concurrency=conf['ingest_concurrency'] or 2 * len(endpoints),
+            on_wait=renderer.tick,
+        )
+    tail = edges["tail"] if num_chars > 2 * excerpt_chars else ""
+    approx_tokens = int(num_chars / chars_per_token)
+    return compact_representation(num_chars, edges["head"] or "", tail, digest, summary, approx_tokens), digest
+
+def ingest_fallback_chars(conf):
+    """How much of an oversized input to send as-is when ingest_large_input fails."""
+    return int(int(conf['ingest_threshold_tokens']) * token_counter.estimator.chars_per_token)
+
+def truncated_input(head, total_chars, error):
+    """Stand-in for an input that could not be summarised: its head plus a note."""
+    return (
+        f"{head}\n\n[Input truncated to its first {len(head)} of {total_chars} characters; "
+        f"summarising the rest failed: {error}]"
+    )
+
+def _recall_from_server(conf, tags_list, query_text, top_k, min_score, raw_tags=()):
+    """Tag lookup on the history server, scored client-side; best top_k above min_score.
+
+    `raw_tags` (the model's tags as written) are also matched on the legacy
+    LIKE path, since rows stored before migration 1 hold them unnormalised.
+    """
+    console = renderer.console
+    max_results = conf['max_chat_history_results']
+    # Some drivers allow binding LIMIT; ws4sqlite supports bindings, use :limit
+    values = {"limit": int(max_results)}
+    keys = []
+    for idx, tag in enumerate(tags_list):
+        key = f"t{idx}"
+        keys.append(key)
+        values[key] = tag
+
+    # Once the store is partitioned, only this user's (or, with
+    # chat_history_scope "workspace", this workspace's) rows are touched
+    owner = _history_partition(conf)
+    owner_columns = _owner_columns(conf, owner)
+    values.update({column: owner[column] for column in owner_columns})
+
+    rows = None
+    if _use_tag_index(conf):
+        # Indexed lookup, ranked by how many of the tags each chat matches
+        sql = indexed_tag_query(keys, owner_columns)
+        try:
+            with renderer.stage("retrieval"):
+                rows = result_rows(history_transaction(conf, "retrieval", [{"query": sql, "values": values}]))
+        except requests.HTTPError as e:
+            if is_outage(e):
+                raise
+            _disable_tag_index(console, e)
+
+    if rows is None:
+        # Legacy path: OR over fuzzy, case-insensitive matches. The free-text
+        # tags column holds the model's tags unsorted and unstemmed, so each
+        # tag is matched both as written (lowercased) and in canonical form
+        patterns = dict.fromkeys([" ".join(tag.lower().split()) for tag in raw_tags] + list(tags_list))
+        like_values = {"limit": values["limit"]}
+        like_keys = []
+        for idx, pattern in enumerate(pattern for pattern in patterns if pattern):
+            key = f"l{idx}"
+            like_keys.append(key)
+            like_values[key] = f"%{pattern}%"
+        like_values.update({column: values[column] for column in owner_columns})
+        sql = like_tag_query(like_keys, owner_columns)
+        with renderer.stage("retrieval"):
+            rows = result_rows(history_transaction(conf, "retrieval", [{"query": sql, "values": like_values}]))
+
+        # Count overlap of canonical tag IDs (set intersection) per row
+        vocabulary = get_tag_vocabulary(conf)
+        query_ids = vocabulary.ids_for(tags_list)
+        for row in rows:
+            row_tags = canonicalize_tags((row.get('tags') or "").split(), conf['tag_synonyms'])
+            row['matches'] = len(query_ids & vocabulary.known_ids(row_tags))
+
+    # Score the compact candidate set and keep only a small, high-value top-k
+    rows = [row for row in rows if isinstance(row.get('summary'), str)]
+    score_summaries(rows, len(tags_list), conf, query_text=query_text)
+    results_list = [
+        {
+            "summary": row.get('summary'),
+            "date": str(row.get('date')) if row.get('date') is not None else "",
+            "score": row['score']
+        }
+        for row in rows[:top_k]
+        if row['score'] >= min_score
+    ]
+    return results_list
+
+@profiler.profiled()
+def find_chat_summaries(history, conf, system_prompt, current_user_input=None, budget_tokens=None):
     """Generate tags from current chat (same as save_chat) and fetch summaries.
 
-    Returns a list of {"summary": str, "date": str} limited by conf['max_chat_history_results'].
+    Up to conf['max_chat_history_results'] candidates are fetched, scored on
+    tag overlap, text similarity to the current input and recency, and only
+    the best conf['chat_history_top_k'] above conf['chat_history_min_score']
+    that fit in `budget_tokens` (default conf['memory_longterm_max_tokens'])
+    are returned as {"summary": str, "date": str, "score": float}. With
+    conf['summary_index_enabled'] every row of the user's history is
+    scored in the local summary index instead, synced from the server.
     """
-    console = Console()
+    console = renderer.console
+    index = _summary_index(conf)
+    # Skip at once while an endpoint it needs is known to be down; the
+    # breakers probe them in the background and retrieval resumes when
+    # they answer. The local index answers while the history server is down.
+    endpoints = [(conf['baseurl'][1], "tag endpoint")]
+    if index is None:
+        endpoints.insert(0, (history_server(conf)[0], "history server"))
+    for endpoint, role in endpoints:
+        if not remote_guard.available(endpoint):
+            console.print(f"[dim]Retrieval skipped: {role} {endpoint} is down; retrying in the background.[/dim]", highlight=False)
+            return []
     try:
         # Generate tags via shared function
-        tags_list = generate_chat_tags(history, conf, system_prompt, current_user_input=current_user_input)
+        tags_list, raw_tags = generate_chat_tags(history, conf, system_prompt, current_user_input=current_user_input, with_raw=True)
 
         # If no tags could be parsed, nothing to search
         if not tags_list:
@@ -291,97 +708,26 @@ def find_chat_summaries(history, conf, system_prompt, current_user_input=None):
             # Fallback plain print if Rich formatting fails for any reason
             print("Tags: " + ", ".join(tags_list))
 
-        # Build SQL query using OR over all tags with fuzzy, case-insensitive matching
-        where_clauses = []
-        values = {}
-        for idx, tag in enumerate(tags_list):
-            key = f"t{idx}"
-            where_clauses.append(f"LOWER(tags) LIKE :{key}")
-            values[key] = f"%{tag}%"
-
-        max_results = conf.get('max_chat_history_results', 100)
-        # Some drivers allow binding LIMIT; ws4sqlite supports bindings, use :limit
-        values["limit"] = int(max_results)
-
-        where_sql = " OR ".join(where_clauses) if where_clauses else "1=0"
-        sql = (
-            "SELECT summary, date FROM chat_history "
-            f"WHERE ({where_sql}) "
-            "ORDER BY id DESC "
-            "LIMIT :limit"
-        )
-
-        server_url = conf.get('chat_history_server_url') or "http://127.0.0.1:12321/chat_history"
-        auth_user = conf.get('chat_history_server_auth_user') or "admin"
-        auth_pass = conf.get('chat_history_server_auth_pass') or "YourSuperSecretPass123"
-
-        payload = {
-            "transaction": [
-                {
-                    "query": sql,
-                    "values": values,
-                }
-            ]
-        }
-
-        with processing_spinner():
-            r = requests.post(
-                server_url,
-                json=payload,
-                auth=(auth_user, auth_pass),
-                headers={"Content-Type": "application/json"},
-                timeout=10,
-            )
-        r.raise_for_status()
-
-        data = r.json()
-
-        # Prefer ws4sqlite standard shape: list of result objects with columns/rows
-        results_list = []
-        if isinstance(data, dict) and 'results' in data:
-            data_iter = data.get('results')
+        top_k = int(conf['chat_history_top_k'])
+        min_score = float(conf['chat_history_min_score'])
+        if index is not None:
+            _sync_summary_index(index, conf)
+            with renderer.stage("retrieval"):
+                results_list = index.search(tags_list, conf, top_k, min_score, query_text=current_user_input)
         else:
-            data_iter = data if isinstance(data, list) else [data]
+            results_list = _recall_from_server(conf, tags_list, current_user_input, top_k, min_score, raw_tags)
 
-        for item in data_iter:
-            if isinstance(item, dict) and 'columns' in item and 'rows' in item:
-                columns = item.get('columns') or []
-                rows = item.get('rows') or []
-                try:
-                    idx_summary = columns.index('summary') if 'summary' in columns else None
-                    idx_date = columns.index('date') if 'date' in columns else None
-                except ValueError:
-                    idx_summary = None
-                    idx_date = None
-                if idx_summary is not None:
-                    for row in rows:
-                        summary_val = row[idx_summary] if idx_summary < len(row) else None
-                        date_val = row[idx_date] if (idx_date is not None and idx_date < len(row)) else None
-                        if isinstance(summary_val, str):
-                            results_list.append({
-                                "summary": summary_val,
-                                "date": str(date_val) if date_val is not None else ""
-                            })
-
-        # Fallback: recursively collect any dicts having summary/date
-        if not results_list:
-            def _collect_pairs(obj):
-                pairs = []
-                if isinstance(obj, dict):
-                    if 'summary' in obj and isinstance(obj.get('summary'), str):
-                        pairs.append({
-                            "summary": obj.get('summary'),
-                            "date": str(obj.get('date') or "")
-                        })
-                    for v in obj.values():
-                        pairs.extend(_collect_pairs(v))
-                elif isinstance(obj, list):
-                    for it in obj:
-                        pairs.extend(_collect_pairs(it))
-                return pairs
-            results_list = _collect_pairs(data)
-
-        return results_list[: int(max_results)]
+        # Long-term tier budget: best first, skipping summaries that don't fit
+        results_list, _ = fit_to_budget(
+            results_list,
+            int(budget_tokens if budget_tokens is not None else conf['memory_longterm_max_tokens']),
+            lambda item: count_tokens([{"role": "system", "content": item["summary"]}])
+        )
+        return results_list
+    except CircuitOpenError as e:
+        # An endpoint went down during this turn; already reported when it failed
+        console.print(f"[dim]Retrieval skipped: {str(e)}[/dim]", highlight=False)
+        return []
     except Exception as e:
         # On failure, return empty list
         try:
@@ -394,67 +740,214 @@ def find_chat_summaries(history, conf, system_prompt, current_user_input=None):
             pass
         return []
 
-def query_llm(prompt, history=None, context=None, system_prompt=None, base="qwen", temperature=0.99, max_tokens=32768, baseurl=None, enable_thinking=True):
-    # Use provided baseurl or default to baseurl0
-    base_url = baseurl 
-    client = OpenAI(
-        base_url=base_url,  # Using configured server
-        api_key="dummy_api_key"  # Using dummy API key for local server
-    )
-    print(f"Sending request to: {base_url}")
-    try:
-        # Build messages array
-        messages = []
+def build_chat_messages(prompt, history=None, context=None, system_prompt=None, enable_thinking=True):
+    """Assemble the chat messages array for query_llm."""
+    messages = []
+    
+    # Add system prompt if provided
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
         
-        # Add system prompt if provided
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-            
-        # Add context if provided
-        if context:
-            messages.append({"role": "system", "content": f"Context: {context}"})
-            
-        # Add conversation history if provided
-        if history:
-            messages.extend(history)
-            
-        # Add current prompt with Qwen's thinking flag
-        if enable_thinking:
-                # Qwen3's native thinking format
-            messages.append({"role": "system", "content": "Please provide your reasoning in <think> tags before your answer."})
-        messages.append({"role": "user", "content": prompt.strip()})
+    # Add context if provided
+    if context:
+        messages.append({"role": "system", "content": f"Context: {context}"})
         
-        # For Qwen, we'll use a single response with its built-in thinking format
-        # Set recommended parameters for thinking mode
-        # Start spinner before sending request; stop it on first streamed token
-        stop_spinner = start_processing_spinner()
-
-        if enable_thinking:
-            response = client.chat.completions.create(
-                model="my-model",
-                messages=messages,
-                temperature=0.99,
-                top_p=0.95,
-                max_tokens=max_tokens,
-                stream=True  # Stream the response
-            )
-        else:
-            response = client.chat.completions.create(
-                model="my-model",
-                messages=messages,
-                temperature=0.99,
-                top_p=0.8,
-                max_tokens=max_tokens,
-                stream=True  # Stream the response
+    # Add conversation history if provided
+    if history:
+        messages.extend(history)
+        
+    # Add current prompt with Qwen's thinking flag
+    if enable_thinking:
+            # Qwen3's native thinking format
+        messages.append({"role": "system", "content": "Please provide your reasoning in <think> tags before your answer."})
+    messages.append({"role": "user", "content": prompt.strip()})
+    return messages
+
+def open_chat_stream(messages, baseurl, max_tokens=32768, enable_thinking=True):
+    """Send a streamed chat completion request and return the stream."""
+    # For Qwen, we'll use a single response with its built-in thinking format
+    # Set recommended parameters for thinking mode
+    return create_completion(
+        baseurl,  # Using configured server
+        "chat",
+        messages=messages,
+        temperature=0.99,
+        top_p=0.95 if enable_thinking else 0.8,
+        max_tokens=max_tokens,
+        stream=True,  # Stream the response
+        # Final chunk carries the authoritative prompt/completion token counts
+        stream_options={"include_usage": True}
+    )
+
+def iter_stream_deltas(response, meta=None, baseurl=None, stage="chat"):
+    """Yield ("reasoning" | "content", text) pairs from a streamed completion.
+
+    If `meta` is a dict, the stream's finish_reason, `usage` block, the
+    server's `timings` (llama.cpp) and the perf_counter() time of the first
+    delta are recorded in it. With `baseurl`, the stage's total budget bounds
+    the wait for each token and outages mid-stream count against that
+    endpoint's breaker.
+    """
+    budget = remote_guard.budget(stage)
+    deadline = budget.deadline() if baseurl else None
+    try:
+        yield from _iter_stream_deltas(response, meta, deadline, stage, budget.total)
+    except Exception as e:
+        if baseurl is not None and is_outage(e):
+            remote_guard.breaker(baseurl).record_failure(e)
+        raise
+
+def _iter_stream_deltas(response, meta, deadline, stage, total):
+    for chunk in response:
+        if deadline is not None and time.perf_counter() > deadline:
+            raise DeadlineExceeded(f"{stage} stream produced no token for {total:.0f}s")
+        if meta is not None and getattr(chunk, 'timings', None):
+            meta['timings'] = chunk.timings
+        if meta is not None and getattr(chunk, 'usage', None) is not None:
+            meta['usage'] = chunk.usage
+        if hasattr(chunk, 'choices') and chunk.choices:
+            if meta is not None and getattr(chunk.choices[0], 'finish_reason', None):
+                meta['finish_reason'] = chunk.choices[0].finish_reason
+            delta = chunk.choices[0].delta
+            if hasattr(delta, 'reasoning_content') and delta.reasoning_content is not None:
+                kind, text = "reasoning", delta.reasoning_content
+            elif hasattr(delta, 'content') and delta.content is not None:
+                kind, text = "content", delta.content
+            else:
+                continue
+            now = time.perf_counter()
+            if meta is not None and 'first_token_at' not in meta:
+                meta['first_token_at'] = now
+            if deadline is not None:
+                # Still making progress: the budget starts over
+                deadline = now + total
+            yield kind, text
+
+def _observe_prefill(baseurl, messages, ttft, meta):
+    """Feed one request's prefill speed to the context budget."""
+    if ttft is None:
+        return
+    timings = meta.get('timings')
+    prompt_tokens = None if timings else count_tokens(messages)
+    context_budget.observe(baseurl, prompt_tokens, ttft, timings)
+
+class StreamWorker:
+    """Runs one streamed completion on a background thread.
+
+    Deltas are buffered in a queue until someone renders them via events(),
+    so a request can be started speculatively and either adopted or
+    cancelled later. `on_ready(worker)` is called once, from the worker
+    thread, at the first token or when the stream ends without one.
+    """
+
+    _DONE = object()
+
+    def __init__(self, messages, baseurl, max_tokens=32768, enable_thinking=True, on_ready=None):
+        self.baseurl = baseurl
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.chunks = 0
+        self.answer_parts = []
+        self.reasoning_parts = []
+        self.meta = {}
+        self.error = None
+        self._on_ready = on_ready
+        self._response = None
+        self._thread = threading.Thread(
+            target=self._run, args=(messages, max_tokens, enable_thinking), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, messages, max_tokens, enable_thinking):
+        try:
+            self._response = open_chat_stream(messages, self.baseurl, max_tokens, enable_thinking)
+            for kind, text in iter_stream_deltas(self._response, self.meta, self.baseurl):
+                if self.cancelled.is_set():
+                    break
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                    self._ready()
+                self.chunks += 1
+                if kind == "content":
+                    self.answer_parts.append(text)
+                else:
+                    self.reasoning_parts.append(text)
+                self.queue.put((kind, text))
+            if not self.cancelled.is_set():
+                _observe_prefill(self.baseurl, messages, self.ttft, self.meta)
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.error = e
+                self.queue.put(("error", e))
+        finally:
+            self._close()
+            self.finished_at = time.perf_counter()
+            # Cancelled streams never see the usage chunk and are counted locally
+            token_ledger.record(
+                "chat", self.meta.get('usage'), messages, "".join(self.reasoning_parts) + self.answer_text()
             )
+            self.queue.put(self._DONE)
+            self._ready()
 
-        
+    def _ready(self):
+        callback, self._on_ready = self._on_ready, None
+        if callback is not None:
+            callback(self)
+
+    @property
+    def ttft(self):
+        """Seconds to the first token, or None if none arrived."""
+        return None if self.first_token_at is None else self.first_token_at - self.started_at
+
+    def answer_text(self):
+        return "".join(self.answer_parts)
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _close(self):
+        if self._response is not None:
+            try:
+                self._response.close()
+            except Exception:
+                pass
+
+    def cancel(self):
+        """Stop the stream; safe to call from any thread and more than once."""
+        self.cancelled.set()
+        self._close()
+
+    def events(self):
+        """Yield buffered and then live deltas until the stream ends."""
+        while True:
+            item = self.queue.get()
+            if item is self._DONE:
+                return
+            if item[0] == "error":
+                raise item[1]
+            yield item
+
+def render_stream(open_events):
+    """Stream deltas to the terminal and return the parsed response dict.
+
+    `open_events` is called to start the request and must return
+    (events, cancel): an iterator of ("reasoning" | "content", text) pairs and
+    a callable that stops the underlying stream. The caller opens the
+    "prefill" stage; it is closed here on the first token, or dropped if the
+    request is cancelled or fails before one arrives.
+    """
+    current_content = ""
+    cancel = None
+    try:
         # Stream and collect content
-        current_content = ""
         print("\n", end="", flush=True)
         
-        # Initialize Rich console
-        console = Console()
+        # Shared Rich console
+        console = renderer.console
         
         # Track if we're in the thinking or answer section
         in_thinking = False
@@ -464,63 +957,72 @@ def query_llm(prompt, history=None, context=None, system_prompt=None, base="qwen
         # Live content for streaming display
         live_content = ""
         
-        for chunk in response:
-            try:
-                if hasattr(chunk, 'choices') and chunk.choices:
-                    delta = chunk.choices[0].delta
-                    # Stop spinner on first token (either reasoning or content)
-                    if stop_spinner is not None:
-                        try:
-                            stop_spinner()
-                        except Exception:
-                            pass
-                        finally:
-                            stop_spinner = None
-                        console.print(" " * 10, end="\r")
-                    if hasattr(delta, 'reasoning_content') and delta.reasoning_content is not None:
-                        # This is the thinking part
-                        if not in_thinking:
-                            current_content += "<think>\n"
-                            console.print("\n", end="")
-                            in_thinking = True
-                        content = delta.reasoning_content
-                        thinking_content += content
-                        # Print thinking in dim style
-                        console.print(content, style="dim", end="", highlight=False)
-                        current_content += content
-                    elif hasattr(delta, 'content') and delta.content is not None:
-                        # This is the answer part
-                        if in_thinking:
-                            current_content += "</think>\n\n"
-                            console.print("\n", end="")
-                            in_thinking = False
-                            # Display collected thinking in a panel
-                            console.print(Panel(
-                                Text(thinking_content.strip(), style="dim"),
-                                title="Thinking Process",
-                                border_style="dim"
-                            ))
-                            console.print()  # Add spacing
-                        content = delta.content
-                        answer_content += content
-                        # Collect content for live display
-                        live_content += content
-                        # Print without markdown for streaming
-                        console.print(content, end="", highlight=False)
-                        current_content += content
-                    elif delta.role == 'assistant':
-                        # Skip initial role marker
-                        continue
-            except Exception as e:
-                console.print(f"[red]Error: {str(e)}[/red]", flush=True)
-        
-        # Ensure spinner is stopped if still running
-        if stop_spinner is not None:
-            try:
-                stop_spinner()
-            except Exception:
-                pass
-            console.print(" " * 10, end="\r")
+        # Set when Ctrl+C interrupts the request; whatever streamed so far is kept
+        cancelled = False
+        first_token = True
+
+        try:
+            events, cancel = open_events()
+
+            for kind, content in events:
+                # Client-side cost of one chunk: parsing, bookkeeping and terminal output
+                with profiler.span("stream chunk"):
+                    renderer.tick()
+                    try:
+                        # Switch from prefill to decoding on first token (either reasoning or content);
+                        # the streamed text itself is the progress indicator while decoding
+                        if first_token:
+                            first_token = False
+                            renderer.end_stage("prefill")
+                            renderer.begin_stage("decoding", visible=False)
+                        if kind == "reasoning":
+                            # This is the thinking part
+                            if not in_thinking:
+                                current_content += "<think>\n"
+                                console.print("\n", end="")
+                                in_thinking = True
+                            thinking_content += content
+                            # Print thinking in dim style
+                            console.print(content, style="dim", end="", highlight=False)
+                            current_content += content
+                        else:
+                            # This is the answer part
+                            if in_thinking:
+                                current_content += "</think>\n\n"
+                                console.print("\n", end="")
+                                in_thinking = False
+                                # Display collected thinking in a panel
+                                console.print(Panel(
+                                    Text(thinking_content.strip(), style="dim"),
+                                    title="Thinking Process",
+                                    border_style="dim"
+                                ))
+                                console.print()  # Add spacing
+                            answer_content += content
+                            # Collect content for live display
+                            live_content += content
+                            # Print without markdown for streaming
+                            console.print(content, end="", highlight=False)
+                            current_content += content
+                    except Exception as e:
+                        console.print(f"[red]Error: {str(e)}[/red]", flush=True)
+
+        except KeyboardInterrupt:
+            # First Ctrl+C: stop the stream but keep the partial answer
+            cancelled = True
+            if cancel is not None:
+                try:
+                    cancel()
+                except Exception:
+                    pass
+
+        # Close the stage that is still open (prefill if no token ever arrived);
+        # a prefill cut short by Ctrl+C measured nothing, so it is not timed
+        renderer.end_stage("decoding")
+        if cancelled:
+            renderer.discard_stage("prefill")
+        else:
+            renderer.end_stage("prefill")
 
         # Close thinking tags and display final panel if we're still in thinking mode
         if in_thinking:
@@ -533,16 +1035,19 @@ def query_llm(prompt, history=None, context=None, system_prompt=None, base="qwen
             ))
             console.print()  # Add spacing
         
-        # Add a separator line between streaming and final rendering
-        console.print("\n")
-        console.print("─" * console.width, style="dim")
-        console.print("\n[bold blue]Final Formatted Output:[/bold blue]\n")
-        
-        # Render the final answer with proper markdown formatting
-        if answer_content.strip():
-            console.print(Markdown(answer_content.strip()))
-        
-        print("\n")  # New line after response
+        if cancelled:
+            console.print("\n\n[yellow]Response cancelled; partial answer kept.[/yellow]\n")
+        else:
+            # Add a separator line between streaming and final rendering
+            console.print("\n")
+            console.print("─" * console.width, style="dim")
+            console.print("\n[bold blue]Final Formatted Output:[/bold blue]\n")
+            
+            # Render the final answer with proper markdown formatting
+            if answer_content.strip():
+                console.print(Markdown(answer_content.strip()))
+            
+            print("\n")  # New line after response
         
         # Process the complete content
         full_content = current_content
@@ -569,23 +1074,359 @@ def query_llm(prompt, history=None, context=None, system_prompt=None, base="qwen
         return {
             "thinking": think_match,
             "answer": answer,
-            "full_response": full_content.strip()
+            "full_response": full_content.strip(),
+            "cancelled": cancelled
+        }
+    except KeyboardInterrupt:
+        # Ctrl+C outside the stream itself (e.g. while rendering)
+        if cancel is not None:
+            cancel()
+        return {
+            "thinking": "",
+            "answer": current_content.strip(),
+            "full_response": current_content.strip(),
+            "cancelled": True
         }
     except Exception as e:
-        # Stop spinner on error
-        try:
-            stop_spinner()
-        except Exception:
-            pass
         error_msg = f"Error: {str(e)}"
         print(f"Debug: Exception occurred - {error_msg}", flush=True)
         return {
             "thinking": "",
             "answer": error_msg,
-            "full_response": error_msg
+            "full_response": error_msg,
+            "error": True
         }
+    finally:
+        # Interrupted or failed before the normal close above: nothing open may
+        # carry over into the next turn's stage timings
+        renderer.end_stage("decoding")
+        renderer.discard_stage("prefill")
+
+def query_llm(prompt, history=None, context=None, system_prompt=None, base="qwen", temperature=0.99, max_tokens=32768, baseurl=None, enable_thinking=True):
+    # Use provided baseurl or default to baseurl0
+    base_url = baseurl 
+    print(f"Sending request to: {base_url}")
+    messages = build_chat_messages(prompt, history, context, system_prompt, enable_thinking)
+    meta = {}
+
+    def _open():
+        response = open_chat_stream(messages, base_url, max_tokens, enable_thinking)
+        return iter_stream_deltas(response, meta, base_url), response.close
+
+    # Prefill runs from sending the request until the first streamed token
+    started_at = time.perf_counter()
+    renderer.begin_stage("prefill")
+    result = render_stream(_open)
+    if not result.get("cancelled") and 'first_token_at' in meta:
+        _observe_prefill(base_url, messages, meta['first_token_at'] - started_at, meta)
+    token_ledger.record("chat", meta.get('usage'), messages, result["full_response"])
+    return _with_completion_tokens(result, meta)
+
+def _with_completion_tokens(result, meta):
+    """Attach the server-reported completion token count to a response dict."""
+    completion_tokens = getattr(meta.get('usage'), 'completion_tokens', None)
+    if completion_tokens is not None and not result.get("cancelled"):
+        result["completion_tokens"] = completion_tokens
+    return result
+
+def build_summaries_context(context, chat_history_summaries):
+    """Append previous chat summaries (with dates) to `context` for the LLM."""
+    if not chat_history_summaries:
+        return context
+    summaries_lines = [
+        "Use the following concise summaries of previous chats as supplemental context. Guidelines for using them:",
+        "- Treat them as high-level reminders; do not assume unstated facts.",
+        "- Prefer more recent items when resolving conflicts.",
+        "- If you draw from a summary, reference its date.",
+        "- Do not invent details not present in the summaries.",
+        "- Ignore items irrelevant to the current request.",
+        "- If a summary conflicts with the user's current instructions, follow the current instructions.",
+        "",
+        "Previous chat summaries:"]
+    for item in chat_history_summaries:
+        date_str = item.get("date", "") or ""
+        summary_str = item.get("summary", "") or ""
+        if date_str:
+            summaries_lines.append(f"- [{date_str}] {summary_str}")
+        else:
+            summaries_lines.append(f"- {summary_str}")
+    summaries_block = "\n".join(summaries_lines)
+    if context:
+        return f"{context}\n\n{summaries_block}"
+    return summaries_block
+
+def speculative_query(prompt, history, context, system_prompt, conf, stats, enable_thinking=True, max_tokens=32768, longterm_tokens=None):
+    """Start generation without retrieved context while retrieval runs in parallel.
+
+    The speculative stream is kept (and rendered from its buffer) unless
+    retrieval returns a summary scoring at least
+    conf['speculation_min_context_score']; then it is cancelled and the request
+    is re-issued with the context. `stats` accumulates won/lost counts.
+    `longterm_tokens` caps the retrieved summaries (see find_chat_summaries).
+
+    The draft goes to the endpoint answer_query would use; when that is a
+    fan-out over several endpoints, nothing is drafted and the turn runs
+    retrieval first, as without speculation.
+    """
+    endpoints = live_answer_endpoints(conf)
+    if len(endpoints) > 1:
+        chat_history_summaries = find_chat_summaries(
+            history, conf, system_prompt, current_user_input=prompt, budget_tokens=longterm_tokens
+        )
+        return answer_query(
+            prompt, history, build_summaries_context(context, chat_history_summaries), system_prompt, conf,
+            enable_thinking=enable_thinking, max_tokens=max_tokens
+        )
+    baseurl = endpoints[0]
+    messages = build_chat_messages(prompt, history, context, system_prompt, enable_thinking)
+    worker = StreamWorker(messages, baseurl, max_tokens=max_tokens, enable_thinking=enable_thinking)
+    adopted = False
+    try:
+        chat_history_summaries = find_chat_summaries(
+            history, conf, system_prompt, current_user_input=prompt, budget_tokens=longterm_tokens
+        )
+        head_start = time.perf_counter() - worker.started_at
+        threshold = float(conf['speculation_min_context_score'])
+        relevant = [item for item in chat_history_summaries if item.get("score", 0.0) >= threshold]
+
+        if not relevant:
+            adopted = True
+            stats["won"] += 1
+            stats["head_start_s"] += head_start
+            print(f"Sending request to: {baseurl} (speculative, {head_start:.2f}s head start)")
+            renderer.begin_stage("prefill")
+            response = _with_completion_tokens(render_stream(lambda: (worker.events(), worker.cancel)), worker.meta)
+            outcome = f"speculation won ({head_start:.2f}s head start)"
+        else:
+            worker.cancel()
+            stats["lost"] += 1
+            stats["wasted_chunks"] += worker.chunks
+            response = answer_query(
+                prompt,
+                history,
+                build_summaries_context(context, relevant),
+                system_prompt,
+                conf,
+                enable_thinking=enable_thinking,
+                max_tokens=max_tokens
+            )
+            outcome = f"speculation restarted (context score {relevant[0]['score']:.2f}, {worker.chunks} chunks discarded)"
+    finally:
+        # render_stream closes prefill itself; this covers a Ctrl+C before it starts
+        renderer.discard_stage("prefill")
+        if not adopted:
+            worker.cancel()
+
+    total = stats["won"] + stats["lost"]
+    renderer.console.print(
+        f"[dim]{outcome} · session {stats['won']}/{total} won ({100.0 * stats['won'] / total:.0f}%)[/dim]",
+        highlight=False
+    )
+    return response
+
+# Per-endpoint TTFT history for the session: url -> {"ttfts": [...], "wins": int, "requests": int}
+fanout_endpoint_stats = {}
+
+def _answer_quality(text, median_length):
+    """Cheap best-of-N heuristic: penalise repetition loops and unusual lengths."""
+    words = text.split()
+    if not words:
+        return float("-inf")
+    trigrams = list(zip(words, words[1:], words[2:]))
+    distinct = len(set(trigrams)) / len(trigrams) if trigrams else 1.0
+    length_penalty = abs(math.log(len(text) / median_length)) if median_length else 0.0
+    return distinct - 0.5 * length_penalty
+
+def _pick_best_worker(workers):
+    candidates = [w for w in workers if w.error is None and w.answer_text().strip()]
+    if not candidates:
+        return workers[0]
+    lengths = sorted(len(w.answer_text()) for w in candidates)
+    median_length = lengths[len(lengths) // 2]
+    return max(
+        candidates,
+        key=lambda w: (w.meta.get('finish_reason') == "stop") + _answer_quality(w.answer_text(), median_length)
+    )
+
+def fanout_query(prompt, history, context, system_prompt, conf, endpoints, enable_thinking=True, max_tokens=32768):
+    """Send the same request to each of `endpoints` concurrently.
+
+    conf['fanout_mode'] == "first" renders whichever endpoint streams a token
+    first and cancels the others; "best" waits for all of them and renders the
+    answer picked by _pick_best_worker. Per-endpoint TTFT is reported after.
+    """
+    mode = conf['fanout_mode']
+    messages = build_chat_messages(prompt, history, context, system_prompt, enable_thinking)
+    print(f"Sending request to {len(endpoints)} endpoints ({mode} mode)")
+
+    ready = queue.Queue()
+    workers = [
+        StreamWorker(messages, url, max_tokens=max_tokens, enable_thinking=enable_thinking, on_ready=ready.put)
+        for url in endpoints
+    ]
+    winner = None
+    try:
+        if mode == "best":
+            with renderer.stage(f"best-of-{len(workers)}"):
+                for worker in workers:
+                    while not worker.join(timeout=renderer.TICK_INTERVAL):
+                        renderer.tick()
+            winner = _pick_best_worker(workers)
+            # Everything is buffered already; prefill closes on the first rendered token
+            renderer.begin_stage("prefill")
+        else:
+            renderer.begin_stage("prefill")
+            pending = len(workers)
+            while winner is None and pending:
+                try:
+                    worker = ready.get(timeout=renderer.TICK_INTERVAL)
+                except queue.Empty:
+                    renderer.tick()
+                    continue
+                if worker.first_token_at is not None:
+                    winner = worker
+                else:
+                    pending -= 1
+            # Every endpoint failed: render the first one's error
+            winner = winner or workers[0]
+        for worker in workers:
+            if worker is not winner:
+                worker.cancel()
+        response = _with_completion_tokens(render_stream(lambda: (winner.events(), winner.cancel)), winner.meta)
+    finally:
+        # A Ctrl+C while waiting for the first token leaves prefill open
+        renderer.discard_stage("prefill")
+        for worker in workers:
+            if worker is not winner:
+                worker.cancel()
+
+    lines = []
+    winner_ttft = winner.ttft
+    for worker in workers:
+        stats = fanout_endpoint_stats.setdefault(worker.baseurl, {"ttfts": [], "wins": 0, "requests": 0})
+        stats["requests"] += 1
+        if worker.ttft is not None:
+            stats["ttfts"].append(worker.ttft)
+            ttft_str = f"{worker.ttft:.2f}s"
+        elif worker.error is not None:
+            ttft_str = "error"
+        elif winner_ttft is not None:
+            ttft_str = f">{winner_ttft:.2f}s"
+        else:
+            ttft_str = "-"
+        if worker is winner:
+            stats["wins"] += 1
+        avg = sum(stats["ttfts"]) / len(stats["ttfts"]) if stats["ttfts"] else None
+        avg_str = f"{avg:.2f}s" if avg is not None else "-"
+        mark = "*" if worker is winner else " "
+        lines.append(
+            f"{mark} {worker.baseurl}  TTFT {ttft_str}  ·  session avg {avg_str}, {stats['wins']}/{stats['requests']} wins"
+        )
+    renderer.console.print("[dim]" + "\n".join(lines) + "[/dim]", highlight=False)
+    return response
+
+def answer_endpoints(conf):
+    """The distinct endpoints answer_query will send to under the configured strategy."""
+    if conf['fanout_mode'] in ("first", "best"):
+        # A URL listed twice would only get the same request twice
+        return list(dict.fromkeys(conf['fanout_endpoints'] or conf['baseurl']))
+    return [conf['baseurl'][0]]
+
+def live_answer_endpoints(conf):
+    """answer_endpoints without those whose breaker is open, unless that is all of them."""
+    endpoints = answer_endpoints(conf)
+    return [url for url in endpoints if remote_guard.available(url)] or endpoints
+
+def answer_query(prompt, history, context, system_prompt, conf, enable_thinking=True, max_tokens=32768):
+    """Send the chat request with the configured strategy (single endpoint or fan-out)."""
+    endpoints = live_answer_endpoints(conf)
+    if len(endpoints) > 1:
+        return fanout_query(prompt, history, context, system_prompt, conf, endpoints, enable_thinking, max_tokens)
+    return query_llm(
+        prompt=prompt,
+        history=history,
+        context=context,
+        system_prompt=system_prompt,
+        max_tokens=max_tokens,
+        baseurl=endpoints[0],
+        enable_thinking=enable_thinking
+    )
+
+def trim_history(history, token_counts, max_tokens):
+    """Drop the oldest message pairs until the window fits in max_tokens.
+
+    Returns (history, token_counts, evicted, evicted_counts).
+    """
+    evicted = []
+    evicted_counts = []
+    while history and sum(token_counts) > max_tokens:
+        # Remove oldest message pair (user + assistant messages); if somehow
+        # we have an odd number of messages, just remove the oldest
+        drop = 2 if len(history) >= 2 else 1
+        evicted.extend(history[:drop])
+        evicted_counts.extend(token_counts[:drop])
+        history = history[drop:]
+        token_counts = token_counts[drop:]
+    return history, token_counts, evicted, evicted_counts
+
+def stop_profiling(basename):
+    """Stop the profiler, write its samples and return a report for the console."""
+    profiler.stop()
+    path = profiler.write(conf['profile_dir'], basename, conf['profile_format'])
+    return "\n".join([f"Profile written to {path}"] + profiler.report())
+
+def reload_config(memory):
+    """Apply conf.json edits made since the last turn and say what changed.
+
+    Values read per turn (endpoints, budgets, retrieval settings) switch over
+    by themselves; this re-applies the few that objects copied at startup.
+    """
+    console = renderer.console
+    try:
+        changes = conf.reload()
+    except ConfigError as e:
+        console.print(Text(f"{e}\nKeeping the previous settings.", style="yellow"))
+        return
+    if changes is None:
+        return
+    applied, pending = changes
+    remote_guard.configure(conf)
+    token_counter.configure(conf)
+    profiler.interval = conf['profile_interval_ms'] / 1000.0
+    tag_batcher.window_s = conf['tag_batch_window_ms'] / 1000.0
+    tag_batcher.max_items = conf['tag_batch_max_items']
+    if memory:
+        memory.chunk_min_tokens = conf['memory_chunk_min_tokens']
+        memory.rollup_chunks = conf['memory_rollup_chunks']
+    if applied:
+        console.print(Text(f"conf.json reloaded: {', '.join(applied)}", style="dim"))
+    if pending:
+        console.print(Text(f"conf.json: restart to apply {', '.join(pending)}", style="yellow"))
+    for warning in conf.warnings:
+        console.print(Text(warning, style="yellow"))
+
+def render_cached_response(entry, similarity):
+    """Display a response served from the response cache and return it."""
+    console = renderer.console
+    kind = "exact match" if similarity >= 1.0 else f"~{similarity:.0%} similar to \"{entry['prompt'][:60]}\""
+    console.print()
+    console.print(Panel(
+        Text(f"Served from response cache ({kind}, hit #{entry['hits']}); no request sent", style="bold cyan"),
+        title="⚡ Cache hit",
+        border_style="cyan"
+    ))
+    answer = entry["response"].get("answer", "")
+    if answer.strip():
+        console.print(Markdown(answer.strip()))
+    print("\n")
+    return {**entry["response"], "cached": True}
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI Sidekick chat")
+    parser.add_argument("--resume", metavar="SESSION", default=None,
+                        help="Resume a logged session by id (or 'latest')")
+    args = parser.parse_args()
+
     # Initialize conversation context, history, and system prompt
     try:
         with open('ai_personality_profile.txt', 'r') as f:
@@ -598,106 +1439,246 @@ if __name__ == "__main__":
         print(f"Warning: Could not read personality profile: {str(e)}")
         system_prompt = "You are a helpful AI assistant. Be concise and clear in your responses."
 
+    # Every message goes to an append-only session log; --resume rebuilds the
+    # sliding window from its tail using the stored token counts
+    sessions_dir = conf['sessions_dir']
+    session_id = args.resume
+    if session_id == "latest":
+        session_id = latest_session_id(sessions_dir)
+    if args.resume and (session_id is None or not os.path.exists(session_path(sessions_dir, session_id))):
+        print(f"Session not found: {args.resume}")
+        raise SystemExit(1)
+    session_id = session_id or new_session_id()
+    session_log = SessionLog(session_path(sessions_dir, session_id))
+
     context = ""
-    history = []
+    # history_token_counts[i] is the token count of history[i]; the resumed
+    # window is sized like a turn's history budget
+    history, history_token_counts = session_log.read_window(context_budget.plan(answer_endpoints(conf))["history"])
     enable_thinking = True  # Default thinking mode
-    total_tokens_used = 0  # Reset token counter at the start of each session
+    total_tokens_used = session_log.total_tokens  # Zero for a new session
+    response_cache = load_response_cache(conf)
+    # Mid-term tier: pairs trimmed from the window are compressed in the background
+    memory = load_tiered_memory(
+        conf,
+        summarize=lambda messages: compress_evicted_messages(messages, conf, system_prompt),
+        archive=lambda summaries: archive_memory_chunks(summaries, conf, system_prompt, session_id),
+        count=lambda text: count_tokens([{"role": "system", "content": text}]),
+    )
+    speculation_stats = {"won": 0, "lost": 0, "head_start_s": 0.0, "wasted_chunks": 0}
     
-    console = Console()
+    # SIDEKICK_PROFILE=1 profiles the whole session; /profile toggles it at runtime
+    profiler.interval = conf['profile_interval_ms'] / 1000.0
+    profile_count = 0
+    if os.environ.get('SIDEKICK_PROFILE', "") not in ("", "0"):
+        profiler.start()
+
+    console = renderer.console
     console.print("[bold blue]Welcome to AI Sidekick![/bold blue] Type [yellow]'quit'[/yellow] to exit.")
+    if args.resume:
+        console.print(f"[dim]Resumed session {session_id}: {len(history)} messages in the window, {total_tokens_used} tokens so far.[/dim]", highlight=False)
+    else:
+        console.print(f"[dim]Session {session_id} (resume with --resume {session_id})[/dim]", highlight=False)
+    for warning in conf.warnings:
+        console.print(Text(warning, style="yellow"))
     
-    # Define and register Ctrl+C handler to autosave chat with required args
-    def _handle_sigint(signum, frame):
-        try:
-            global keyboard_interupt_double_autosave_prevention_bool
-            if not keyboard_interupt_double_autosave_prevention_bool:
-                save_chat(history, conf, system_prompt)
-        finally:
-            console = Console()
-            console.print("\n[dim]Session terminated.[/dim]")
-            raise KeyboardInterrupt
-
-    signal.signal(signal.SIGINT, _handle_sigint)
+    # Ctrl+C only flags the shutdown; the autosave runs after the loop exits
+    shutdown = ShutdownCoordinator()
+    signal.signal(signal.SIGINT, shutdown.handle_sigint)
     
     while True:
-        # Get user input
-        console.print("\n[bold green]You:[/bold green] ", end="")
-        user_input = input().strip()
+        try:
+            # Get user input
+            console.print("\n[bold green]You:[/bold green] ", end="")
+            with profiler.idle():
+                user_input = input().strip()
         
-        # Check for exit condition
-        if user_input.lower() in ['quit', 'exit']:
-            print("Goodbye!")
-            break
+            # Check for exit condition
+            if user_input.lower() in ['quit', 'exit']:
+                print("Goodbye!")
+                break
 
-        chat_history_summaries = find_chat_summaries(history, conf, system_prompt, current_user_input=user_input)
-        # Append previous chat summaries (with dates) to the existing context for the LLM
-        if chat_history_summaries:
-            summaries_lines = [
-                "Use the following concise summaries of previous chats as supplemental context. Guidelines for using them:",
-                "- Treat them as high-level reminders; do not assume unstated facts.",
-                "- Prefer more recent items when resolving conflicts.",
-                "- If you draw from a summary, reference its date.",
-                "- Do not invent details not present in the summaries.",
-                "- Ignore items irrelevant to the current request.",
-                "- If a summary conflicts with the user's current instructions, follow the current instructions.",
-                "",
-                "Previous chat summaries:"]
-            for item in chat_history_summaries:
-                date_str = item.get("date", "") or ""
-                summary_str = item.get("summary", "") or ""
-                if date_str:
-                    summaries_lines.append(f"- [{date_str}] {summary_str}")
+            # Edits to conf.json take effect from this turn on
+            if conf['config_hot_reload']:
+                reload_config(memory)
+
+            # /profile [start|stop]: sample this session and dump a flamegraph file
+            if user_input.split(" ")[0] == "/profile":
+                action = user_input[len("/profile"):].strip() or ("stop" if profiler.enabled else "start")
+                if action == "start" and not profiler.enabled:
+                    profiler.start()
+                    console.print("[dim]Profiling on; '/profile' again to stop and write the profile.[/dim]")
+                elif action == "stop" and profiler.enabled:
+                    profile_count += 1
+                    console.print(f"[dim]{stop_profiling(f'{session_id}-{profile_count}')}[/dim]", highlight=False)
                 else:
-                    summaries_lines.append(f"- {summary_str}")
-            summaries_block = "\n".join(summaries_lines)
-            if context:
-                context = f"{context}\n\n{summaries_block}"
+                    console.print(f"[dim]Profiling is already {'on' if profiler.enabled else 'off'}.[/dim]")
+                continue
+
+            # Oversized inputs (pasted, or "/file PATH [question]") are stored as a blob and
+            # replaced by a compact summary before they reach history, tags or the LLM
+            ingest_threshold = int(conf['ingest_threshold_tokens'])
+            if user_input.startswith("/file "):
+                file_path, _, question = user_input[len("/file "):].strip().partition(" ")
+                file_path = os.path.expanduser(file_path)
+                if not os.path.isfile(file_path):
+                    console.print(f"[red]No such file: {file_path}[/red]")
+                    continue
+                file_size = os.path.getsize(file_path)
+                try:
+                    if file_size / token_counter.estimator.chars_per_token > ingest_threshold:
+                        contents, digest = ingest_large_input(conf, path=file_path)
+                        console.print(f"[dim]{file_path} stored as blob {digest[:12]}; sending a {len(contents)}-char summary.[/dim]", highlight=False)
+                    else:
+                        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                            contents = f.read()
+                except Exception as e:
+                    # A dead endpoint or unreadable file must not end the session
+                    try:
+                        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                            head = f.read(ingest_fallback_chars(conf))
+                    except OSError as read_error:
+                        console.print(Text(f"Could not read {file_path}: {read_error}", style="red"))
+                        continue
+                    contents = truncated_input(head, file_size, e)
+                    console.print(Text(f"Summarising {file_path} failed ({e}); sending its first {len(head)} characters.", style="yellow"))
+                user_input = f"{question}\n\n{contents}" if question else contents
+            elif len(user_input) / token_counter.estimator.chars_per_token > ingest_threshold:
+                try:
+                    user_input, digest = ingest_large_input(conf, text=user_input)
+                    console.print(f"[dim]Large input stored as blob {digest[:12]}; sending a {len(user_input)}-char summary.[/dim]", highlight=False)
+                except Exception as e:
+                    total_chars = len(user_input)
+                    user_input = truncated_input(user_input[:ingest_fallback_chars(conf)], total_chars, e)
+                    console.print(Text(f"Summarising the large input failed ({e}); sending a truncated excerpt.", style="yellow"))
+
+            # Size this turn from the endpoint's context length and prefill speed:
+            # trim the window to its history budget and resize the mid-term tier
+            fixed_tokens = count_tokens([
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_input},
+            ]) + (count_tokens([{"role": "system", "content": context}]) if context else 0)
+            plan = context_budget.plan(answer_endpoints(conf), fixed_tokens)
+            history, history_token_counts, evicted, evicted_counts = trim_history(
+                history, history_token_counts, plan["history"]
+            )
+            if memory:
+                memory.max_tokens = plan["midterm"]
+                if evicted:
+                    # Trimmed pairs move down to the mid-term tier instead of vanishing
+                    memory.evict(evicted, evicted_counts)
+            console.print(f"[dim]{describe_plan(plan)}[/dim]", highlight=False)
+            down = remote_guard.open_breakers()
+            if down:
+                console.print(
+                    "[dim]down (skipped until a background probe succeeds): "
+                    + ", ".join(f"{b.name} ({b.describe_error()})" for b in down) + "[/dim]",
+                    highlight=False
+                )
+
+            # Mid-term summaries go ahead of this turn's retrieved long-term summaries
+            memory_context = memory.context(context) if memory else context
+
+            cache_hit = response_cache.lookup(user_input, system_prompt, history) if response_cache else None
+            if cache_hit:
+                # Identical (or near-identical) request in the same context: no retrieval, no generation
+                response = render_cached_response(*cache_hit)
+            elif conf['speculative_generation']:
+                # Generation starts now; retrieval decides whether it must restart
+                response = speculative_query(
+                    user_input, history, memory_context, system_prompt, conf, speculation_stats,
+                    max_tokens=plan["max_tokens"], longterm_tokens=plan["longterm"]
+                )
             else:
-                context = summaries_block
+                chat_history_summaries = find_chat_summaries(
+                    history, conf, system_prompt, current_user_input=user_input, budget_tokens=plan["longterm"]
+                )
+                # Append this turn's chat summaries (with dates) to the base context for the LLM;
+                # earlier turns' summaries are not carried over, so the prompt doesn't keep growing
+                turn_context = build_summaries_context(memory_context, chat_history_summaries)
 
+                # Query LLM with context and history
+                response = answer_query(user_input, history, turn_context, system_prompt, conf, max_tokens=plan["max_tokens"])
         
+            # No need to print response here as it's already streamed
 
-        # Query LLM with context and history
-        response = query_llm(
-            prompt=user_input,
-            history=history,
-            context=context,
-            system_prompt=system_prompt,
-            baseurl=conf['baseurl'][0]  # Using first base URL from config
-        )
+            # Cache complete, fresh answers (keyed on the history before this exchange)
+            if response_cache and not cache_hit and not response.get("cancelled") and not response.get("error"):
+                response_cache.store(user_input, system_prompt, history, response)
         
-        # No need to print response here as it's already streamed
-        
-        # Update history with the current exchange and maintain token-based sliding window
-        new_messages = [
-            {"role": "user", "content": user_input},
-            {"role": "assistant", "content": response["full_response"] if isinstance(response, dict) else response}
-        ]
+            # Update history with the current exchange and maintain token-based sliding window
+            new_messages = [
+                {"role": "user", "content": user_input},
+                {"role": "assistant", "content": response["full_response"] if isinstance(response, dict) else response}
+            ]
         
-        # Count tokens in new messages and update total for this session
-        new_tokens = count_tokens(new_messages)
-        total_tokens_used += new_tokens
-        console.print(f"[dim]Total tokens used in this session: {total_tokens_used}[/dim]\n")
+            # Count tokens per new message, log them, and update total for this session;
+            # the answer's count comes from the server's usage block when it sent one
+            new_token_counts = [count_tokens([new_messages[0]])]
+            if response.get("completion_tokens") is not None:
+                new_token_counts.append(
+                    MESSAGE_OVERHEAD_TOKENS + token_counter.count("assistant") + response["completion_tokens"]
+                )
+            else:
+                new_token_counts.append(count_tokens([new_messages[1]]))
+            new_tokens = sum(new_token_counts)
+            total_tokens_used += new_tokens
+            for message, tokens in zip(new_messages, new_token_counts):
+                session_log.append(message, tokens)
+            renderer.print_stage_summary()
+            turn_tokens = token_ledger.pop_turn()
+            if turn_tokens:
+                console.print(f"[dim]Tokens this turn (prompt→completion, * counted locally): {format_ledger(turn_tokens)}[/dim]", highlight=False)
+            prompt_total, completion_total, calls = token_ledger.session_totals()
+            console.print(
+                f"[dim]Total tokens used in this session: {prompt_total + completion_total} "
+                f"({prompt_total} prompt + {completion_total} completion over {calls} calls)[/dim]\n",
+                highlight=False
+            )
         
-        # Add new messages
-        history.extend(new_messages)
-        # Reset prevention flag on new user input/change in history
-        keyboard_interupt_double_autosave_prevention_bool = False
+            # Add new messages
+            history.extend(new_messages)
+            history_token_counts.extend(new_token_counts)
+            # Reset prevention flag on new user input/change in history
+            keyboard_interupt_double_autosave_prevention_bool = False
+
+            # Stream was cancelled by Ctrl+C: partial answer is in history, shut down
+            if shutdown.requested.is_set():
+                break
         
-        # Trigger save when total tokens cross a multiple of the sliding window size
-        window = CHAT_SLIDING_WINDOW_MAX_TOKENS
-        if window and total_tokens_used > 0:
-            prev_total = total_tokens_used - new_tokens
-            if (prev_total // window) < (total_tokens_used // window):
-                save_chat(history, conf, system_prompt)
-                # Set prevention flag so immediate Ctrl+C won't double-save
-                keyboard_interupt_double_autosave_prevention_bool = True
+            # Trigger save when total tokens cross a multiple of the sliding window size
+            window = conf['chat_sliding_window_max_size']
+            if window and total_tokens_used > 0:
+                prev_total = total_tokens_used - new_tokens
+                if (prev_total // window) < (total_tokens_used // window):
+                    save_chat(history, conf, system_prompt, session_id)
+                    # Set prevention flag so immediate Ctrl+C won't double-save
+                    keyboard_interupt_double_autosave_prevention_bool = True
         
-        # Check token count and trim history if needed
-        while history and count_tokens(history) > CHAT_SLIDING_WINDOW_MAX_TOKENS:
-            # Remove oldest message pair (user + assistant messages)
-            if len(history) >= 2:
-                history = history[2:]
-            else:
-                # If somehow we have an odd number of messages, just remove the oldest
-                history = history[1:]
\ No newline at end of file
+            # The window itself is trimmed at the start of the next turn, once its budget is known
+            if memory:
+                console.print(
+                    f"[dim]memory: window {sum(history_token_counts)}/{plan['history']} · {memory.status()}[/dim]",
+                    highlight=False
+                )
+        except KeyboardInterrupt:
+            break
+
+    if shutdown.requested.is_set():
+        # Autosave in the background; a hung LLM or history server can't block exit
+        if history and not keyboard_interupt_double_autosave_prevention_bool:
+            deadline = float(conf['shutdown_autosave_deadline_s'])
+            console.print(f"\n[dim]Saving chat (up to {deadline:.0f}s, Ctrl+C again to skip)...[/dim]")
+            if not shutdown.flush(lambda: save_chat(history, conf, system_prompt, session_id), deadline):
+                console.print("[yellow]Autosave did not finish in time; skipped.[/yellow]")
+        console.print("\n[dim]Session terminated.[/dim]")
+    if memory:
+        # Roll the mid-term tier into the long-term store, under the same deadline as the autosave
+        deadline = float(conf['shutdown_autosave_deadline_s'])
+        if memory.unsaved():
+            console.print(f"[dim]Archiving mid-term memory (up to {deadline:.0f}s)...[/dim]")
+        if not memory.stop(deadline):
+            console.print("[yellow]Mid-term memory was not archived in time; dropped.[/yellow]")
+    if profiler.enabled:
+        console.print(f"[dim]{stop_profiling(f'{session_id}-{profile_count + 1}')}[/dim]", highlight=False)
+    session_log.close()
@@ -0,0 +1,162 @@
+import queue
+import threading
+from collections import deque
+
+# Three memory tiers, each with its own token budget in the prompt:
+#
+#   working    the verbatim `history` sliding window (chat_sliding_window_max_size)
+#   mid-term   compressed summaries of pairs evicted from the window, held
+#              here in order (memory_midterm_max_tokens)
+#   long-term  chat_history rows in ws4sqlite, retrieved by tag
+#              (memory_longterm_max_tokens)
+#
+# Evicted messages accumulate until there are memory_chunk_min_tokens of
+# them, then a background thread compresses them into one chunk summary.
+# When the mid-term tier is over budget its oldest chunks are rolled up
+# into a single long-term row. At exit, stop() compresses what is still
+# pending and rolls up every remaining chunk, so nothing evicted is lost.
+
+def fit_to_budget(items, max_tokens, count):
+    """Keep items in order while their total `count(item)` fits in max_tokens."""
+    kept = []
+    used = 0
+    for item in items:
+        tokens = count(item)
+        if used + tokens > max_tokens:
+            continue
+        kept.append(item)
+        used += tokens
+    return kept, used
+
+class TieredMemory:
+    """Mid-term memory between the sliding window and the long-term store.
+
+    `summarize(messages)` compresses evicted messages into a short text,
+    `archive(summaries)` writes a list of chunk summaries to the long-term
+    store, and `count(text)` returns a token count. The first two run on the
+    background thread and may be slow or raise.
+    """
+
+    _STOP = object()
+
+    def __init__(self, summarize, archive, count, max_tokens=1000, chunk_min_tokens=600, rollup_chunks=4):
+        self._summarize = summarize
+        self._archive = archive
+        self._count = count
+        self.max_tokens = int(max_tokens)
+        self.chunk_min_tokens = int(chunk_min_tokens)
+        self.rollup_chunks = max(1, int(rollup_chunks))
+        self._lock = threading.Lock()
+        # Mid-term chunks, oldest first: {"summary": str, "tokens": int, "messages": int}
+        self.chunks = deque()
+        self._pending = []
+        self._pending_tokens = 0
+        self.archived = 0
+        self.errors = 0
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def evict(self, messages, token_counts):
+        """Hand over messages dropped from the working window."""
+        self._pending.extend(messages)
+        self._pending_tokens += sum(token_counts)
+        if self._pending_tokens >= self.chunk_min_tokens:
+            self._jobs.put(self._pending)
+            self._pending = []
+            self._pending_tokens = 0
+
+    def _run(self):
+        while True:
+            messages = self._jobs.get()
+            if messages is self._STOP:
+                with self._lock:
+                    remaining = list(self.chunks)
+                    self.chunks.clear()
+                for start in range(0, len(remaining), self.rollup_chunks):
+                    self._roll_up(remaining[start:start + self.rollup_chunks])
+                return
+            try:
+                summary = self._summarize(messages).strip()
+            except Exception:
+                self.errors += 1
+                continue
+            if not summary:
+                continue
+            rollup = []
+            with self._lock:
+                self.chunks.append({"summary": summary, "tokens": self._count(summary), "messages": len(messages)})
+                while self.chunks and self._used() > self.max_tokens:
+                    rollup.extend(self.chunks.popleft() for _ in range(min(self.rollup_chunks, len(self.chunks))))
+            if rollup:
+                self._roll_up(rollup)
+
+    def _roll_up(self, rollup):
+        try:
+            self._archive([chunk["summary"] for chunk in rollup])
+            self.archived += len(rollup)
+        except Exception:
+            self.errors += 1
+
+    def _used(self):
+        return sum(chunk["tokens"] for chunk in self.chunks)
+
+    def context(self, context):
+        """Prepend the mid-term summaries to `context` for the next request."""
+        with self._lock:
+            summaries = [chunk["summary"] for chunk in self.chunks]
+        if not summaries:
+            return context
+        lines = ["Earlier in this conversation (compressed, oldest first):"]
+        lines.extend(f"- {summary}" for summary in summaries)
+        block = "\n".join(lines)
+        if context:
+            return f"{block}\n\n{context}"
+        return block
+
+    def status(self):
+        """One-line description of the mid-term tier for the per-turn summary."""
+        with self._lock:
+            used = self._used()
+            count = len(self.chunks)
+        line = f"mid-term {count} chunks {used}/{self.max_tokens}"
+        if self._pending_tokens:
+            line += f" (+{self._pending_tokens} pending)"
+        if self.archived:
+            line += f" · {self.archived} rolled up"
+        if self.errors:
+            line += f" · {self.errors} errors"
+        return line
+
+    def unsaved(self):
+        """True while evicted messages or chunks are not in the long-term store yet."""
+        with self._lock:
+            return bool(self.chunks or self._pending or not self._jobs.empty())
+
+    def stop(self, deadline=None):
+        """Compress pending messages, archive every chunk and stop the background thread.
+
+        Waits at most `deadline` seconds (None: until done). Returns True
+        if everything was archived in time; the thread is a daemon, so
+        whatever is left after the deadline is dropped at exit.
+        """
+        if self._pending:
+            self._jobs.put(self._pending)
+            self._pending = []
+            self._pending_tokens = 0
+        self._jobs.put(self._STOP)
+        self._thread.join(deadline)
+        return not self._thread.is_alive()
+
+def load_tiered_memory(conf, summarize, archive, count):
+    """Build the mid-term tier from conf, or return None when it is disabled."""
+    if not conf['memory_tiers_enabled']:
+        return None
+    return TieredMemory(
+        summarize,
+        archive,
+        count,
+        max_tokens=conf['memory_midterm_max_tokens'],
+        chunk_min_tokens=conf['memory_chunk_min_tokens'],
+        rollup_chunks=conf['memory_rollup_chunks'],
+    )
@@ -0,0 +1,280 @@
+import argparse
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer as _ThreadingHTTPServer
+
+# Local stand-ins for the OpenAI-compatible endpoints in conf['baseurl']
+# and the ws4sqlite chat_history server. LLM latency is simulated from the
+# prompt size (prefill) and the number of generated tokens (decode) so
+# benchmarks see realistic timing shapes.
+
+MOCK_WORDS = [
+    "the", "model", "answer", "simply", "because", "python", "server", "token",
+    "latency", "cache", "thread", "request", "result", "value", "context", "prompt",
+]
+
+_MOCK_TOKEN_RE = re.compile(r"\w{1,6}|[^\w\s]")
+
+def _estimate_tokens(text):
+    # Rough 4 chars/token estimate, same fallback count_tokens() uses
+    return max(1, len(text) // 4)
+
+def _mock_tokenize(text):
+    # Word pieces of up to 6 characters plus punctuation: deterministic counts,
+    # deliberately not a fixed chars/token ratio, so estimators need calibrating
+    return [hash(piece) & 0xFFFF for piece in _MOCK_TOKEN_RE.findall(text)]
+
+class ThreadingHTTPServer(_ThreadingHTTPServer):
+    # socketserver's default backlog of 5 drops connects when many sessions
+    # arrive together (e.g. all callers of one batched tag request)
+    request_queue_size = 128
+
+def _mock_reply(messages, max_tokens, rng):
+    """Build a deterministic reply for a chat request."""
+    user_text = messages[-1].get("content", "") if messages else ""
+    if "numbered chat transcripts" in user_text:
+        # Batched tag request (tag_batching.py): one numbered list per transcript
+        count = user_text.count("\n### Transcript ")
+        lines = "\n".join(
+            f"{number}: [" + ", ".join(f"\"mock-tag-{rng.randint(0, 20)}\"" for _ in range(5)) + "]"
+            for number in range(1, count + 1)
+        )
+        padding = " ".join(rng.choice(MOCK_WORDS) for _ in range(60 + rng.randint(0, 60)))
+        return f"{lines}\n\nThese tags were chosen because {padding}"
+    if "detailed tags that uniquely identify" in user_text:
+        tags = ", ".join(f"\"mock-tag-{rng.randint(0, 20)}\"" for _ in range(5))
+        if "Summary:" in user_text:
+            return f"Summary: Mock summary of a chat about {rng.choice(MOCK_WORDS)}.\nTags: [{tags}]"
+        # Chatty models keep going after the list; tag requests stop reading at "]"
+        padding = " ".join(rng.choice(MOCK_WORDS) for _ in range(60 + rng.randint(0, 60)))
+        return f"[{tags}]\n\nThese tags were chosen because {padding}"
+    # Reply length depends on the system prompt so that personalities differ
+    length = min(max_tokens, 40 + rng.randint(0, 160))
+    return " ".join(rng.choice(MOCK_WORDS) for _ in range(length))
+
+def _make_handler(prefill_tps, decode_tps, n_ctx, slots=0):
+    # Like llama.cpp's --parallel: requests beyond `slots` queue for a free slot
+    slot_pool = threading.BoundedSemaphore(slots) if slots else None
+
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, obj, status=200):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json({"object": "list", "data": [{"id": "my-model", "object": "model", "max_model_len": n_ctx}]})
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.rstrip("/").endswith("/tokenize"):
+                self._send_json({"tokens": _mock_tokenize(str(body.get("content", "")))})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json({"error": "not found"}, status=404)
+                return
+            if slot_pool is None:
+                self._complete(body)
+                return
+            with slot_pool:
+                self._complete(body)
+
+        def _complete(self, body):
+            messages = body.get("messages") or []
+            prompt_text = "\n".join(str(m.get("content", "")) for m in messages)
+            prompt_tokens = _estimate_tokens(prompt_text)
+            rng = random.Random(prompt_text)
+            reply = _mock_reply(messages, int(body.get("max_tokens") or 256), rng)
+            stop = body.get("stop") or []
+            for marker in [stop] if isinstance(stop, str) else stop:
+                if marker in reply:
+                    reply = reply[:reply.index(marker)]
+            pieces = reply.split(" ")
+            completion_tokens = len(pieces)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+
+            prefill_s = prompt_tokens / prefill_tps
+            decode_s = completion_tokens / decode_tps
+            timings = {
+                "prompt_n": prompt_tokens,
+                "prompt_ms": prefill_s * 1000.0,
+                "predicted_n": completion_tokens,
+                "predicted_ms": decode_s * 1000.0,
+            }
+            time.sleep(prefill_s)
+
+            created = int(time.time())
+            if not body.get("stream"):
+                time.sleep(decode_s)
+                self._send_json({
+                    "id": "mock-completion",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": "my-model",
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+                    "usage": usage,
+                    "timings": timings,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def _event(delta, finish_reason=None, extra=None):
+                chunk = {
+                    "id": "mock-completion",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": "my-model",
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                if extra:
+                    chunk.update(extra)
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            try:
+                for i, piece in enumerate(pieces):
+                    delta = {"content": piece if i == 0 else " " + piece}
+                    if i == 0:
+                        delta["role"] = "assistant"
+                    _event(delta)
+                    time.sleep(1.0 / decode_tps)
+                _event({}, finish_reason="stop", extra={"timings": timings})
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self.wfile.write(f"data: {json.dumps({'id': 'mock-completion', 'object': 'chat.completion.chunk', 'created': created, 'model': 'my-model', 'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # Client cancelled the stream
+                pass
+
+    return MockLLMHandler
+
+def start_mock_llm_server(host="127.0.0.1", port=0, prefill_tps=2000.0, decode_tps=80.0, n_ctx=32768, slots=0):
+    """Start a mock OpenAI-compatible server in a daemon thread.
+
+    With slots > 0 at most that many completions run at once and the rest
+    wait. Returns (server, base_url); call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _make_handler(prefill_tps, decode_tps, n_ctx, slots))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+# The table as created by hand before the chat_history_db.py migrations
+MOCK_HISTORY_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS chat_history "
+    "(id INTEGER PRIMARY KEY AUTOINCREMENT, summary TEXT, tags TEXT, date TEXT, time TEXT)"
+)
+
+def _make_history_handler(db_path, latency_s):
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.execute(MOCK_HISTORY_SCHEMA)
+    # One writer at a time, like ws4sqlite on a single SQLite file
+    lock = threading.Lock()
+
+    def _run(item):
+        values = item.get("values") or {}
+        if "query" in item:
+            cur = conn.execute(item["query"], values)
+            columns = [d[0] for d in cur.description or []]
+            return {"success": True, "resultSet": [dict(zip(columns, row)) for row in cur.fetchall()]}
+        if "valuesBatch" in item:
+            return {"success": True, "rowsUpdatedBatch": [conn.execute(item["statement"], v).rowcount for v in item["valuesBatch"]]}
+        return {"success": True, "rowsUpdated": conn.execute(item["statement"], values).rowcount}
+
+    class MockHistoryHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, obj, status=200):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if latency_s:
+                time.sleep(latency_s)
+            results = []
+            with lock:
+                # Every request is one transaction; a failing item rolls it back
+                conn.execute("BEGIN")
+                for i, item in enumerate(body.get("transaction") or []):
+                    try:
+                        results.append(_run(item))
+                    except sqlite3.Error as e:
+                        conn.execute("ROLLBACK")
+                        self._send_json({"reqIdx": i, "error": str(e)}, status=500)
+                        return
+                conn.execute("COMMIT")
+            self._send_json({"results": results})
+
+    return MockHistoryHandler
+
+def start_mock_history_server(host="127.0.0.1", port=0, db_path=":memory:", latency_s=0.0):
+    """Start a ws4sqlite-compatible server for chat_history in a daemon thread.
+
+    Accepts {"transaction": [...]} requests (query / statement, values /
+    valuesBatch) and ignores authentication. Returns (server, url) where url
+    is what conf['chat_history_server_url'] should be set to.
+    """
+    server = ThreadingHTTPServer((host, port), _make_history_handler(db_path, latency_s))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/chat_history"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local stand-in servers for AI Sidekick")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=8081)
+    parser.add_argument("--prefill-tps", type=float, default=2000.0, help="Simulated prompt tokens/sec")
+    parser.add_argument("--decode-tps", type=float, default=80.0, help="Simulated generated tokens/sec")
+    parser.add_argument("--n-ctx", type=int, default=32768, help="Context size reported by /models")
+    parser.add_argument("--slots", type=int, default=0, help="Concurrent completions before requests queue (0 = unlimited)")
+    parser.add_argument("--history-port", type=int, default=0, help="Also serve a mock ws4sqlite chat_history on this port")
+    parser.add_argument("--history-db", default=":memory:", help="SQLite file behind the mock chat_history server")
+    parser.add_argument("--history-latency-s", type=float, default=0.0, help="Added latency per chat_history request")
+    args = parser.parse_args()
+
+    _, llm_url = start_mock_llm_server(args.host, args.llm_port, args.prefill_tps, args.decode_tps, args.n_ctx, args.slots)
+    print(f"Mock LLM server listening on {llm_url}")
+    if args.history_port:
+        _, history_url = start_mock_history_server(args.host, args.history_port, args.history_db, args.history_latency_s)
+        print(f"Mock chat_history server listening on {history_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("Mock servers stopped.")
@@ -0,0 +1,323 @@
+import re
+
+# Single-pass parser for the summary/tag replies of the tagging, autosave
+# and memory prompts:
+#
+#   [<think> ... </think>] [Summary: <text>] [Tags:] ["tag1", 'tag2', bare tag, ...]
+#
+# OutputParser is a small state machine fed with text as it streams in.
+# Each state looks for its next token with one precompiled pattern from
+# where it left off, so the input is scanned once whatever its size, and
+# a chunk boundary inside a token is held back until the next feed(). The
+# tag list counts as complete at its closing "]" (or once max_items tags
+# are in), so a streamed tag request can stop right there. BatchTagParser
+# does the same for a batched tag reply (tag_batching.py), one numbered
+# list per transcript.
+
+_TEXT_EVENTS = re.compile(r"<think>|tags:|\[", re.IGNORECASE)
+_TEXT_EVENTS_WITH_SUMMARY = re.compile(r"<think>|summary:|tags:|\[", re.IGNORECASE)
+_SUMMARY_END = re.compile(r"\n[ \t]*tags:[ \t]*", re.IGNORECASE)
+_LIST_TOKEN = re.compile(r"""\s*(?:(["'])|(\])|(,)|([^,\]"'\s]))""")
+# The rest of an item once it has started: up to the closing quote, or to "," / "]"
+_ITEM_REST = {
+    '"': re.compile(r'(?:[^"\\]|\\.)*', re.DOTALL),
+    "'": re.compile(r"(?:[^'\\]|\\.)*", re.DOTALL),
+    None: re.compile(r"[^,\]]*"),
+}
+_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+# Batched tag replies: one "N: [...]" line per transcript
+_BATCH_MARKER = re.compile(r"^[ \t]*(?:transcript[ \t]*)?#?(\d+)[ \t]*[:.)]", re.IGNORECASE | re.MULTILINE)
+_BATCH_MARKER_PREFIX = re.compile(r"[ \t]*(?:t[a-z]*[ \t]*)?#?\d*[ \t]*", re.IGNORECASE)
+# Fallback when there is no usable list: every quoted string in the reply
+_QUOTED = re.compile(r"['\"]([^'\"]+)['\"]")
+
+_THINK_END = "</think>"
+# Longest marker a chunk boundary can cut in two, minus one
+_TEXT_HOLD_BACK = len("summary:") - 1
+# A summary line this short may still turn out to be "\n  Tags:"
+_SUMMARY_HOLD_BACK = 32
+# Summary fallback when the reply has no "Summary:" marker
+MAX_FALLBACK_SUMMARY_CHARS = 1000
+
+class OutputParser:
+    """Incremental Summary/Tags extraction; feed() chunks, then close().
+
+    With summary=False only the tag list is looked for and the first "["
+    outside a <think> block starts it. With max_items the list is complete
+    after that many items. After close(), `tags` holds the
+    cleaned, lowercased tags (falling back to quoted strings anywhere in
+    the reply) and `summary` the summary text.
+    """
+
+    def __init__(self, summary=False, max_items=None):
+        self._events = _TEXT_EVENTS_WITH_SUMMARY if summary else _TEXT_EVENTS
+        self._want_summary = summary
+        self._state = "text"
+        self._buffer = ""
+        self._received = []
+        self._summary_parts = []
+        self._summary_seen = False
+        self._items = []
+        self._max_items = max_items
+        # Item being read: its opening quote (None when bare) and text so far
+        self._quote = None
+        self._item_parts = []
+        self.tags_complete = False
+        self.closed = False
+        self.tags = []
+        self.summary = ""
+
+    def feed(self, text):
+        """Consume the next piece of the reply; returns True once the tag list is closed."""
+        if self.closed:
+            raise ValueError("feed() after close()")
+        self._received.append(text)
+        if self._state != "done":
+            self._buffer += text
+            self._scan(final=False)
+        return self.tags_complete
+
+    def close(self):
+        """Finish parsing at end of input and settle `tags` and `summary`."""
+        if self.closed:
+            return self
+        self._scan(final=True)
+        self.closed = True
+        self.tags = [str(t).strip().lower() for t in self._items if str(t).strip()]
+        full = "".join(self._received)
+        if not self.tags:
+            self.tags = [t.lower() for t in _QUOTED.findall(full)]
+        if self._want_summary:
+            summary = "".join(self._summary_parts).strip()
+            if not self._summary_seen or not summary:
+                summary = full.split(_THINK_END)[-1].strip()[:MAX_FALLBACK_SUMMARY_CHARS]
+            self.summary = summary
+        return self
+
+    def _scan(self, final):
+        buf = self._buffer
+        pos = 0
+        while pos < len(buf) and self._state != "done":
+            state = self._state
+            if state == "text":
+                m = self._events.search(buf, pos)
+                if m is None:
+                    pos = len(buf) if final else max(pos, len(buf) - _TEXT_HOLD_BACK)
+                    break
+                token = m.group(0).lower()
+                pos = m.end()
+                if token == "<think>":
+                    self._state = "think"
+                elif token == "summary:":
+                    self._summary_seen = True
+                    self._state = "summary"
+                elif token == "tags:":
+                    self._state = "await_list"
+                else:
+                    self._state = "list"
+            elif state == "think":
+                end = buf.find(_THINK_END, pos)
+                if end == -1:
+                    pos = len(buf) if final else max(pos, len(buf) - len(_THINK_END) + 1)
+                    break
+                pos = end + len(_THINK_END)
+                self._state = "text"
+            elif state == "summary":
+                m = _SUMMARY_END.search(buf, pos)
+                if m is None:
+                    cut = len(buf)
+                    if not final:
+                        newline = buf.rfind("\n", pos)
+                        if newline != -1 and len(buf) - newline <= _SUMMARY_HOLD_BACK:
+                            cut = newline
+                    self._summary_parts.append(buf[pos:cut])
+                    pos = cut
+                    break
+                self._summary_parts.append(buf[pos:m.start()])
+                pos = m.end()
+                self._state = "await_list"
+            elif state == "await_list":
+                start = buf.find("[", pos)
+                if start == -1:
+                    pos = len(buf)
+                    break
+                pos = start + 1
+                self._state = "list"
+            elif state == "list":
+                m = _LIST_TOKEN.match(buf, pos)
+                if m is None:
+                    # Only whitespace left
+                    pos = len(buf)
+                    break
+                pos = m.end()
+                if m.group(2) is not None:
+                    self.tags_complete = True
+                    self._state = "done"
+                elif m.group(3) is None:
+                    self._quote = m.group(1)
+                    self._item_parts = [] if self._quote else [m.group(4)]
+                    self._state = "item"
+            else:
+                # Items are read incrementally, so one spanning many chunks is scanned once
+                m = _ITEM_REST[self._quote].match(buf, pos)
+                self._item_parts.append(m.group(0))
+                pos = m.end()
+                if pos == len(buf):
+                    break
+                if self._quote is None:
+                    # Leave the "," or "]" for the list state
+                    self._end_item()
+                elif buf[pos] == self._quote:
+                    pos += 1
+                    self._end_item()
+                else:
+                    # A backslash at the end of the buffer: its escaped character is still to come
+                    break
+        if final and self._state == "item":
+            self._end_item()
+        self._buffer = "" if self._state == "done" else buf[pos:]
+
+    def _end_item(self):
+        text = "".join(self._item_parts)
+        self._items.append(_ESCAPE.sub(r"\1", text) if self._quote else text)
+        self._item_parts = []
+        if self._max_items and len(self._items) >= self._max_items:
+            self.tags_complete = True
+            self._state = "done"
+        else:
+            self._state = "list"
+
+class BatchTagParser:
+    """Splits a batched tag reply ("1: [...]" per transcript) back into per-item tags.
+
+    Each numbered section goes to its own OutputParser; a leading <think>
+    block is skipped. feed() returns True once every item's list is
+    complete. After close(), `tags` holds one list per item, None where the
+    reply has no usable list for it.
+    """
+
+    def __init__(self, count, max_items=None):
+        self.count = count
+        self._max_items = max_items
+        self._parsers = {}
+        self._current = None
+        self._buffer = ""
+        self._state = "start"
+        self._line_start = True
+        self.closed = False
+        self.tags = []
+
+    def feed(self, text):
+        if self.closed:
+            raise ValueError("feed() after close()")
+        self._buffer += text
+        self._scan(final=False)
+        return len(self._parsers) == self.count and all(p.tags_complete for p in self._parsers.values())
+
+    def close(self):
+        if self.closed:
+            return self
+        self._scan(final=True)
+        self.closed = True
+        parsers = [self._parsers.get(number) for number in range(1, self.count + 1)]
+        self.tags = [(parser.close().tags or None) if parser else None for parser in parsers]
+        return self
+
+    def _scan(self, final):
+        buf = self._buffer
+        if self._state == "start":
+            stripped = buf.lstrip()
+            if not final and len(stripped) < len("<think>") and "<think>".startswith(stripped):
+                return
+            self._state = "think" if stripped.startswith("<think>") else "lines"
+        if self._state == "think":
+            end = buf.find(_THINK_END)
+            if end == -1:
+                self._buffer = "" if final else buf[-(len(_THINK_END) - 1):]
+                return
+            buf = buf[end + len(_THINK_END):]
+            self._state = "lines"
+        pos = 0
+        while True:
+            m = _BATCH_MARKER.search(buf, pos)
+            if m is not None and m.start() == 0 and not self._line_start:
+                # Mid-line: the buffer starts where the previous feed stopped
+                m = _BATCH_MARKER.search(buf, 1)
+            if m is None:
+                break
+            self._feed_current(buf[pos:m.start()])
+            number = int(m.group(1))
+            if 1 <= number <= self.count and number not in self._parsers:
+                self._current = self._parsers[number] = OutputParser(max_items=self._max_items)
+            else:
+                self._current = None
+            pos = m.end()
+        tail = buf[pos:]
+        # A short last line may still turn out to be the next "N:" marker
+        newline = tail.rfind("\n")
+        if newline != -1:
+            line, line_start = tail[newline + 1:], True
+        else:
+            line, line_start = tail, pos == 0 and self._line_start
+        held = ""
+        if not final and line and line_start and len(line) < 24 and _BATCH_MARKER_PREFIX.fullmatch(line):
+            held = line
+            tail = tail[:len(tail) - len(line)]
+        self._feed_current(tail)
+        self._line_start = bool(held) or (tail.endswith("\n") if tail else self._line_start)
+        self._buffer = held
+
+    def _feed_current(self, text):
+        if text and self._current is not None and not self._current.tags_complete:
+            self._current.feed(text)
+
+def _tag_list_rules(max_tags):
+    more = f"{{0,{max_tags - 1}}}" if max_tags else "*"
+    return (
+        f'list ::= "[" ws (tag (ws "," ws tag){more})? ws "]"\n'
+        'tag ::= "\\"" [^"\\\\\\n]{1,64} "\\""\n'
+        'ws ::= [ \\t\\n]{0,4}\n'
+    )
+
+def tag_list_grammar(max_tags=None):
+    """GBNF (llama.cpp `grammar`) admitting only a list of up to max_tags quoted tags."""
+    return "root ::= list\n" + _tag_list_rules(max_tags)
+
+def tag_batch_grammar(count, max_tags=None):
+    """GBNF for a batched reply: lines "1: [...]" to "count: [...]", in order."""
+    lines = " ".join(f'"{number}: " list "\\n"' for number in range(1, count + 1))
+    return f"root ::= {lines}\n" + _tag_list_rules(max_tags)
+
+def tag_request_options(max_tags=None, constraint="off", batch_size=1):
+    """Extra chat.completions.create params constraining a tag-list reply.
+
+    constraint is "off", "stop" (end generation at the first "]"; any
+    backend, but a "]" inside inline reasoning also stops it) or "grammar"
+    (llama.cpp GBNF; leaves no room for inline reasoning). A batched reply
+    (batch_size > 1) holds several lists, so "stop" does not apply to it.
+    """
+    if constraint == "stop" and batch_size == 1:
+        return {"stop": ["]"]}
+    if constraint == "grammar":
+        grammar = tag_list_grammar(max_tags) if batch_size == 1 else tag_batch_grammar(batch_size, max_tags)
+        return {"extra_body": {"grammar": grammar}}
+    return {}
+
+def parse_tags(content):
+    """Tags from a complete reply (lowercased, stripped, non-empty)."""
+    parser = OutputParser()
+    parser.feed(content)
+    return parser.close().tags
+
+def parse_summary(content):
+    """The Summary: text of a complete reply, or its first 1000 characters."""
+    parser = OutputParser(summary=True)
+    parser.feed(content)
+    return parser.close().summary
+
+def parse_summary_and_tags(content):
+    """(summary, tags) from a complete reply in one pass."""
+    parser = OutputParser(summary=True)
+    parser.feed(content)
+    parser.close()
+    return parser.summary, parser.tags
@@ -0,0 +1,118 @@
+import argparse
+import ast
+import random
+import re
+import statistics
+import time
+from rich.console import Console
+from rich.table import Table
+
+from output_parser import OutputParser, parse_summary, parse_tags
+
+# The parsing main.py did before output_parser.py, kept as the reference
+
+def legacy_parse_tag_list(content):
+    tags_list = []
+    m_list = re.search(r"\[(?:.|\n)*?\]", content)
+    if m_list:
+        try:
+            parsed = ast.literal_eval(m_list.group(0))
+            if isinstance(parsed, list):
+                tags_list = [str(t).strip().lower() for t in parsed if str(t).strip()]
+        except Exception:
+            pass
+    if not tags_list:
+        tags_list = [t.lower() for t in re.findall(r"['\"]([^'\"]+)['\"]", content)]
+    return tags_list
+
+def legacy_parse_summary(content):
+    m_sum = re.search(r"Summary:\s*(.+)", content, re.IGNORECASE | re.DOTALL)
+    summary = ""
+    if m_sum:
+        summary = m_sum.group(1).strip()
+        summary = re.split(r"\n\s*Tags:\s*\[", summary)[0].strip()
+    if not summary:
+        summary = content.strip()[:1000]
+    return summary
+
+WORDS = ["latency", "python", "server", "cache", "the", "of", "retrieval", "sqlite", "tokens", "because", "stream"]
+
+def _prose(rng, chars):
+    words = []
+    size = 0
+    while size < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+def _tag_list(rng, count=12):
+    return "[" + ", ".join(f"\"{rng.choice(WORDS)}-{rng.randint(0, 999)}\"" for _ in range(count)) + "]"
+
+def build_cases(size_chars, seed=0):
+    """(name, reply, summary_mode) pairs: typical, large and malformed outputs."""
+    rng = random.Random(seed)
+    return [
+        ("typical tags", _tag_list(rng), False),
+        ("typical summary", f"Summary: {_prose(rng, 400)}\nTags: {_tag_list(rng)}", True),
+        ("large summary", f"Summary: {_prose(rng, size_chars)}\nTags: {_tag_list(rng, 40)}", True),
+        ("large thinking", f"<think>{_prose(rng, size_chars)} [maybe] [\"draft\"</think>\n{_tag_list(rng)}", False),
+        ("list then rambling", f"{_tag_list(rng)}\n\n{_prose(rng, size_chars)}", False),
+        ("truncated list", _tag_list(rng, 400)[: size_chars // 4], False),
+        ("no list", " ".join(f"\"{w}\"" for w in _prose(rng, size_chars // 4).split()), False),
+        ("unclosed brackets", "[ " * (size_chars // 8) + _prose(rng, size_chars // 4), False),
+    ]
+
+def _time(func, repeats):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - t0)
+    return result, statistics.median(timings)
+
+def _streamed(reply, summary_mode, delta_chars):
+    """Feed the reply in delta_chars pieces like a stream; stop at the closing ']' unless summarising."""
+    parser = OutputParser(summary=summary_mode)
+    consumed = 0
+    for start in range(0, len(reply), delta_chars):
+        consumed = min(len(reply), start + delta_chars)
+        if parser.feed(reply[start:consumed]) and not summary_mode:
+            break
+    parser.close()
+    return parser, consumed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the legacy regex parsing with output_parser on large and malformed replies")
+    parser.add_argument("--size-kb", type=int, default=32, help="Size of the large cases (an 8192-token reply is ~32KB)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--delta-chars", type=int, default=4, help="Characters per streamed delta")
+    args = parser.parse_args()
+
+    console = Console()
+    table = Table(title=f"Reply parsing, median of {args.repeats} runs (ms)")
+    for column in ["case", "chars", "legacy", "parser", "streamed", "read before stop", "same tags"]:
+        table.add_column(column, justify="right")
+
+    for name, reply, summary_mode in build_cases(args.size_kb * 1024):
+        if summary_mode:
+            legacy, legacy_s = _time(lambda: (legacy_parse_summary(reply), legacy_parse_tag_list(reply.split("Tags:")[-1])), args.repeats)
+            current, parser_s = _time(lambda: (parse_summary(reply), parse_tags(reply.split("Tags:")[-1])), args.repeats)
+        else:
+            legacy, legacy_s = _time(lambda: legacy_parse_tag_list(reply), args.repeats)
+            current, parser_s = _time(lambda: parse_tags(reply), args.repeats)
+        (streamed, consumed), streamed_s = _time(lambda: _streamed(reply, summary_mode, args.delta_chars), args.repeats)
+        legacy_tags = legacy[1] if summary_mode else legacy
+        current_tags = current[1] if summary_mode else current
+        table.add_row(
+            name, str(len(reply)),
+            f"{1000 * legacy_s:.2f}", f"{1000 * parser_s:.2f}", f"{1000 * streamed_s:.2f}",
+            f"{100.0 * consumed / max(1, len(reply)):.1f}%",
+            "yes" if legacy_tags == current_tags == streamed.tags else f"no ({len(legacy_tags)} vs {len(current_tags)})",
+        )
+    console.print(table)
+    console.print(
+        "[dim]'streamed' feeds the reply in small deltas and, for tag-only replies, stops at the closing ']'. "
+        "Tag differences on malformed cases come from the legacy path's literal_eval/quote-scan fallback.[/dim]"
+    )
@@ -0,0 +1,198 @@
+from openai import OpenAI
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rich.console import Console
+from rich.table import Table
+
+from config import load_config
+from system_personality_generator import load_variant_index, render_personality
+
+DEFAULT_PROBE_PROMPT = "Explain in a few sentences what a race condition is and how to avoid one."
+
+def run_variant(variant_id, system_prompt, base_url, probe_prompt, max_tokens=512, timeout=120.0):
+    """Stream one probe request with `system_prompt` and record its timings.
+
+    prefill_s is the server-reported prompt processing time (llama.cpp
+    `timings.prompt_ms`) when available; ttft_s is measured client-side up to
+    the first reasoning or answer token.
+    """
+    result = {
+        "id": variant_id,
+        "endpoint": base_url,
+        "prompt_chars": len(system_prompt),
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "prefill_s": None,
+        "ttft_s": None,
+        "total_s": None,
+        "response_chars": 0,
+        "error": None,
+    }
+    client = OpenAI(base_url=base_url, api_key="dummy_api_key", timeout=timeout, max_retries=0)
+    t0 = time.perf_counter()
+    try:
+        stream = client.chat.completions.create(
+            model="my-model",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": probe_prompt},
+            ],
+            temperature=0.7,
+            top_p=0.9,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            now = time.perf_counter()
+            if chunk.choices:
+                delta = chunk.choices[0].delta
+                text = getattr(delta, 'reasoning_content', None) or delta.content or ""
+                if text:
+                    if result["ttft_s"] is None:
+                        result["ttft_s"] = now - t0
+                    result["response_chars"] += len(text)
+            usage = getattr(chunk, 'usage', None)
+            if usage is not None:
+                result["prompt_tokens"] = usage.prompt_tokens
+                result["completion_tokens"] = usage.completion_tokens
+            timings = (getattr(chunk, 'model_extra', None) or {}).get('timings')
+            if isinstance(timings, dict) and timings.get('prompt_ms') is not None:
+                result["prefill_s"] = float(timings['prompt_ms']) / 1000.0
+        result["total_s"] = time.perf_counter() - t0
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def run_benchmark(variants, endpoints, probe_prompt=DEFAULT_PROBE_PROMPT, concurrency=8, repeats=1, max_tokens=512, on_result=None):
+    """Run every (variant, repeat) pair across `endpoints` in parallel.
+
+    `variants` is a list of (variant_id, system_prompt) pairs; endpoints are
+    assigned round-robin. Returns the list of per-request result dicts.
+    """
+    jobs = [
+        (variant_id, system_prompt, endpoints[n % len(endpoints)])
+        for n, (variant_id, system_prompt) in enumerate(
+            pair for pair in variants for _ in range(repeats)
+        )
+    ]
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(run_variant, variant_id, system_prompt, endpoint, probe_prompt, max_tokens)
+            for variant_id, system_prompt, endpoint in jobs
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+def summarize_results(results):
+    """Aggregate results per variant (medians over repeats), cheapest first."""
+    by_variant = {}
+    for r in results:
+        by_variant.setdefault(r["id"], []).append(r)
+
+    def _median(rows, key):
+        values = [r[key] for r in rows if r[key] is not None]
+        return statistics.median(values) if values else None
+
+    summary = []
+    for variant_id, rows in by_variant.items():
+        ok = [r for r in rows if not r["error"]]
+        summary.append({
+            "id": variant_id,
+            "runs": len(rows),
+            "errors": len(rows) - len(ok),
+            "prompt_tokens": _median(ok, "prompt_tokens"),
+            "prefill_s": _median(ok, "prefill_s"),
+            "ttft_s": _median(ok, "ttft_s"),
+            "total_s": _median(ok, "total_s"),
+            "response_chars": _median(ok, "response_chars"),
+        })
+    # Cheapest to serve: fastest first token, then shortest end-to-end time
+    summary.sort(key=lambda s: (s["ttft_s"] is None, s["ttft_s"] or 0.0, s["total_s"] or 0.0))
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark personality variants for serving cost")
+    parser.add_argument("--index", default="personality_variants.jsonl", help="Variant index from system_personality_generator.py --batch")
+    parser.add_argument("--endpoint", action="append", default=None, help="Base URL to benchmark (repeatable, defaults to conf.json baseurl)")
+    parser.add_argument("--mock", action="store_true", help="Benchmark against a local mock server instead")
+    parser.add_argument("--baseline", default=None, help="Profile text file to include as the 'baseline' variant (A/B reference)")
+    parser.add_argument("--limit", type=int, default=0, help="Only benchmark the first N variants")
+    parser.add_argument("--repeats", type=int, default=1, help="Requests per variant")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--prompt", default=DEFAULT_PROBE_PROMPT, help="Probe user prompt")
+    parser.add_argument("--out", default="personality_benchmark.jsonl", help="Per-request results file")
+    parser.add_argument("--top", type=int, default=15, help="Rows to show in the summary table")
+    args = parser.parse_args()
+
+    console = Console()
+
+    if args.mock:
+        from mock_servers import start_mock_llm_server
+        _, mock_url = start_mock_llm_server()
+        endpoints = [mock_url]
+    elif args.endpoint:
+        endpoints = args.endpoint
+    else:
+        endpoints = load_config('conf.json')['baseurl']
+
+    index = load_variant_index(args.index)
+    if args.limit > 0:
+        index = index[: args.limit]
+    variants = [(v["id"], render_personality(v)) for v in index]
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            variants.insert(0, ("baseline", f.read()))
+
+    console.print(f"[bold blue]Benchmarking {len(variants)} variants x {args.repeats} against {len(endpoints)} endpoint(s)[/bold blue]")
+
+    with open(args.out, 'w', encoding='utf-8') as out:
+        done = [0]
+        total = len(variants) * args.repeats
+
+        def _record(result):
+            out.write(json.dumps(result) + "\n")
+            done[0] += 1
+            console.print(f"[dim]{done[0]}/{total}[/dim]", end="\r", highlight=False)
+
+        results = run_benchmark(
+            variants,
+            endpoints,
+            probe_prompt=args.prompt,
+            concurrency=args.concurrency,
+            repeats=args.repeats,
+            max_tokens=args.max_tokens,
+            on_result=_record,
+        )
+
+    summary = summarize_results(results)
+
+    def _fmt(value, spec="{:.3f}"):
+        return "-" if value is None else spec.format(value)
+
+    table = Table(title=f"Cheapest variants (results in '{args.out}')")
+    for column in ["variant", "runs", "errors", "prompt tok", "prefill s", "ttft s", "total s", "resp chars"]:
+        table.add_column(column, justify="right")
+    for s in summary[: args.top]:
+        table.add_row(
+            str(s["id"]), str(s["runs"]), str(s["errors"]),
+            _fmt(s["prompt_tokens"], "{:.0f}"), _fmt(s["prefill_s"]), _fmt(s["ttft_s"]),
+            _fmt(s["total_s"]), _fmt(s["response_chars"], "{:.0f}"),
+        )
+    console.print(table)
+
+    baseline = next((s for s in summary if s["id"] == "baseline"), None)
+    if baseline and summary and summary[0]["id"] != "baseline" and baseline["ttft_s"] and summary[0]["ttft_s"]:
+        console.print(
+            f"[dim]Best variant {summary[0]['id']} vs baseline: "
+            f"TTFT {summary[0]['ttft_s']:.3f}s vs {baseline['ttft_s']:.3f}s[/dim]"
+        )
@@ -0,0 +1,251 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Instrumentation hooks and an on-demand sampling profiler.
+#
+#   @profiler.profiled("name")     time every call of a function
+#   with profiler.span("name"):    time a block (e.g. one stream chunk)
+#   with profiler.idle():          mark the calling thread as waiting for
+#                                  the user, so its samples are left out
+#
+# While disabled, a hook costs one attribute check. While enabled, spans
+# record count/total/max wall time, and a daemon thread samples every
+# thread's Python stack each interval_ms (wall clock, so time blocked on
+# sockets shows up as network frames). stop() writes the samples as
+# collapsed stacks (flamegraph.pl, speedscope) or speedscope JSON.
+
+NETWORK_MODULES = ("socket.py", "ssl.py", "selectors.py", "http/client.py")
+NETWORK_PACKAGES = ("urllib3", "httpx", "httpcore", "requests", "openai")
+RENDERER_MODULES = ("renderer.py",)
+RENDERER_PACKAGES = ("rich",)
+# Leaf frames of parked background threads (idle pool workers, queue consumers)
+PARKED_LEAVES = {("thread.py", "_worker"), ("threading.py", "wait"), ("queue.py", "get")}
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("profiler", "name", "started")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record_span(self.name, time.perf_counter() - self.started)
+        return False
+
+class _Idle:
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler._idle_threads.add(threading.get_ident())
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._idle_threads.discard(threading.get_ident())
+        return False
+
+def _frame_category(filename):
+    """"network" or "renderer" for frames in those layers, else None."""
+    path = filename.replace("\\", "/")
+    parts = path.split("/")
+    if parts[-1] in RENDERER_MODULES or any(p in RENDERER_PACKAGES for p in parts[:-1]):
+        return "renderer"
+    if any(p in NETWORK_PACKAGES for p in parts[:-1]) or path.endswith(NETWORK_MODULES):
+        return "network"
+    return None
+
+class Profiler:
+    """Span timings plus a wall-clock stack sampler, both off until start()."""
+
+    def __init__(self, interval_ms=5.0):
+        self.enabled = False
+        self.interval = interval_ms / 1000.0
+        self._lock = threading.Lock()
+        self._idle_threads = set()
+        self._labels = {}
+        self._reset()
+
+    def _reset(self):
+        # span name -> [calls, total_s, max_s]
+        self.spans = {}
+        # (thread name, frame label, ...) root first -> sample count
+        self.stacks = {}
+        # "network" | "renderer" | "client" -> samples, for the main thread only
+        self.categories = {}
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+
+    # -- hooks ---------------------------------------------------------------
+
+    def profiled(self, name=None):
+        """Decorator timing every call of the function as span `name`."""
+        def decorate(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Span(self, span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def span(self, name):
+        """Context manager timing a block; a shared no-op while disabled."""
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def idle(self):
+        return _Idle(self)
+
+    def _record_span(self, name, elapsed):
+        with self._lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                entry = self.spans[name] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+
+    # -- sampling ------------------------------------------------------------
+
+    def start(self):
+        if self.enabled:
+            return
+        with self._lock:
+            self._reset()
+            self.started_at = time.perf_counter()
+        self.enabled = True
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        """Stop sampling; the collected data stays until the next start()."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._sampler.join()
+        self.stopped_at = time.perf_counter()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        main = threading.main_thread().ident
+        while self.enabled:
+            time.sleep(self.interval)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident == own or ident in self._idle_threads:
+                        continue
+                    leaf = frame.f_code
+                    if ident != main and (os.path.basename(leaf.co_filename), leaf.co_name) in PARKED_LEAVES:
+                        continue
+                    stack = []
+                    category = None
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(self._label(code))
+                        category = category or _frame_category(code.co_filename)
+                        frame = frame.f_back
+                    stack.append(names.get(ident, f"thread-{ident}"))
+                    key = tuple(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                    if ident == main:
+                        category = category or "client"
+                        self.categories[category] = self.categories.get(category, 0) + 1
+
+    # -- output --------------------------------------------------------------
+
+    def write_collapsed(self, path):
+        """'thread;outer;...;inner count' lines, one per distinct stack."""
+        with self._lock:
+            lines = [";".join(frame.replace(";", ",") for frame in stack) + f" {count}" for stack, count in self.stacks.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(sorted(lines)) + "\n")
+
+    def write_speedscope(self, path, name="AI Sidekick"):
+        """speedscope's sampled-profile JSON, one profile per thread."""
+        frames = {}
+        profiles = {}
+        with self._lock:
+            for stack, count in self.stacks.items():
+                indexes = [frames.setdefault(label, len(frames)) for label in stack[1:]]
+                profile = profiles.setdefault(stack[0], {"samples": [], "weights": []})
+                profile["samples"].append(indexes)
+                profile["weights"].append(count * self.interval)
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "shared": {"frames": [{"name": label} for label in frames]},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(profile["weights"]),
+                    "samples": profile["samples"],
+                    "weights": profile["weights"],
+                }
+                for thread, profile in profiles.items()
+            ],
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(document, f)
+
+    def write(self, directory, basename, fmt="collapsed"):
+        """Write the samples in `fmt` ("collapsed" or "speedscope"); returns the path."""
+        os.makedirs(directory, exist_ok=True)
+        if fmt == "speedscope":
+            path = os.path.join(directory, f"{basename}.speedscope.json")
+            self.write_speedscope(path)
+        else:
+            path = os.path.join(directory, f"{basename}.collapsed")
+            self.write_collapsed(path)
+        return path
+
+    def report(self):
+        """Lines summarising span timings and where the main thread's samples went."""
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda item: item[1][1], reverse=True)
+            categories = dict(self.categories)
+        lines = []
+        main_samples = sum(categories.values())
+        if main_samples:
+            lines.append("main thread: " + " · ".join(
+                f"{category} {100.0 * count / main_samples:.0f}%"
+                for category, count in sorted(categories.items(), key=lambda item: item[1], reverse=True)
+            ) + f" ({main_samples} samples, idle excluded)")
+        for name, (calls, total, longest) in spans:
+            lines.append(f"{name}: {calls} calls · {total:.3f}s total · {1000.0 * total / calls:.2f}ms avg · {1000.0 * longest:.1f}ms max")
+        return lines
+
+# Shared by every module; main.py starts it from SIDEKICK_PROFILE or /profile
+profiler = Profiler()
@@ -0,0 +1,69 @@
+import math
+import re
+from datetime import datetime
+
+# Scoring for retrieved chat summaries. Each candidate gets
+#
+#   relevance = w_tags * tag_overlap + w_text * text_similarity
+#   score     = relevance * ((1 - w_recency) + w_recency * decay)
+#
+# where decay = 0.5 ** (age_days / half_life_days). Old chats are damped,
+# never cut off, so a strong match from months ago still beats recent noise.
+
+_WORD_RE = re.compile(r"[a-z0-9]{3,}")
+
+DEFAULT_SCORE_WEIGHTS = {"tags": 0.7, "text": 0.3, "recency": 0.5}
+
+def text_words(text):
+    """The set of lowercase words (3+ alphanumerics) used for text similarity."""
+    return set(_WORD_RE.findall(text.lower())) if text else set()
+
+def text_similarity(query_words, text):
+    """Jaccard similarity between a pre-tokenised query and `text` (0..1)."""
+    if not query_words:
+        return 0.0
+    words = text_words(text)
+    if not words:
+        return 0.0
+    return len(query_words & words) / len(query_words | words)
+
+def chat_timestamp(date_str, time_str=None):
+    """Parse the chat_history date/time columns, or None if unparseable."""
+    try:
+        if time_str:
+            return datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S")
+        return datetime.strptime(str(date_str), "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+def recency_decay(timestamp, now, half_life_days):
+    """Exponential decay in (0, 1]; undated rows count as one half-life old."""
+    if timestamp is None:
+        return 0.5
+    age_days = max(0.0, (now - timestamp).total_seconds() / 86400.0)
+    return math.exp(-math.log(2) * age_days / max(half_life_days, 1e-6))
+
+def score_summaries(rows, num_query_tags, conf, query_text=None, now=None):
+    """Score candidate rows in place and return them best first.
+
+    Each row needs 'summary', 'date' and optionally 'time' and 'matches'
+    (the number of query tags it shares). Adds a 'score' key.
+    """
+    now = now or datetime.now()
+    weights = {**DEFAULT_SCORE_WEIGHTS, **conf['chat_history_score_weights']}
+    half_life_days = float(conf['chat_history_recency_half_life_days'])
+    use_text = bool(query_text) and conf['chat_history_text_similarity']
+    query_words = text_words(query_text) if use_text else set()
+
+    relevance_weight = weights["tags"] + (weights["text"] if use_text else 0.0)
+    for row in rows:
+        tag_score = min(1.0, (row.get('matches') or 0) / max(num_query_tags, 1))
+        relevance = weights["tags"] * tag_score
+        if use_text:
+            relevance += weights["text"] * text_similarity(query_words, row.get('summary') or "")
+        relevance /= relevance_weight or 1.0
+        decay = recency_decay(chat_timestamp(row.get('date'), row.get('time')), now, half_life_days)
+        row['score'] = relevance * ((1.0 - weights["recency"]) + weights["recency"] * decay)
+
+    rows.sort(key=lambda row: -row['score'])
+    return rows
@@ -0,0 +1,113 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from rich.console import Console
+from rich.table import Table
+
+from chat_history_db import indexed_tag_query, migrate, post_transaction, result_rows
+from chat_tags import canonicalize_tags
+from config import default_config
+from mock_servers import MOCK_HISTORY_SCHEMA, start_mock_history_server
+from ranking import score_summaries
+from summary_index import SummaryIndex
+
+# Recall latency of the indexed SQL lookup on a (mock) ws4sqlite server
+# plus client-side scoring, against the local summary index, for growing
+# chat_history sizes. main.py's SQL path scores the max_chat_history_results
+# rows with the most tag matches; the local index scores every row and
+# should agree with the SQL lookup run without that LIMIT.
+
+WORDS = [f"w{i}" for i in range(4000)]
+
+def _zipf_words(rng, count):
+    # A few common words, a long tail of rare ones
+    return [WORDS[min(len(WORDS) - 1, int(rng.paretovariate(1.1)) - 1)] for _ in range(count)]
+
+def populate(db_path, rows, seed=0):
+    """Write `rows` synthetic chats straight into the mock server's SQLite file."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute(MOCK_HISTORY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO chat_history (summary, tags, date, time) VALUES (?, ?, ?, ?)",
+        (
+            (
+                " ".join(_zipf_words(rng, 40)),
+                " ".join(canonicalize_tags(_zipf_words(rng, 8))),
+                f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d}",
+                "12:00:00",
+            )
+            for _ in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+def sql_recall(conf, tags, query_text, top_k, limit):
+    keys = [f"t{i}" for i in range(len(tags))]
+    values = {"limit": int(limit), **dict(zip(keys, tags))}
+    rows = result_rows(post_transaction(conf, [{"query": indexed_tag_query(keys), "values": values}]))
+    score_summaries(rows, len(tags), conf, query_text=query_text)
+    return [round(row['score'], 6) for row in rows[:top_k]]
+
+def _time(func, repeats):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - t0)
+    return result, statistics.median(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare SQL recall on a mock ws4sqlite server with the local summary index")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated chat_history sizes")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    console = Console()
+    table = Table(title="Recall latency, median over queries (ms)")
+    for column in ["rows", "initial sync", "index size", "sql LIMIT 100", "sql all rows", "local index", "same top-k as all rows"]:
+        table.add_column(column, justify="right")
+
+    conf = default_config()
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "history.db")
+            populate(db_path, size, args.seed)
+            server, conf['chat_history_server_url'] = start_mock_history_server(db_path=db_path)
+            migrate(conf, console=Console(quiet=True))
+
+            index = SummaryIndex(os.path.join(tmp, "index"))
+            query = lambda sql, values: result_rows(post_transaction(conf, [{"query": sql, "values": values}], timeout=60))
+            t0 = time.perf_counter()
+            index.sync(query)
+            sync_s = time.perf_counter() - t0
+            index_bytes = sum(os.path.getsize(os.path.join(index.directory, name)) for name in os.listdir(index.directory))
+
+            rng = random.Random(args.seed + 1)
+            sql_times, full_times, local_times, same = [], [], [], 0
+            for _ in range(args.queries):
+                tags = canonicalize_tags(_zipf_words(rng, 6))
+                text = " ".join(_zipf_words(rng, 12))
+                _, sql_s = _time(lambda: sql_recall(conf, tags, text, args.top_k, 100), 1)
+                full_scores, full_s = _time(lambda: sql_recall(conf, tags, text, args.top_k, size), 1)
+                local, local_s = _time(lambda: index.search(tags, conf, top_k=args.top_k, query_text=text), 3)
+                sql_times.append(sql_s)
+                full_times.append(full_s)
+                local_times.append(local_s)
+                same += full_scores == [round(row['score'], 6) for row in local]
+            server.shutdown()
+            table.add_row(
+                str(size), f"{sync_s:.2f}s", f"{index_bytes / 1e6:.1f}MB",
+                f"{1000 * statistics.median(sql_times):.2f}", f"{1000 * statistics.median(full_times):.2f}",
+                f"{1000 * statistics.median(local_times):.3f}",
+                f"{same}/{args.queries}",
+            )
+    console.print(table)
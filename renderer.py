@@ -0,0 +1,98 @@
+import threading
+import time
+from contextlib import contextmanager
+from rich.console import Console
+
+class OutputRenderer:
+    """Single owner of the terminal for a session.
+
+    Holds the one Console everything prints through, plus a status line that
+    shows the current pipeline stage (tagging, retrieval, prefill, ...) with
+    its elapsed time. The status line is redrawn only on stage changes and on
+    tick() calls from loops that are already running, so no extra thread,
+    timer or lock is needed. Only the main thread draws, so loops that also
+    run in the background (autosave on exit, fan-out workers) may tick
+    freely.
+    """
+
+    TICK_INTERVAL = 0.1
+
+    def __init__(self, console=None):
+        self.console = console or Console()
+        # Stack of [name, start_time, visible] for nested stages
+        self._stages = []
+        self._status_width = 0
+        self._last_draw = 0.0
+        # Completed stage durations for the current turn, in completion order
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name, visible=True):
+        """Context manager marking a pipeline stage."""
+        self.begin_stage(name, visible)
+        try:
+            yield
+        finally:
+            self.end_stage(name)
+
+    def begin_stage(self, name, visible=True):
+        self._stages.append([name, time.perf_counter(), visible])
+        self._draw()
+
+    def end_stage(self, name):
+        """Close `name` (and anything nested inside it); no-op if not open."""
+        self._close_stage(name, record=True)
+
+    def discard_stage(self, name):
+        """Close `name` like end_stage, but leave it out of this turn's timings."""
+        self._close_stage(name, record=False)
+
+    def _close_stage(self, name, record):
+        names = [s[0] for s in self._stages]
+        if name not in names:
+            return
+        now = time.perf_counter()
+        while self._stages:
+            stage_name, start, _ = self._stages.pop()
+            if record:
+                self.timings.append((stage_name, now - start))
+            if stage_name == name:
+                break
+        self.clear_status()
+        self._draw()
+
+    def tick(self):
+        """Refresh the elapsed time; cheap enough to call once per streamed chunk."""
+        if threading.current_thread() is not threading.main_thread():
+            return
+        now = time.perf_counter()
+        if now - self._last_draw >= self.TICK_INTERVAL:
+            self._draw(now)
+
+    def _draw(self, now=None):
+        if not self._stages or not self._stages[-1][2]:
+            return
+        now = now or time.perf_counter()
+        _, start, _ = self._stages[-1]
+        path = " › ".join(s[0] for s in self._stages)
+        line = f"⋯ {path} {now - start:.1f}s"
+        self._status_width = max(self._status_width, len(line))
+        self.console.print(f"[dim]{line}[/dim]", end="\r", highlight=False, markup=True)
+        self._last_draw = now
+
+    def clear_status(self):
+        if self._status_width:
+            self.console.print(" " * self._status_width, end="\r", highlight=False)
+            self._status_width = 0
+
+    def pop_timings(self):
+        """Return and reset the completed stage durations for this turn."""
+        timings, self.timings = self.timings, []
+        return timings
+
+    def print_stage_summary(self):
+        """Print a one-line breakdown of where this turn's time went."""
+        timings = self.pop_timings()
+        if timings:
+            summary = " · ".join(f"{name} {elapsed:.2f}s" for name, elapsed in timings)
+            self.console.print(f"[dim]{summary}[/dim]", highlight=False)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Opt-in cache of final answers keyed by
+#
+#   bucket = hash(system prompt) + hash(last N history messages)
+#   key    = bucket + hash(normalised prompt)
+#
+# Exact hits are a dict lookup. Approximate hits (opt-in, similarity_threshold
+# below 1.0) compare MinHash signatures of the prompt's character shingles,
+# but only within the same bucket, so a cached answer is never reused under
+# a different personality or context. Shingles alone rate "list all hidden
+# files" and "delete all hidden files" ~0.94 similar, so an approximate hit
+# must also have exactly the same content words (everything but stopwords):
+# it may differ in phrasing, never in a verb or noun.
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT_RE = re.compile(r"^[\W_]+|[\W_]+$")
+_CONTENT_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOPWORDS = frozenset(
+    "a an the and or but if then so of to in on at by for with from into about as is are was were be been "
+    "being am do does did can could would should will shall may might must i me my we our you your it its "
+    "this that these those there here what which who whom how please just also very".split()
+)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_SHINGLE_SIZE = 4
+
+def normalize_prompt(prompt):
+    """Lowercase, collapse whitespace and strip leading/trailing punctuation."""
+    text = _WHITESPACE_RE.sub(" ", (prompt or "").lower()).strip()
+    return _EDGE_PUNCT_RE.sub("", text)
+
+def content_words(normalized):
+    """Sorted non-stopword words of a normalised prompt; approximate hits must match these."""
+    return sorted(w for w in _CONTENT_WORD_RE.findall(normalized) if w not in STOPWORDS)
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+def _make_permutations(num_perm):
+    # Fixed seed: persisted signatures must stay comparable across runs
+    rng = random.Random(0x5EED)
+    return [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+class ResponseCache:
+    """Size-bounded exact + MinHash response cache persisted to a JSON file."""
+
+    def __init__(self, path, max_entries=500, policy="lru", similarity_threshold=1.0, history_window=2, num_perm=64):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.policy = policy if policy in ("lru", "lfu") else "lru"
+        self.similarity_threshold = float(similarity_threshold)
+        self.history_window = max(0, int(history_window))
+        self._perms = _make_permutations(num_perm)
+        self._lock = threading.Lock()
+        # key -> entry; order is recency of use (oldest first)
+        self.entries = OrderedDict()
+        self._buckets = {}
+        self._load()
+
+    def _bucket(self, system_prompt, history):
+        window = history[-self.history_window:] if (history and self.history_window) else []
+        history_text = "\n".join(f"{m.get('role', '')}:{normalize_prompt(m.get('content', ''))}" for m in window)
+        return _digest(system_prompt or "") + _digest(history_text)
+
+    def signature(self, normalized):
+        """MinHash signature over character shingles of a normalised prompt."""
+        text = f" {normalized} "
+        shingles = {text[i:i + _SHINGLE_SIZE] for i in range(max(1, len(text) - _SHINGLE_SIZE + 1))}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles]
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """Estimated Jaccard similarity of two signatures."""
+        if not sig_a or len(sig_a) != len(sig_b):
+            return 0.0
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+    def lookup(self, prompt, system_prompt, history):
+        """Return (entry, similarity) for an exact or approximate hit, else None."""
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return None
+        bucket = self._bucket(system_prompt, history)
+        key = bucket + _digest(normalized)
+        with self._lock:
+            entry = self.entries.get(key)
+            similarity = 1.0
+            if entry is None and self.similarity_threshold < 1.0:
+                signature = self.signature(normalized)
+                words = content_words(normalized)
+                best_key, best_sim = None, 0.0
+                for candidate_key in self._buckets.get(bucket, ()):
+                    candidate = self.entries[candidate_key]
+                    if content_words(candidate["prompt"]) != words:
+                        continue
+                    sim = self.similarity(signature, candidate["signature"])
+                    if sim > best_sim:
+                        best_key, best_sim = candidate_key, sim
+                if best_key is not None and best_sim >= self.similarity_threshold:
+                    key, entry, similarity = best_key, self.entries[best_key], best_sim
+            if entry is None:
+                return None
+            entry["hits"] += 1
+            entry["last_used"] = time.time()
+            self.entries.move_to_end(key)
+            return entry, similarity
+
+    def store(self, prompt, system_prompt, history, response):
+        """Cache a response dict (thinking/answer/full_response) for this prompt."""
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return
+        bucket = self._bucket(system_prompt, history)
+        key = bucket + _digest(normalized)
+        entry = {
+            "bucket": bucket,
+            "prompt": normalized,
+            "signature": self.signature(normalized),
+            "response": {k: response.get(k, "") for k in ("thinking", "answer", "full_response")},
+            "hits": 0,
+            "created": time.time(),
+            "last_used": time.time(),
+        }
+        with self._lock:
+            self._remove(key)
+            self.entries[key] = entry
+            self._buckets.setdefault(bucket, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._evict()
+        self.save()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self._buckets.get(entry["bucket"])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[entry["bucket"]]
+
+    def _evict(self):
+        if self.policy == "lfu":
+            # Least hits; recency order breaks ties (oldest first)
+            victim = min(self.entries, key=lambda k: self.entries[k]["hits"])
+        else:
+            victim = next(iter(self.entries))
+        self._remove(victim)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, entry in sorted(data.get("entries", {}).items(), key=lambda kv: kv[1].get("last_used", 0)):
+            if len(entry.get("signature") or []) != len(self._perms):
+                continue
+            self.entries[key] = entry
+            self._buckets.setdefault(entry["bucket"], set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._evict()
+
+    def save(self):
+        """Persist the cache atomically."""
+        with self._lock:
+            payload = json.dumps({"entries": self.entries}, separators=(",", ":"))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+def load_response_cache(conf):
+    """Build the cache from conf, or return None when it is disabled."""
+    if not conf['response_cache_enabled']:
+        return None
+    return ResponseCache(
+        conf['response_cache_path'],
+        max_entries=conf['response_cache_max_entries'],
+        policy=conf['response_cache_policy'],
+        similarity_threshold=conf['response_cache_similarity'],
+        history_window=conf['response_cache_history_window'],
+    )
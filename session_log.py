@@ -0,0 +1,155 @@
+import json
+import mmap
+import os
+import struct
+from datetime import datetime
+
+# Append-only session log. After an 8-byte magic, every record is
+#
+#   header  <III  payload length, message tokens, cumulative session tokens
+#   payload       UTF-8 JSON of the chat message
+#   trailer <I    payload length again
+#
+# The trailer lets readers walk backwards from the end of the file, so
+# resuming only touches the records that fit in the sliding window, and the
+# stored token counts mean nothing has to be re-tokenised.
+
+MAGIC = b"SKLOG01\n"
+_HEADER = struct.Struct("<III")
+_TRAILER = struct.Struct("<I")
+
+def new_session_id():
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+def session_path(sessions_dir, session_id):
+    return os.path.join(sessions_dir, f"{session_id}.log")
+
+def latest_session_id(sessions_dir):
+    """Return the most recently modified session id, or None."""
+    try:
+        logs = [f for f in os.listdir(sessions_dir) if f.endswith(".log")]
+    except FileNotFoundError:
+        return None
+    if not logs:
+        return None
+    latest = max(logs, key=lambda f: os.path.getmtime(os.path.join(sessions_dir, f)))
+    return latest[:-len(".log")]
+
+class SessionLog:
+    """Length-prefixed, append-only log of chat messages with token counts."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+        else:
+            self._repair()
+        self.total_tokens = self._last_total()
+        self._file = open(path, 'ab')
+
+    def _records_from_start(self, data):
+        """Yield (offset, end) of each complete record scanning forwards."""
+        offset = len(MAGIC)
+        while offset + _HEADER.size <= len(data):
+            length, _, _ = _HEADER.unpack_from(data, offset)
+            end = offset + _HEADER.size + length + _TRAILER.size
+            if end > len(data) or _TRAILER.unpack_from(data, end - _TRAILER.size)[0] != length:
+                return
+            yield offset, end
+            offset = end
+
+    def _repair(self):
+        """Truncate a torn final record left by a crash mid-append."""
+        with open(self.path, 'rb') as f:
+            data = f.read(len(MAGIC))
+        if data != MAGIC:
+            raise ValueError(f"{self.path} is not a session log")
+        if self._tail_is_valid():
+            return
+        # Rare path: forward scan to the last complete record
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        valid_end = len(MAGIC)
+        for _, end in self._records_from_start(data):
+            valid_end = end
+        with open(self.path, 'r+b') as f:
+            f.truncate(valid_end)
+
+    def _tail_is_valid(self):
+        size = os.path.getsize(self.path)
+        if size == len(MAGIC):
+            return True
+        if size < len(MAGIC) + _HEADER.size + _TRAILER.size:
+            return False
+        with open(self.path, 'rb') as f:
+            f.seek(size - _TRAILER.size)
+            length = _TRAILER.unpack(f.read(_TRAILER.size))[0]
+            start = size - _TRAILER.size - length - _HEADER.size
+            if start < len(MAGIC):
+                return False
+            f.seek(start)
+            return _HEADER.unpack(f.read(_HEADER.size))[0] == length
+
+    def _last_total(self):
+        for _, _, total in self._iter_backwards(limit=1):
+            return total
+        return 0
+
+    def append(self, message, tokens):
+        """Append one message with its token count."""
+        payload = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.total_tokens += tokens
+        self._file.write(
+            _HEADER.pack(len(payload), tokens, self.total_tokens) + payload + _TRAILER.pack(len(payload))
+        )
+        self._file.flush()
+
+    def _iter_backwards(self, limit=None):
+        """Yield (message, tokens, cumulative_tokens) from newest to oldest via mmap."""
+        if os.path.getsize(self.path) <= len(MAGIC):
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = len(data)
+            count = 0
+            while end > len(MAGIC) and (limit is None or count < limit):
+                length = _TRAILER.unpack_from(data, end - _TRAILER.size)[0]
+                start = end - _TRAILER.size - length - _HEADER.size
+                _, tokens, total = _HEADER.unpack_from(data, start)
+                payload = data[start + _HEADER.size:start + _HEADER.size + length]
+                yield json.loads(payload.decode("utf-8")), tokens, total
+                end = start
+                count += 1
+
+    def messages(self):
+        """All logged messages in chronological order."""
+        messages = [message for message, _, _ in self._iter_backwards()]
+        messages.reverse()
+        return messages
+
+    def read_window(self, max_tokens):
+        """Rebuild the sliding window from the tail of the log.
+
+        Returns (messages, token_counts) in chronological order, holding as
+        many recent messages as fit in `max_tokens` and starting on a user
+        message so that user/assistant pairs stay intact.
+        """
+        messages = []
+        counts = []
+        used = 0
+        for message, tokens, _ in self._iter_backwards():
+            if used + tokens > max_tokens:
+                break
+            messages.append(message)
+            counts.append(tokens)
+            used += tokens
+        messages.reverse()
+        counts.reverse()
+        while messages and messages[0].get("role") != "user":
+            messages.pop(0)
+            counts.pop(0)
+        return messages, counts
+
+    def close(self):
+        self._file.close()
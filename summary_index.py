@@ -0,0 +1,449 @@
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from chat_tags import canonicalize_tags
+from ranking import DEFAULT_SCORE_WEIGHTS, chat_timestamp, score_summaries, text_words
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): only one process may use an index directory
+    fcntl = None
+
+# Local recall index over this user's chat_history, so scoring does not
+# wait on the ws4sqlite server. Each summary becomes a hashed bag-of-tags
+# and bag-of-words vector:
+#
+#   columns [0, tag_dim)                  crc32(canonical tag) % tag_dim
+#   columns [tag_dim, tag_dim + word_dim) crc32(summary word) % word_dim
+#
+# stored as 0/1 uint8 in a column-major memory-mapped vectors.npy, with
+# per-row id / timestamp / word count / liveness in rows.npy and the
+# summary text in summaries.jsonl. A query only has a few non-zero
+# columns, so scoring gathers those columns (contiguous on disk) and does
+# one small matrix-vector product per part:
+#
+#   tag_overlap = min(1, V[:, tag cols] @ tag counts / n_tags)
+#   text        = jaccard(V[:, word cols] @ 1, row words, query words)
+#
+# combined with recency like ranking.score_summaries. argpartition picks
+# the best candidates, which are then re-scored exactly with
+# score_summaries from their stored tags and text (widening the set while
+# an unvisited hashed score could still beat the top-k), so hash
+# collisions do not change the result. Rows must share at least one tag, as with the
+# SQL lookups. The index syncs by id (rows above the last seen id). For
+# the ids it already has, each range of RANGE_SPAN ids is compared by
+# COUNT, MAX(id) and the summed summary and tag lengths against the
+# server; a range that differs (rows deleted by compaction or retention,
+# an id reused, a summary rewritten) is masked and fetched again.
+#
+# Several processes may share an index directory: every read and write
+# holds an flock on index.lock, and a process reopens the files when
+# meta.json was replaced by another one since it last looked.
+
+FORMAT_VERSION = 2
+ROW_DTYPE = [
+    ("id", "<i8"),
+    ("timestamp", "<f8"),   # epoch seconds, NaN when undated
+    ("words", "<i4"),       # distinct word columns
+    ("alive", "?"),         # still on the server
+    ("offset", "<i8"),      # summary record in summaries.jsonl
+    ("length", "<i4"),
+    ("chars", "<i8"),       # length(summary) + length(tags) on the server
+]
+MIN_CAPACITY = 1024
+# Ids per range compared against the server on each sync
+RANGE_SPAN = 256
+# Hashed candidates re-scored exactly per result asked for, to start with
+RERANK_FACTOR = 4
+MIN_RERANK = 32
+
+def _bucket(token, dim):
+    return zlib.crc32(token.encode("utf-8")) % dim
+
+def _owner_sql(owner_columns):
+    return "".join(f" AND {column} = :{column}" for column in owner_columns)
+
+def sync_query(owner_columns=()):
+    return (
+        "SELECT id, summary, tags, date, time FROM chat_history "
+        f"WHERE id > :after{_owner_sql(owner_columns)} ORDER BY id LIMIT :limit"
+    )
+
+def checksum_query(owner_columns=()):
+    return (
+        "SELECT id / :span AS part, COUNT(*) AS n, MAX(id) AS last_id, "
+        "SUM(length(COALESCE(summary, '')) + length(COALESCE(tags, ''))) AS chars FROM chat_history "
+        f"WHERE id <= :max_id{_owner_sql(owner_columns)} GROUP BY part"
+    )
+
+def range_query(owner_columns=()):
+    return (
+        "SELECT id, summary, tags, date, time FROM chat_history "
+        f"WHERE id >= :low AND id < :high{_owner_sql(owner_columns)} ORDER BY id"
+    )
+
+class SummaryIndex:
+    """Memory-mapped hashed tag/word vectors for one owner's summaries (needs numpy)."""
+
+    def __init__(self, directory, tag_dim=1024, word_dim=1024, synonyms=None):
+        if np is None:
+            raise ImportError("summary_index_enabled needs the numpy package")
+        self.directory = directory
+        self.tag_dim = int(tag_dim)
+        self.word_dim = int(word_dim)
+        self.synonyms = synonyms
+        self._lock = threading.Lock()
+        self._next_sync = 0.0
+        self._columns = None
+        self.meta = None
+        self._stamp = None
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            pass
+
+    # -- storage -------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _meta_stamp(self):
+        try:
+            stat = os.stat(self._path("meta.json"))
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread and process locks, reopening files another process replaced."""
+        with self._lock, open(self._path("index.lock"), 'a') as lock_file:
+            if fcntl is not None:
+                # Released when lock_file closes
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self.meta is None or self._meta_stamp() != self._stamp:
+                self._open()
+            yield
+
+    def _open(self):
+        try:
+            with open(self._path("meta.json"), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta.get("version"), meta.get("tag_dim"), meta.get("word_dim")) != (FORMAT_VERSION, self.tag_dim, self.word_dim):
+                raise ValueError("index format or dimensions changed")
+            vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+            rows = np.load(self._path("rows.npy"), mmap_mode="r+")
+            if vectors.shape != (meta["capacity"], self.tag_dim + self.word_dim) or rows.shape != (meta["capacity"],):
+                raise ValueError("index files do not match meta.json")
+            self.meta, self._vectors, self._rows = meta, vectors, rows
+            self._columns = None
+            self._stamp = self._meta_stamp()
+            # Drop summary records written after the last completed sync
+            with open(self._path("summaries.jsonl"), 'ab') as f:
+                f.truncate(meta["summaries_size"])
+        except (OSError, ValueError, KeyError):
+            self._reset()
+
+    def _reset(self, owner_columns=(), owner=None):
+        self.meta = {
+            "version": FORMAT_VERSION,
+            "tag_dim": self.tag_dim,
+            "word_dim": self.word_dim,
+            "owner_columns": list(owner_columns),
+            "owner": owner or {},
+            "count": 0,
+            "capacity": 0,
+            "max_id": 0,
+            "summaries_size": 0,
+        }
+        self._vectors = None
+        self._rows = None
+        open(self._path("summaries.jsonl"), 'wb').close()
+        self._allocate(MIN_CAPACITY, keep=None)
+
+    def _allocate(self, capacity, keep):
+        """New vectors.npy/rows.npy of `capacity` rows holding the rows at `keep`."""
+        dim = self.tag_dim + self.word_dim
+        vectors = np.lib.format.open_memmap(
+            self._path("vectors.tmp.npy"), mode="w+", dtype=np.uint8, shape=(capacity, dim), fortran_order=True
+        )
+        rows = np.lib.format.open_memmap(self._path("rows.tmp.npy"), mode="w+", dtype=ROW_DTYPE, shape=(capacity,))
+        count = 0
+        size = 0
+        if keep is not None:
+            count = len(keep)
+            vectors[:count] = self._vectors[keep]
+            rows[:count] = self._rows[keep]
+            # Rewrite summaries.jsonl without the dead rows
+            with open(self._path("summaries.jsonl"), 'rb') as src, open(self._path("summaries.tmp.jsonl"), 'wb') as dst:
+                for slot in range(count):
+                    src.seek(int(rows["offset"][slot]))
+                    record = src.read(int(rows["length"][slot]))
+                    rows["offset"][slot] = size
+                    dst.write(record)
+                    size += len(record)
+            os.replace(self._path("summaries.tmp.jsonl"), self._path("summaries.jsonl"))
+        vectors.flush()
+        rows.flush()
+        del vectors, rows
+        self._vectors = self._rows = None
+        os.replace(self._path("vectors.tmp.npy"), self._path("vectors.npy"))
+        os.replace(self._path("rows.tmp.npy"), self._path("rows.npy"))
+        self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+        self._rows = np.load(self._path("rows.npy"), mmap_mode="r+")
+        self._columns = None
+        self.meta.update(capacity=capacity, count=count, summaries_size=size)
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp = self._path("meta.tmp.json")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._path("meta.json"))
+        self._stamp = self._meta_stamp()
+
+    def _row_columns(self):
+        """Contiguous in-memory copies of the rows.npy fields, kept until rows change."""
+        if self._columns is None:
+            rows = self._rows[:self.meta["count"]].view(np.ndarray)
+            self._columns = {name: np.ascontiguousarray(rows[name]) for name, _ in ROW_DTYPE}
+            self._columns["decay"] = None
+        return self._columns
+
+    def _decay(self, rows, now_ts, half_life_days):
+        """Recency decay per row as in ranking.recency_decay, recomputed once a minute."""
+        key = (int(now_ts // 60), half_life_days)
+        cached = rows.get("decay")
+        if cached is None or cached[0] != key:
+            age_days = np.maximum(0.0, (now_ts - rows["timestamp"]) / 86400.0)
+            decay = np.where(np.isnan(rows["timestamp"]), 0.5, np.exp(-math.log(2) * age_days / half_life_days))
+            cached = rows["decay"] = (key, decay)
+        return cached[1]
+
+    def _checksums(self):
+        """{range: (rows, max id, chars)} over the live rows, as checksum_query reports them."""
+        rows = self._rows[:self.meta["count"]].view(np.ndarray)
+        rows = rows[rows["alive"]]
+        parts, inverse = np.unique(rows["id"] // RANGE_SPAN, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(parts))
+        chars = np.bincount(inverse, weights=rows["chars"], minlength=len(parts))
+        last_ids = np.zeros(len(parts), dtype=np.int64)
+        np.maximum.at(last_ids, inverse, rows["id"])
+        return {int(part): (int(n), int(last), int(c)) for part, n, last, c in zip(parts, counts, last_ids, chars)}
+
+    def __len__(self):
+        with self._locked():
+            count = self.meta["count"]
+            return int(self._rows["alive"][:count].sum()) if count else 0
+
+    # -- sync ----------------------------------------------------------------
+
+    def sync_due(self):
+        return time.monotonic() >= self._next_sync
+
+    def request_sync(self):
+        """Make the next sync_due() true, e.g. after storing a new summary."""
+        self._next_sync = 0.0
+
+    def sync(self, query, owner_columns=(), owner=None, batch_size=1000, interval_s=30.0, on_wait=None):
+        """Pull rows added, changed or removed on the server since the last sync.
+
+        `query(sql, values)` runs one SELECT against chat_history and
+        returns its rows; `on_wait()` is called after each one. Returns the
+        number of rows (re)fetched.
+        """
+        if on_wait is not None:
+            plain_query = query
+
+            def query(sql, values):
+                rows = plain_query(sql, values)
+                on_wait()
+                return rows
+
+        owner_values = {column: (owner or {})[column] for column in owner_columns}
+        with self._locked():
+            if self.meta["owner_columns"] != list(owner_columns) or self.meta["owner"] != owner_values:
+                # Different partition (or the store was just partitioned): start over
+                self._reset(owner_columns, owner_values)
+            added = 0
+            if self.meta["count"]:
+                max_id = self.meta["max_id"]
+                remote = {
+                    int(row["part"]): (int(row["n"]), int(row["last_id"]), int(row["chars"] or 0))
+                    for row in query(checksum_query(owner_columns), {"max_id": max_id, "span": RANGE_SPAN, **owner_values})
+                }
+                local = self._checksums()
+                for part in sorted(part for part in remote.keys() | local.keys() if remote.get(part) != local.get(part)):
+                    rows = self._rows[:self.meta["count"]]
+                    rows["alive"] &= rows["id"] // RANGE_SPAN != part
+                    self._rows.flush()
+                    self._columns = None
+                    if part in remote:
+                        # Above max_id is left to the forward sync below
+                        values = {"low": part * RANGE_SPAN, "high": min((part + 1) * RANGE_SPAN, max_id + 1), **owner_values}
+                        batch = query(range_query(owner_columns), values)
+                        if batch:
+                            self._append(batch)
+                            added += len(batch)
+            while True:
+                batch = query(sync_query(owner_columns), {"after": self.meta["max_id"], "limit": int(batch_size), **owner_values})
+                if batch:
+                    self._append(batch)
+                    added += len(batch)
+                if len(batch) < batch_size:
+                    break
+            self._write_meta()
+            self._next_sync = time.monotonic() + interval_s
+            return added
+
+    def _append(self, batch):
+        count = self.meta["count"]
+        needed = count + len(batch)
+        if needed > self.meta["capacity"]:
+            keep = np.flatnonzero(self._rows["alive"][:count])
+            self._allocate(max(MIN_CAPACITY, 2 * (len(keep) + len(batch))), keep)
+            count = self.meta["count"]
+            needed = count + len(batch)
+        # Build the batch densely, then write it in one strided copy
+        block = np.zeros((len(batch), self.tag_dim + self.word_dim), dtype=np.uint8)
+        new_rows = np.zeros(len(batch), dtype=ROW_DTYPE)
+        size = self.meta["summaries_size"]
+        with open(self._path("summaries.jsonl"), 'ab') as f:
+            for i, row in enumerate(batch):
+                tags = canonicalize_tags((row.get('tags') or "").split(), self.synonyms)
+                block[i, [_bucket(tag, self.tag_dim) for tag in tags]] = 1
+                words = {self.tag_dim + _bucket(word, self.word_dim) for word in text_words(row.get('summary') or "")}
+                block[i, list(words)] = 1
+                timestamp = chat_timestamp(row.get('date'), row.get('time'))
+                record = (json.dumps({
+                    "summary": row.get('summary') or "",
+                    "date": str(row.get('date')) if row.get('date') is not None else "",
+                    "time": row.get('time'),
+                    "tags": tags,
+                }) + "\n").encode("utf-8")
+                f.write(record)
+                new_rows[i] = (
+                    int(row['id']),
+                    timestamp.timestamp() if timestamp is not None else math.nan,
+                    len(words),
+                    True,
+                    size,
+                    len(record),
+                    len(row.get('summary') or "") + len(row.get('tags') or ""),
+                )
+                size += len(record)
+        self._vectors[count:needed] = block
+        self._rows[count:needed] = new_rows
+        self._vectors.flush()
+        self._rows.flush()
+        self._columns = None
+        self.meta.update(count=needed, max_id=max(self.meta["max_id"], int(new_rows["id"].max())), summaries_size=size)
+
+    # -- recall --------------------------------------------------------------
+
+    def search(self, tags, conf, top_k=5, min_score=0.0, query_text=None, now=None):
+        """Best `top_k` summaries for canonical `tags`, scored like ranking.score_summaries.
+
+        Returns [{"summary", "date", "score"}, ...] best first.
+        """
+        weights = {**DEFAULT_SCORE_WEIGHTS, **conf['chat_history_score_weights']}
+        half_life_days = max(float(conf['chat_history_recency_half_life_days']), 1e-6)
+        use_text = bool(query_text) and conf['chat_history_text_similarity']
+        query_words = {_bucket(word, self.word_dim) for word in text_words(query_text)} if use_text else set()
+        now_ts = (now or datetime.now()).timestamp()
+
+        tag_cols, tag_counts = np.unique([_bucket(tag, self.tag_dim) for tag in tags], return_counts=True)
+        if not len(tag_cols):
+            return []
+        word_cols = np.array(sorted(query_words), dtype=np.int64) + self.tag_dim
+        # Held until the summaries are read: another sync may rewrite summaries.jsonl
+        with self._locked():
+            count = self.meta["count"]
+            if not count:
+                return []
+            # As a plain ndarray the gather skips the memmap subclass overhead
+            block = self._vectors.view(np.ndarray)[:count, np.concatenate([tag_cols, word_cols])].astype(np.float32)
+            rows = self._row_columns()
+            decay = self._decay(rows, now_ts, half_life_days)
+
+            tag_score = np.minimum(block[:, :len(tag_cols)] @ (tag_counts / len(tags)).astype(np.float32), 1.0)
+            relevance = weights["tags"] * tag_score
+            relevance_weight = weights["tags"]
+            if use_text:
+                if len(word_cols):
+                    shared = block[:, len(tag_cols):] @ np.ones(len(word_cols), dtype=np.float32)
+                    union = np.maximum(rows["words"] + len(word_cols) - shared, 1.0)
+                    relevance += weights["text"] * shared / union
+                relevance_weight += weights["text"]
+            relevance /= relevance_weight or 1.0
+
+            scores = relevance * ((1.0 - weights["recency"]) + weights["recency"] * decay)
+            scores[~(rows["alive"] & (tag_score > 0))] = -1.0
+
+            # Collisions only add to the hashed scores, so they bound the exact
+            # ones: candidates are re-scored exactly, best hashed score first,
+            # until no unvisited row could still make the top_k
+            top_k = int(top_k)
+            if top_k <= 0:
+                return []
+            query_tags = set(tags)
+            exact = []
+            visited = 0
+            width = min(max(RERANK_FACTOR * top_k, MIN_RERANK), count)
+            with open(self._path("summaries.jsonl"), 'rb') as f:
+                while True:
+                    candidates = np.argpartition(-scores, width - 1)[:width]
+                    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+                    batch = []
+                    for slot in candidates[visited:]:
+                        if scores[slot] < 0:
+                            break
+                        f.seek(int(rows["offset"][slot]))
+                        record = json.loads(f.read(int(rows["length"][slot])))
+                        record["id"] = int(rows["id"][slot])
+                        record["matches"] = len(query_tags.intersection(record.pop("tags")))
+                        if record["matches"]:
+                            batch.append(record)
+                    visited = width
+                    score_summaries(batch, len(tags), conf, query_text=query_text, now=now)
+                    exact.extend(batch)
+                    # Ties go to the newest chat, like the SQL lookups
+                    exact.sort(key=lambda row: (-row["score"], -row["id"]))
+                    bound = scores[candidates[-1]]
+                    cutoff = exact[top_k - 1]["score"] if len(exact) >= top_k else min_score
+                    if width == count or bound < 0 or bound <= max(cutoff, min_score):
+                        break
+                    width = min(2 * width, count)
+            return [
+                {"summary": row["summary"], "date": row["date"], "score": row["score"]}
+                for row in exact[:top_k]
+                if row["score"] >= min_score
+            ]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_summary_index(conf, owner_key):
+    """The shared SummaryIndex for `owner_key` under conf['summary_index_dir']."""
+    directory = os.path.join(conf['summary_index_dir'], owner_key)
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = _indexes[directory] = SummaryIndex(
+                directory,
+                tag_dim=int(conf['summary_index_tag_dim']),
+                word_dim=int(conf['summary_index_word_dim']),
+                synonyms=conf['tag_synonyms'],
+            )
+        return index
@@ -1,3 +1,5 @@
+import argparse
+import json
 import random
 
 # 100 distinct personality dimensions for AI system prompts
@@ -462,83 +464,184 @@ dimensions = {
     ],
 }
 
-def generate_ai_personality(num_dimensions=20, traits_per_dimension=1, include_mbti_style=True):
+def select_personality(num_dimensions=20, traits_per_dimension=1, include_mbti_style=True, rng=None):
     """
-    Generate a comprehensive AI personality for system prompts.
-    
+    Pick the keys that make up one personality without rendering any text.
+
+    The returned selection is a compact, JSON-serialisable index into
+    mbti_cognitive_axes, cognitive_functions, personality_archetypes and
+    dimensions; render_personality() turns it back into the full profile.
+
     Args:
         num_dimensions: Number of personality dimensions to include (1-100)
         traits_per_dimension: Number of traits to include per dimension (1-4)
         include_mbti_style: Whether to include Myers-Briggs inspired cognitive style (default True)
+        rng: random.Random instance to draw from (defaults to the module-level generator)
     """
-    
-    personality = "=== AI PERSONALITY PROFILE ===\n\n"
-    
-    # Add Myers-Briggs inspired cognitive style if requested
+    rng = rng or random
+    selection = {}
+
     if include_mbti_style:
-        personality += "## COGNITIVE STYLE (Myers-Briggs Inspired)\n\n"
-        
         # Select one trait from each cognitive axis
-        for axis_name, options in mbti_cognitive_axes.items():
-            selected_option = random.choice(list(options.keys()))
+        selection["mbti"] = {
+            axis_name: rng.choice(list(options.keys()))
+            for axis_name, options in mbti_cognitive_axes.items()
+        }
+        selection["function"] = rng.choice(list(cognitive_functions.keys()))
+        selection["archetype"] = rng.choice(list(personality_archetypes.keys()))
+
+    # Randomly select dimensions, storing trait indices rather than trait text
+    all_dimensions = list(dimensions.keys())
+    selected_dimensions = rng.sample(all_dimensions, min(num_dimensions, len(all_dimensions)))
+    selection["dimensions"] = [
+        [dimension, rng.sample(range(len(dimensions[dimension])), min(traits_per_dimension, len(dimensions[dimension])))]
+        for dimension in selected_dimensions
+    ]
+    return selection
+
+def render_personality(selection):
+    """Render a selection from select_personality() into the full profile text."""
+    personality = "=== AI PERSONALITY PROFILE ===\n\n"
+
+    # Add Myers-Briggs inspired cognitive style if it was selected
+    if "mbti" in selection:
+        personality += "## COGNITIVE STYLE (Myers-Briggs Inspired)\n\n"
+
+        for axis_name, selected_option in selection["mbti"].items():
             personality += f"**{axis_name}: {selected_option}**\n"
-            personality += options[selected_option] + "\n\n"
-        
+            personality += mbti_cognitive_axes[axis_name][selected_option] + "\n\n"
+
         # Add a dominant cognitive function
         personality += "**Dominant Cognitive Function**\n"
-        func_name = random.choice(list(cognitive_functions.keys()))
-        personality += cognitive_functions[func_name] + "\n\n"
-        
+        personality += cognitive_functions[selection["function"]] + "\n\n"
+
         # Add personality archetype
         personality += "**Personality Archetype**\n"
-        archetype_name = random.choice(list(personality_archetypes.keys()))
+        archetype_name = selection["archetype"]
         personality += f"{archetype_name}\n"
         personality += personality_archetypes[archetype_name] + "\n\n"
-        
+
         personality += "## SPECIFIC DIMENSIONS\n\n"
-    
-    # Randomly select dimensions to include
-    all_dimensions = list(dimensions.keys())
-    selected_dimensions = random.sample(all_dimensions, min(num_dimensions, len(all_dimensions)))
-    
-    for dimension in selected_dimensions:
+
+    for dimension, trait_indices in selection["dimensions"]:
         traits = dimensions[dimension]
-        selected_traits = random.sample(traits, min(traits_per_dimension, len(traits)))
-        
+
         personality += f"### {dimension}\n"
-        for trait in selected_traits:
-            personality += trait + "\n\n"
-    
+        for idx in trait_indices:
+            personality += traits[idx] + "\n\n"
+
     personality += "### Synthesis\n"
     personality += "These dimensions form your complete working identity. You don't recite them or mechanically apply them—you embody them naturally. They guide the countless micro-decisions in each response. When dimensions conflict, you use judgment to balance competing values. You remain true to core principles while adapting flexibly to each unique conversation and person."
-    
+
     return personality
 
+def generate_ai_personality(num_dimensions=20, traits_per_dimension=1, include_mbti_style=True, seed=None):
+    """
+    Generate a comprehensive AI personality for system prompts.
+    
+    Args:
+        num_dimensions: Number of personality dimensions to include (1-100)
+        traits_per_dimension: Number of traits to include per dimension (1-4)
+        include_mbti_style: Whether to include Myers-Briggs inspired cognitive style (default True)
+        seed: Optional seed; the same seed always produces the same profile
+    """
+    rng = random.Random(seed) if seed is not None else None
+    selection = select_personality(num_dimensions, traits_per_dimension, include_mbti_style, rng=rng)
+    return render_personality(selection)
+
+def generate_personality_variants(count, seed=0, num_dimensions=20, traits_per_dimension=1, include_mbti_style=True):
+    """
+    Yield `count` seeded personality selections.
+
+    Each variant carries its own seed (drawn from `seed`), so any single
+    variant can be regenerated later without replaying the whole batch.
+    """
+    batch_rng = random.Random(seed)
+    for variant_id in range(count):
+        variant_seed = batch_rng.getrandbits(32)
+        selection = select_personality(
+            num_dimensions,
+            traits_per_dimension,
+            include_mbti_style,
+            rng=random.Random(variant_seed),
+        )
+        yield {"id": variant_id, "seed": variant_seed, **selection}
+
+def write_variant_index(path, variants):
+    """Write variants as one compact JSON object per line. Returns the number written."""
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for variant in variants:
+            f.write(json.dumps(variant, ensure_ascii=False, separators=(",", ":")) + "\n")
+            written += 1
+    return written
+
+def load_variant_index(path):
+    """Read a variant index written by write_variant_index()."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
 # Generate and save personality profile to file
 if __name__ == "__main__":
-    # Generate a personality profile with MBTI-inspired cognitive style
-    # Adjust parameters as needed:
-    # - num_dimensions: how many trait dimensions to include (1-100)
-    # - traits_per_dimension: how many traits per dimension (1-4)
-    # - include_mbti_style: whether to add Myers-Briggs cognitive framework
-    
-    include_mbti = True  # Set to False to disable MBTI-style section
-    
-    profile = generate_ai_personality(
-        num_dimensions=25, 
-        traits_per_dimension=1,
-        include_mbti_style=include_mbti
-    )
-    
-    # Save to file (overwrites if exists)
+    # Adjust parameters on the command line:
+    # - --num-dimensions: how many trait dimensions to include (1-100)
+    # - --traits-per-dimension: how many traits per dimension (1-4)
+    # - --no-mbti: drop the Myers-Briggs cognitive framework
+    # - --batch N: write N seeded variants to an index instead of one profile
+    # - --from-index/--variant: render a previously indexed variant as the profile
+    parser = argparse.ArgumentParser(description="Generate AI personality profiles")
+    parser.add_argument("--num-dimensions", type=int, default=25)
+    parser.add_argument("--traits-per-dimension", type=int, default=1)
+    parser.add_argument("--no-mbti", action="store_true", help="Disable the MBTI-style section")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible output")
+    parser.add_argument("--batch", type=int, default=0, help="Number of variants to write to --index")
+    parser.add_argument("--index", default="personality_variants.jsonl", help="Variant index file")
+    parser.add_argument("--from-index", default=None, help="Render a variant from this index file")
+    parser.add_argument("--variant", type=int, default=0, help="Variant id to render with --from-index")
+    args = parser.parse_args()
+
+    include_mbti = not args.no_mbti
+
+    if args.batch > 0:
+        seed = args.seed if args.seed is not None else random.getrandbits(32)
+        written = write_variant_index(args.index, generate_personality_variants(
+            args.batch,
+            seed=seed,
+            num_dimensions=args.num_dimensions,
+            traits_per_dimension=args.traits_per_dimension,
+            include_mbti_style=include_mbti,
+        ))
+        print(f"✓ {written} personality variants saved to '{args.index}'")
+        print(f"  Batch seed: {seed}")
+        raise SystemExit(0)
+
+    if args.from_index:
+        selection = next((v for v in load_variant_index(args.from_index) if v["id"] == args.variant), None)
+        if selection is None:
+            parser.error(f"unknown variant {args.variant} in {args.from_index}")
+    else:
+        seed = args.seed if args.seed is not None else random.getrandbits(32)
+        selection = {"id": None, "seed": seed, **select_personality(
+            num_dimensions=args.num_dimensions,
+            traits_per_dimension=args.traits_per_dimension,
+            include_mbti_style=include_mbti,
+            rng=random.Random(seed),
+        )}
+    profile = render_personality(selection)
+    
+    # Save to file (overwrites if exists), along with a record of what was picked
     filename = "ai_personality_profile.txt"
     with open(filename, 'w', encoding='utf-8') as f:
         f.write(profile)
+    selection_filename = "ai_personality_profile.json"
+    with open(selection_filename, 'w', encoding='utf-8') as f:
+        json.dump(selection, f, ensure_ascii=False, indent=2)
     
-    print(f"✓ Personality profile saved to '{filename}'")
+    print(f"✓ Personality profile saved to '{filename}' (selection in '{selection_filename}')")
+    print(f"  Seed: {selection['seed']}")
     print(f"  Dimensions included: {profile.count('###') - 1}")
     print(f"  File size: {len(profile)} characters")
-    print(f"  MBTI-style included: {include_mbti}")
+    print(f"  MBTI-style included: {'mbti' in selection}")
     print("\nPreview:")
     print("="*70)
     # Show the MBTI section in preview
@@ -546,4 +649,4 @@ if __name__ == "__main__":
     if preview_end > 0:
         print(profile[:preview_end] + "...\n[+ " + str(profile.count('###') - 1) + " additional dimensions]")
     else:
-        print(profile[:500] + "...")
\ No newline at end of file
+        print(profile[:500] + "...")
@@ -0,0 +1,113 @@
+import threading
+import time
+
+# Micro-batching of tag requests.
+#
+# Every tag request is the same instruction plus one transcript, and they
+# are short and frequent. TagBatcher holds a request for up to window_s;
+# requests for the same key (endpoint and system prompt) arriving in that
+# window go out as ONE completion over numbered transcripts, and the
+# numbered lists in the reply are handed back to their callers. The
+# instruction is prefilled once per batch and the batch takes one server
+# slot instead of one each. Decoding the lists is sequential, so batches
+# are capped at max_items.
+#
+# There is no worker thread: the first caller of a batch waits out the
+# window and sends it, the others wait for it. An item the batched reply
+# has no list for (or a failed batch) is retried by its own caller with
+# the single-transcript request, which also surfaces any error to it.
+
+def batch_tag_prompt(transcripts, max_tags):
+    """User message asking for one numbered tag list per transcript."""
+    count = len(transcripts)
+    lines = "\n".join(f"{number}: [\"tag1\", \"tag2\", ...]" for number in range(1, min(count, 2) + 1))
+    return (
+        f"You will receive {count} numbered chat transcripts.\n"
+        f"For EACH transcript produce a Python list of at most {max_tags} detailed tags that uniquely identify that chat.\n"
+        "Tags must be strings, lowercase, and specific.\n"
+        "Output exactly one line per transcript, in order, strictly as:\n"
+        f"{lines}\n"
+        + "".join(f"\n### Transcript {number}\n{text}\n" for number, text in enumerate(transcripts, 1))
+    )
+
+class _Request:
+    __slots__ = ("transcript", "result", "done")
+
+    def __init__(self, transcript):
+        self.transcript = transcript
+        self.result = None
+        self.done = threading.Event()
+
+class TagBatcher:
+    """Coalesces concurrent tag requests for the same key into batched requests.
+
+    send_one(key, transcript) makes the usual single request and returns
+    its result; send_batch(key, transcripts) makes one batched request and
+    returns a result per transcript, None where it has none. window_s and
+    max_items may be changed at any time; window_s 0 sends every request
+    on its own.
+    """
+
+    def __init__(self, send_one, send_batch, window_s=0.005, max_items=8):
+        self._send_one = send_one
+        self._send_batch = send_batch
+        self.window_s = float(window_s)
+        self.max_items = int(max_items)
+        self._cond = threading.Condition()
+        # key -> requests waiting for the batch their first caller will send
+        self._pending = {}
+        self.batches = 0
+        self.batched_items = 0
+        self.retried_items = 0
+
+    def tag(self, key, transcript):
+        """Result for one transcript, sent alone or as part of a batch."""
+        request = _Request(transcript)
+        with self._cond:
+            batch = self._pending.setdefault(key, [])
+            batch.append(request)
+            if len(batch) >= max(1, self.max_items):
+                # Full: the next request starts a new batch
+                del self._pending[key]
+                self._cond.notify_all()
+            leader = batch[0] is request
+            if leader:
+                deadline = time.monotonic() + self.window_s
+                while self._pending.get(key) is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self._pending[key]
+                        break
+                    self._cond.wait(remaining)
+        if leader:
+            self._send(key, batch)
+        else:
+            request.done.wait()
+        if request.result is None:
+            if len(batch) > 1:
+                with self._cond:
+                    self.retried_items += 1
+            return self._send_one(key, transcript)
+        return request.result
+
+    def _send(self, key, batch):
+        if len(batch) == 1:
+            return
+        results = []
+        try:
+            results = list(self._send_batch(key, [request.transcript for request in batch]))
+        except Exception:
+            # Each caller retries alone and gets its own error, if any
+            pass
+        finally:
+            with self._cond:
+                self.batches += 1
+                self.batched_items += len(batch)
+            for request, result in zip(batch, results + [None] * len(batch)):
+                request.result = result
+                request.done.set()
+
+    def stats(self):
+        """{"batches", "batched_items", "retried_items"} so far."""
+        with self._cond:
+            return {"batches": self.batches, "batched_items": self.batched_items, "retried_items": self.retried_items}
@@ -0,0 +1,121 @@
+import argparse
+import glob
+import random
+import statistics
+import time
+from rich.console import Console
+from rich.table import Table
+
+from config import load_config
+from session_log import SessionLog
+from token_counting import CalibratedEstimator, HFBackend, ServerBackend, TiktokenBackend, TokenCounter
+
+def load_corpus(paths, sessions_dir=None, limit=0):
+    """Texts to count: chat messages from session logs plus any text files."""
+    texts = []
+    if sessions_dir:
+        for path in sorted(glob.glob(f"{sessions_dir}/*.log")):
+            log = SessionLog(path)
+            texts.extend(str(message.get("content", "")) for message in log.messages())
+            log.close()
+    for path in paths or []:
+        with open(path, 'r', encoding='utf-8') as f:
+            # One text per blank-line separated paragraph
+            texts.extend(p.strip() for p in f.read().split("\n\n"))
+    texts = [t for t in texts if t]
+    if limit > 0:
+        texts = texts[:limit]
+    return texts
+
+def synthetic_corpus(count=300, seed=0):
+    """Mixed prose/code/number texts for when no real corpus is given."""
+    rng = random.Random(seed)
+    words = ["the", "latency", "tokenizer", "context", "window", "prefill", "request", "because",
+             "ThreadPoolExecutor", "def", "return", "{", "}", "()", "12345", "0.25", "naïve", "café", "→", "日本語"]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(5, 400))) for _ in range(count)]
+
+def time_counts(counter, texts):
+    """(counts, cold seconds, warm seconds) for counting every text twice."""
+    t0 = time.perf_counter()
+    counts = counter.count_many(texts)
+    cold = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    counter.count_many(texts)
+    warm = time.perf_counter() - t0
+    return counts, cold, warm
+
+def relative_errors(counts, reference):
+    return [abs(c - r) / r for c, r in zip(counts, reference) if r]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare token counting backends for accuracy and speed")
+    parser.add_argument("--corpus", action="append", default=None, help="Text file to count (repeatable; paragraphs are texts)")
+    parser.add_argument("--sessions", default=None, help="Also count messages from session logs in this directory")
+    parser.add_argument("--limit", type=int, default=0, help="Only count the first N texts")
+    parser.add_argument("--server", default=None, help="Base URL whose /tokenize is the reference (defaults to conf.json baseurl[0])")
+    parser.add_argument("--hf", default=None, help="Hugging Face tokenizer to include (name or path)")
+    parser.add_argument("--mock", action="store_true", help="Use a local mock server as the reference")
+    args = parser.parse_args()
+
+    console = Console()
+
+    if args.mock:
+        from mock_servers import start_mock_llm_server
+        _, server_url = start_mock_llm_server()
+    elif args.server:
+        server_url = args.server
+    else:
+        server_url = load_config('conf.json')['baseurl'][0]
+
+    texts = load_corpus(args.corpus, args.sessions, args.limit) or synthetic_corpus()
+    console.print(f"[bold blue]Counting {len(texts)} texts ({sum(len(t) for t in texts)} chars); reference: {server_url}/tokenize[/bold blue]")
+
+    backends = [("server", ServerBackend(server_url)), ("tiktoken", TiktokenBackend())]
+    if args.hf:
+        backends.append(("hf", HFBackend(args.hf)))
+
+    rows = []
+    reference = None
+    for name, backend in backends:
+        counter = TokenCounter(backend)
+        counts, cold, warm = time_counts(counter, texts)
+        if counter.backend_error is not None:
+            console.print(f"[red]{name} failed: {type(counter.backend_error).__name__}; skipped[/red]")
+            continue
+        if reference is None:
+            reference = counts
+        rows.append((name, counts, cold, warm))
+
+    if reference is None:
+        raise SystemExit(1)
+
+    # Estimators: fixed 4 chars/token, and calibrated on the first half
+    # against the reference then scored on the held-out second half
+    half = len(texts) // 2
+    fixed = CalibratedEstimator()
+    rows.append(("estimate 4.0", [fixed.count(t) for t in texts], None, None))
+    calibrated = CalibratedEstimator()
+    for text, tokens in zip(texts[:half], reference[:half]):
+        calibrated.observe(text, tokens)
+    t0 = time.perf_counter()
+    held_out = [calibrated.count(t) for t in texts[half:]]
+    elapsed = time.perf_counter() - t0
+    rows.append((f"calibrated {calibrated.chars_per_token:.2f}", [None] * half + held_out, elapsed, None))
+
+    table = Table(title="Token counting backends (error vs reference, lower is better)")
+    for column in ["backend", "total tokens", "mean err %", "p95 err %", "cold ms/text", "cached ms/text"]:
+        table.add_column(column, justify="right")
+    for name, counts, cold, warm in rows:
+        pairs = [(c, r) for c, r in zip(counts, reference) if c is not None]
+        errors = sorted(relative_errors([c for c, _ in pairs], [r for _, r in pairs]))
+        p95 = errors[int(0.95 * (len(errors) - 1))] if errors else None
+        table.add_row(
+            name,
+            str(sum(c for c, _ in pairs)) + ("" if len(pairs) == len(texts) else " (held out)"),
+            f"{100 * statistics.mean(errors):.1f}" if errors else "-",
+            f"{100 * p95:.1f}" if p95 is not None else "-",
+            f"{1000 * cold / len(pairs):.3f}" if cold is not None and pairs else "-",
+            f"{1000 * warm / len(pairs):.3f}" if warm is not None and pairs else "-",
+        )
+    console.print(table)
+    console.print("[dim]The calibrated estimator is scored on the second half only, after observing the first.[/dim]")
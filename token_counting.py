@@ -0,0 +1,280 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import tiktoken
+
+# Token counting that matches the model actually being served.
+#
+#   server    POST {server}/tokenize (llama.cpp), uncached texts counted
+#             concurrently over one keep-alive session
+#   hf        a locally loaded Hugging Face tokenizer (optional dependency)
+#   tiktoken  cl100k_base, the old behaviour
+#   estimate  characters / calibrated chars-per-token ratio, no tokenizer
+#
+# Exact counts are cached by text digest, and every exact count also
+# recalibrates the estimator, which is what the counter falls back to when
+# its backend is unreachable. A failed backend is retried after retry_s, so
+# a server restart does not leave the session on the estimate.
+
+# Chat template overhead per message, as count_tokens has always assumed
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+class CalibratedEstimator:
+    """chars / ratio estimate, with the ratio tracked from real counts."""
+
+    def __init__(self, chars_per_token=4.0):
+        self.chars_per_token = chars_per_token
+        self._chars = 0
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def observe(self, text, tokens):
+        if tokens <= 0 or not text:
+            return
+        with self._lock:
+            # Running totals weight long texts more, which is where errors cost most
+            self._chars += len(text)
+            self._tokens += tokens
+            self.chars_per_token = self._chars / self._tokens
+
+    def count(self, text):
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+class TiktokenBackend:
+    name = "tiktoken"
+
+    def __init__(self, encoding="cl100k_base"):
+        self.encoding_name = encoding
+        self._encoding = None
+
+    def count_many(self, texts):
+        if self._encoding is None:
+            # Loaded on first use: tiktoken may need to download the encoding
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return [len(self._encoding.encode(text)) for text in texts]
+
+class ServerBackend:
+    """Counts with the inference server's own tokenizer via /tokenize."""
+
+    name = "server"
+
+    def __init__(self, baseurl, timeout=5, concurrency=8):
+        self.baseurl = baseurl
+        root = baseurl.rstrip("/")
+        self.url = (root[:-3] if root.endswith("/v1") else root) + "/tokenize"
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _count(self, text):
+        r = self._session.post(self.url, json={"content": text, "add_special": False}, timeout=self.timeout)
+        r.raise_for_status()
+        data = r.json()
+        if "count" in data:
+            return int(data["count"])
+        return len(data["tokens"])
+
+    def count_many(self, texts):
+        if len(texts) == 1:
+            return [self._count(texts[0])]
+        return list(self._pool.map(self._count, texts))
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self._session.close()
+
+class HFBackend:
+    """Counts with a local Hugging Face tokenizer (needs `transformers`)."""
+
+    name = "hf"
+
+    def __init__(self, name_or_path):
+        try:
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("tokenizer_backend 'hf' needs the transformers package") from e
+        self._tokenizer = AutoTokenizer.from_pretrained(name_or_path)
+
+    def count_many(self, texts):
+        return [len(ids) for ids in self._tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+class TokenCounter:
+    """Cached token counts from an exact backend, with a calibrated fallback."""
+
+    def __init__(self, backend=None, cache_size=4096, retry_s=30.0):
+        self.backend = backend
+        self.estimator = CalibratedEstimator()
+        self.cache_size = cache_size
+        self.retry_s = retry_s
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # Last backend failure; cleared by the next success
+        self.backend_error = None
+        self._retry_at = 0.0
+
+    @property
+    def name(self):
+        if self.backend is None:
+            return "estimate"
+        return self.backend.name if self.backend_error is None else f"estimate ({self.backend.name} failed)"
+
+    def count_many(self, texts, local=False):
+        """Token counts for a list of texts, one backend round for all cache misses.
+
+        With `local` cache misses are estimated instead, without the backend.
+        """
+        counts = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                if not text:
+                    counts[i] = 0
+                    continue
+                key = _digest(text)
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    counts[i] = cached
+                else:
+                    missing.setdefault(text, []).append(i)
+        if not missing:
+            return counts
+
+        unique = list(missing)
+        exact = None
+        if self.backend is not None and not local and time.monotonic() >= self._retry_at:
+            try:
+                exact = self.backend.count_many(unique)
+                self.backend_error = None
+            except Exception as e:
+                # Estimate until retry_s has passed, then try the backend again
+                self.backend_error = e
+                self._retry_at = time.monotonic() + self.retry_s
+        if exact is None:
+            for text in unique:
+                for i in missing[text]:
+                    counts[i] = self.estimator.count(text)
+            return counts
+
+        with self._lock:
+            for text, tokens in zip(unique, exact):
+                self._cache[_digest(text)] = tokens
+                for i in missing[text]:
+                    counts[i] = tokens
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for text, tokens in zip(unique, exact):
+            self.estimator.observe(text, tokens)
+        return counts
+
+    def configure(self, conf):
+        """Follow a reloaded conf: the server backend counts on baseurl[0] unless tokenizer_server_url is set."""
+        backend = self.backend
+        if not isinstance(backend, ServerBackend) or backend.baseurl == tokenizer_server_url(conf):
+            return
+        self.backend = ServerBackend(tokenizer_server_url(conf), timeout=backend.timeout)
+        backend.close()
+        with self._lock:
+            # Another server may serve another model
+            self._cache.clear()
+        self.backend_error = None
+        self._retry_at = 0.0
+
+    def count(self, text, local=False):
+        return self.count_many([text], local)[0]
+
+    def count_messages(self, messages, local=False):
+        """Total tokens of chat messages, including per-message overhead."""
+        texts = [str(value) for message in messages for value in message.values()]
+        return len(messages) * MESSAGE_OVERHEAD_TOKENS + sum(self.count_many(texts, local))
+
+def tokenizer_server_url(conf):
+    return conf['tokenizer_server_url'] or conf['baseurl'][0]
+
+def load_token_counter(conf):
+    """Build the counter for conf['tokenizer_backend'] (default "tiktoken")."""
+    backend_name = conf['tokenizer_backend']
+    if backend_name == "server":
+        backend = ServerBackend(tokenizer_server_url(conf), timeout=float(conf['tokenizer_timeout_s']))
+    elif backend_name == "hf":
+        backend = HFBackend(conf['tokenizer_hf_name'])
+    elif backend_name == "estimate":
+        backend = None
+    else:
+        backend = TiktokenBackend(conf['tokenizer_tiktoken_encoding'])
+    return TokenCounter(backend, cache_size=int(conf['tokenizer_cache_size']), retry_s=float(conf['tokenizer_retry_s']))
+
+def _usage_value(usage, key):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(key)
+    return getattr(usage, key, None)
+
+class TokenLedger:
+    """Prompt/completion tokens per stage, per turn and per session.
+
+    Counts come from the server's `usage` block; only when a call has none
+    (older servers, cancelled streams) are they counted locally.
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+        self._lock = threading.Lock()
+        # stage -> {"prompt", "completion", "calls", "estimated"}
+        self.session = {}
+        self.turn = {}
+
+    def record(self, stage, usage=None, messages=None, completion="", local=False):
+        """Add one call; returns (prompt_tokens, completion_tokens).
+
+        With `local` whatever `usage` lacks is counted without a backend
+        round trip (cached counts or the estimate), for callers that must
+        not wait on /tokenize.
+        """
+        prompt_tokens = _usage_value(usage, "prompt_tokens")
+        completion_tokens = _usage_value(usage, "completion_tokens")
+        estimated = prompt_tokens is None or completion_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = self.counter.count_messages(messages, local) if messages else 0
+        if completion_tokens is None:
+            completion_tokens = self.counter.count(completion, local) if completion else 0
+        with self._lock:
+            for totals in (self.session, self.turn):
+                entry = totals.setdefault(stage, {"prompt": 0, "completion": 0, "calls": 0, "estimated": 0})
+                entry["prompt"] += prompt_tokens
+                entry["completion"] += completion_tokens
+                entry["calls"] += 1
+                entry["estimated"] += estimated
+        return prompt_tokens, completion_tokens
+
+    def pop_turn(self):
+        """Return and reset the per-stage counts for this turn."""
+        with self._lock:
+            turn, self.turn = self.turn, {}
+        return turn
+
+    def session_totals(self):
+        """(prompt, completion, calls) over the whole session."""
+        with self._lock:
+            entries = list(self.session.values())
+        return (
+            sum(e["prompt"] for e in entries),
+            sum(e["completion"] for e in entries),
+            sum(e["calls"] for e in entries),
+        )
+
+def format_ledger(stages):
+    """'chat 1200→350 · tagging 310→24*' (prompt→completion, * = counted locally)."""
+    return " · ".join(
+        f"{stage} {e['prompt']}→{e['completion']}{'*' if e['estimated'] else ''}"
+        for stage, e in stages.items()
+    )